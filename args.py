@@ -1,12 +1,13 @@
 import argparse
 import json
+import os
 
 debug=False
 
 TYPE_SEQ2SEQ = "seq2seq"
 TYPE_CAUSAL  = "causal"
 
-def parse_args():
+def parse_args(argv: list[str] = None):
 	default_parser = "goparser"
 	default_model = "./ft-models/starcoder"
 	default_type = TYPE_CAUSAL
@@ -19,18 +20,36 @@ def parse_args():
 	default_split = "\n\n###\n\n"
 	default_debug = False
 	default_device_map = "auto"
+	default_batch_size = 1
+	default_concurrency = 0
+	default_cache_size = 1024
+	default_feedback_time = 60
+	default_feedback_rounds = 5
+	default_dedup = 0.8
 
 	parser = argparse.ArgumentParser()
 
-	parser.add_argument("--config", "-c", required=True,
-					 help="generate config json file.")
+	parser.add_argument("--config", "-c", required=True, nargs="+",
+					 help="generate config json file(s). Multiple configs reuse the parsed and encoded prompt, each config is saved in <corpus>/<config name>.")
+
+	parser.add_argument("--repeat", "-r", type=int, default=1,
+					 help="number of runs of each config, each run is saved in <corpus>/<config name>_<run>. Default is 1.")
 
 	parser.add_argument("--parser", "-p", default=default_parser,
 					 help=f"source code parser binary. Default is '{default_parser}'.")
 
+	parser.add_argument("--parser-daemon", "-P", action="store_true", default=False,
+					 help="keep a single parser process (-serve) running for all targets.")
+
+	parser.add_argument("--parser-cache", default=None,
+					 help="directory of the parser output cache, keyed by the package source files. Default is no cache.")
+
 	parser.add_argument("--model", "-m", default=default_model,
 					 help=f"name of the LLM model to be used for seed generation. Default is '{default_model}'.")
 
+	parser.add_argument("--draft-model", default=None,
+					 help="small model of the same family (same tokenizer) for assisted generation with HuggingFace models, e.g. Salesforce/codegen-350M-multi. Not for beam search. Default is no draft model.")
+
 	parser.add_argument("--type", "-t", default=default_type,
 					 help=f"model type '{TYPE_CAUSAL}' or '{TYPE_SEQ2SEQ}'. Default is '{default_type}'.")
 
@@ -49,45 +68,152 @@ def parse_args():
 	parser.add_argument("--legacy", "-L", action="store_true", default=default_legacy,
 					 help=f"enable legacy support (OpenAI). Default is {default_legacy}.")
 
+	parser.add_argument("--concurrency", type=int, default=default_concurrency,
+					 help=f"max concurrent OpenAI requests using the asyncio backend, 0 uses the blocking OpenAI client. Default is {default_concurrency}.")
+
+	parser.add_argument("--rpm", type=int, default=0,
+					 help="OpenAI requests per minute budget for the asyncio backend. Default is unlimited.")
+
+	parser.add_argument("--tpm", type=int, default=0,
+					 help="OpenAI tokens per minute budget for the asyncio backend. Default is unlimited.")
+
+	parser.add_argument("--stream", "-S", action="store_true", default=False,
+					 help="stream the model outputs and save each seed as soon as it is complete (not for beam search).")
+
 	parser.add_argument("-n", type=int, default=default_n,
 					 help=f"number of model return sequences. Default is {default_n}.")
 
 	parser.add_argument("--func", "-f", default=default_func,
-					 help=f"name of the Fuzz function. Default is '{default_func}'.")
+					 help=f"name of the Fuzz function, '*' for all Fuzz functions of the package. Default is '{default_func}'.")
 
 	parser.add_argument("--corpus",  "-d", default=default_corpus,
 					 help=f"corpus directory. Default is '{default_corpus}'.")
 
+	parser.add_argument("--shard", action="store_true", default=False,
+					 help="store seeds in SHA1 prefix subdirectories of the corpus directory (see corpus.py export).")
+
+	parser.add_argument("--dedup", type=float, nargs="?", const=default_dedup, default=None,
+					 help=f"skip seeds that are near-duplicates (estimated byte n-gram similarity at least this threshold) of a seed in the corpus. Default (without value) is {default_dedup}.")
+
+	parser.add_argument("--manifest", "-M", default=None,
+					 help="batch mode manifest json file with a list of targets to generate seeds for in one run. Default is a single target.")
+
+	parser.add_argument("--batch-size", "-b", type=int, default=default_batch_size,
+					 help=f"number of manifest targets generated in one batch. Default is {default_batch_size}.")
+
+	parser.add_argument("--feedback", default=None,
+					 help="libFuzzer binary of the target. Fuzz the generated corpus and generate more seeds in the style of the seeds that add coverage until coverage stops growing. Default is no feedback loop.")
+
+	parser.add_argument("--feedback-time", type=int, default=default_feedback_time,
+					 help=f"fuzzing time in seconds per feedback round. Default is {default_feedback_time}.")
+
+	parser.add_argument("--feedback-rounds", type=int, default=default_feedback_rounds,
+					 help=f"max number of feedback generation rounds. Default is {default_feedback_rounds}.")
+
+	parser.add_argument("--feedback-configs", nargs="+", default=None,
+					 help="generate config json files used in turn by the feedback rounds. Default is the --config files.")
+
 	parser.add_argument("--split", "-s", default=default_split,
 					 help="split string for causal model inference without prompt tuning. Default is {}.".
 						format(json.dumps(default_split)))
 
+	parser.add_argument("--cache", default=None,
+					 help="directory of the persistent model response cache. Default is no cache.")
+
+	parser.add_argument("--cache-size", type=int, default=default_cache_size,
+					 help=f"max response cache size in MB, least recently used responses are evicted. Default is {default_cache_size}.")
+
+	parser.add_argument("--no-cache", action="store_true", default=False,
+					 help="bypass the response cache (e.g. for sampling runs).")
+
+	parser.add_argument("--no-prefix-cache", action="store_true", default=False,
+					 help="do not reuse the encoded prompt of HuggingFace models across configs and repetitions.")
+
+	parser.add_argument("--no-progress", action="store_true", default=False,
+					 help="disable the generation progress output of HuggingFace models.")
+
 	parser.add_argument("--debug", "--verbose", "-v", action="store_true", default=default_debug,
 					 help=f"print debug output to debug.out. Default is {default_debug}.")
 
+	parser.add_argument("--report", default=None,
+					 help="write a JSON report with the time of each stage, tokens/s, peak RSS, OpenAI token usage and seeds per target and run.")
+
+	parser.add_argument("--profile", default=None,
+					 help="profile the run with cProfile and save the stats to this file.")
+
+	parser.add_argument("--torch-profile", default=None,
+					 help="profile the run with torch.profiler and save the Chrome trace to this file.")
+
+	parser.add_argument("--cpu-optimize", nargs="?", const="auto", default=None, choices=["auto", "int8", "bf16"],
+					 help="CPU inference without CUDA: dynamic int8 quantization of the linear layers or bf16 weights. Default (without value) is auto, bf16 if the CPU supports it natively.")
+
+	parser.add_argument("--threads", type=int, default=0,
+					 help="number of CPU inference threads with --cpu-optimize. Default is all available cores.")
+
+	parser.add_argument("--workers", type=int, default=1,
+					 help="number of forked CPU generation processes for HuggingFace models, each pinned to its own cores/socket and generating a part of the sequences. Default is 1 (no workers).")
+
 	parser.add_argument("--device-map", default=default_device_map,
 					 help=f"HuggingFace device_map. Default is '{default_device_map}'.")
 
-	args = parser.parse_args()
+	args = parser.parse_args(argv)
 	if args.type not in [TYPE_CAUSAL, TYPE_SEQ2SEQ]:
 		raise Exception("Invalid type")
 
-	with open(args.config) as json_file:
-		generate_args = json.load(json_file)
-
 	if args.prompt_tuning != default_prompt_tuning:
 		with open(args.prompt_tuning) as json_file:
 			args.prompt_tuning = json.load(json_file)
 	else:
 		args.prompt_tuning = False
 
-	generate_args['n'] = args.n
+	if args.batch_size < 1:
+		raise Exception("Invalid batch size")
+
+	if args.manifest:
+		with open(args.manifest) as json_file:
+			args.manifest = json.load(json_file)
+		if not isinstance(args.manifest, list) or len(args.manifest) == 0:
+			raise Exception("Manifest must be a non-empty list of targets")
+
+	if args.workers < 1:
+		raise Exception("Invalid number of workers")
+
+	if args.repeat < 1:
+		raise Exception("Invalid repeat count")
+
+	runs = load_runs(args.config, args.repeat, args.n)
+
+	if args.dedup is not None and (args.dedup <= 0 or args.dedup > 1):
+		raise Exception("Invalid dedup threshold, must be between 0 and 1")
+
+	if args.feedback_rounds < 0 or args.feedback_time < 0:
+		raise Exception("Invalid feedback rounds or time")
 
 	if args.debug:
 		global debug
 		debug = open('debug.out', 'w')
 
-	return args, generate_args
+	return args, runs
+
+def load_runs(configs: list[str], repeat: int, n: int) -> list[tuple]:
+	"""
+	Returns a (name, generate_args) tuple for each repetition of each generate config file.
+	The name is None for a single run, otherwise <config name> or <config name>_<run> (as in the experiment scripts).
+	"""
+
+	runs = []
+	for config in configs:
+		with open(config) as json_file:
+			generate_args = json.load(json_file)
+		generate_args['n'] = n
+
+		name = os.path.basename(config)
+		for i in range(repeat):
+			runs.append((f"{name}_{i+1}" if repeat > 1 else name, generate_args))
+
+	if len(runs) == 1:
+		return [(None, runs[0][1])]
+	return runs
 
 def printd(v: str):
 	if debug:
@@ -0,0 +1,84 @@
+#!/bin/python3
+# Compares plain and assisted (--draft-model) HuggingFace generation: tokens/s and unique seed yield per sampling config.
+# Example: ./bench_assisted.py -m Salesforce/codegen-2B-multi --draft-model Salesforce/codegen-350M-multi --device-map=cpu
+import argparse
+import glob
+import os
+import sys
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root)
+from args import parse_args
+import init
+
+source_code = """func FuzzParseURL(f *testing.F) {
+	f.Fuzz(func(t *testing.T, raw string) {
+		u, err := url.Parse(raw)
+		if err != nil {
+			return
+		}
+		if u.String() == "" {
+			t.Fatal("empty url")
+		}
+	})
+}"""
+
+def run(args, generate_args, tokenizer, isOpenAI, seq2seq, processor, model, draft_model, input_ids, system_ids) -> tuple[int, float, set]:
+	generator = init.generator(args, generate_args, model, tokenizer, isOpenAI, seq2seq, processor.stop_token(), None, draft_model)
+	tokens = 0
+	seeds = set()
+	start = time.perf_counter()
+	for output in generator.generate(input_ids, system_ids):
+		tokens += len(tokenizer.encode(output, add_special_tokens=False))
+		seeds.update(processor.extract(output))
+	return tokens, time.perf_counter() - start, seeds
+
+def main():
+	parser = argparse.ArgumentParser(allow_abbrev=False)
+	parser.add_argument("--configs", nargs="+", default=[c for c in sorted(glob.glob(os.path.join(root, "configs", "*.json"))) if "beam" not in c],
+					 help="sampling config json files. Default is all configs except beam search.")
+	parser.add_argument("--pt-config", default=os.path.join(root, "pt_configs", "go", "code_only", "code.json"),
+					 help="prompt-tuning config json file. Default is go/code_only/code.json.")
+	parser.add_argument("--source", default=None,
+					 help="source code file for the prompt. Default is a small Fuzz function.")
+	parser.add_argument("--repeat", type=int, default=1,
+					 help="number of runs of each config and path. Default is 1.")
+	bench_args, seedai_argv = parser.parse_known_args()
+
+	# The remaining args (model, draft model, -n, -g, device map ...) are seedai.py args
+	args, runs = parse_args(["-c"] + bench_args.configs + ["-pt", bench_args.pt_config, "--no-progress"] + seedai_argv)
+	if not args.draft_model:
+		sys.exit("--draft-model is required")
+
+	code = source_code
+	if bench_args.source:
+		with open(bench_args.source) as file:
+			code = file.read()
+
+	tokenizer, isOpenAI, seq2seq = init.tokenizer(args)
+	if isOpenAI:
+		sys.exit("Assisted generation requires a HuggingFace model")
+	processor = init.processor(args, seq2seq, tokenizer, isOpenAI)
+	model = init.model(args, isOpenAI)
+	draft_model = init.draft_model(args, isOpenAI)
+	input_ids, system_ids = processor.encode(code, ["FuzzParseURL"])
+	max_new_tokens = args.gen_length if args.gen_length > 0 else 128
+
+	print(f"{'config':<24} {'path':<9} {'tokens/s':>9} {'seeds':>6}")
+	for name, generate_args in runs:
+		generate_args = dict(generate_args, max_new_tokens=max_new_tokens)
+		results = {}
+		for path, draft in [("plain", None), ("assisted", draft_model)]:
+			tokens, seconds, seeds = 0, 0.0, set()
+			for _ in range(bench_args.repeat):
+				t, s, new_seeds = run(args, generate_args, tokenizer, isOpenAI, seq2seq, processor, model, draft, input_ids, system_ids)
+				tokens += t
+				seconds += s
+				seeds |= new_seeds
+			results[path] = tokens / max(seconds, 1e-9)
+			print(f"{name or os.path.basename(args.config[0]):<24} {path:<9} {results[path]:>9.1f} {len(seeds):>6}")
+		print(f"{'':<24} {'speedup':<9} {results['assisted']/max(results['plain'], 1e-9):>8.2f}x")
+
+if __name__ == "__main__":
+	main()
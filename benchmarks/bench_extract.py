@@ -0,0 +1,87 @@
+#!/bin/python3
+# Compares the single-pass literal scanner with the previous per-line extract_values/extract_value/ast implementation.
+import ast
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data_processor import scan_values, parse_escaped
+
+def legacy_extract_values(line: str, multi_vals: bool) -> list[str]:
+	values = []
+
+	value, i = legacy_extract_value(line)
+	if value != "":
+		values.append(value)
+
+	if not multi_vals or i == -1:
+		return values
+
+	while True:
+		line = line[i+1:]
+		value, i = legacy_extract_value(line)
+		if value != "":
+			values.append(value)
+		if i == -1:
+			break
+
+	return values
+
+def legacy_extract_value(line: str) -> str:
+	stringType = '"'
+	start = line.find('"')
+	startBT = line.find('`')
+	if start == -1 or (startBT != -1 and startBT < start):
+		start = startBT
+		stringType = '`'
+	if start == -1:
+		return "", -1
+	start += 1
+
+	for i in range(start, len(line)):
+		if line[i] == stringType and (i == 0 or line[i-1] != '\\'):
+			return line[start:i], i
+
+	return "", -1
+
+def legacy_parse_escaped(value):
+	try:
+		return ast.literal_eval('"'+value+'"')
+	except SyntaxError:
+		return value
+
+def legacy_extract(output: str, multi_vals: bool) -> list[str]:
+	seeds = []
+	for line in output.splitlines():
+		for seed in legacy_extract_values(line, multi_vals):
+			seed = legacy_parse_escaped(seed)
+			if len(seed) > 0:
+				seeds.append(seed)
+	return seeds
+
+def extract(output: str, multi_vals: bool) -> list[str]:
+	seeds = []
+	for seed in scan_values(output, multi_vals):
+		seed = parse_escaped(seed)
+		if len(seed) > 0:
+			seeds.append(seed)
+	return seeds
+
+def outputs():
+	values = ['GET /index.html HTTP/1.1', 'a\\"b\\"c', '\\x00\\xff\\n', 'NL91ABNA0417164300', '<a href=\\"x\\">y</a>', 'long value '*20]
+	# Many short lines, like single value prompts
+	short = "\n".join(f'"{values[i % len(values)]}{i}"' for i in range(20000))
+	# One long line, like []string{...} multi value prompts
+	long = "[]string{" + ", ".join(f'"{values[i % len(values)]}{i}", `raw {i}`' for i in range(5000)) + "}"
+	return {"short lines": short, "long line": long}
+
+def main():
+	for name, output in outputs().items():
+		assert legacy_extract(output, True) == extract(output, True)
+		legacy = min(timeit.repeat(lambda: legacy_extract(output, True), number=1, repeat=3))
+		new = min(timeit.repeat(lambda: extract(output, True), number=1, repeat=3))
+		print(f"{name}: legacy {legacy*1000:.1f} ms, scanner {new*1000:.1f} ms, speedup {legacy/new:.1f}x")
+
+if __name__ == "__main__":
+	main()
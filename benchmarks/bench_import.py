@@ -0,0 +1,54 @@
+#!/bin/python3
+# Measures the startup time of seedai.py (import and --help) and the modules it loads at import time.
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+heavy_modules = ["torch", "transformers", "peft", "openai", "tiktoken"]
+
+def run(args: list[str]) -> float:
+	start = time.perf_counter()
+	subprocess.run([sys.executable] + args, cwd=root, check=True, capture_output=True)
+	return time.perf_counter() - start
+
+def import_times(module: str) -> dict[str, int]:
+	"""
+	Returns the cumulative import time in microseconds of each top-level module imported by module (python -X importtime).
+	"""
+
+	result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=root, check=True, capture_output=True, text=True)
+	times = {}
+	for line in result.stderr.splitlines():
+		if not line.startswith("import time:") or "|" not in line:
+			continue
+		_, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+		if cumulative.isdigit() and not name.startswith(" ") and "." not in name:
+			times[name] = int(cumulative)
+	return times
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--max-import-ms", type=float, default=500,
+					 help="fail if importing seedai takes longer. Default is 500.")
+	args = parser.parse_args()
+
+	times = import_times("seedai")
+	loaded = [m for m in heavy_modules if m in times]
+	import_ms = times.get("seedai", 0) / 1000
+	help_s = min(run(["seedai.py", "--help"]) for _ in range(3))
+
+	print(f"import seedai: {import_ms:.1f} ms")
+	print(f"seedai.py --help: {help_s*1000:.1f} ms")
+	for name, t in sorted(times.items(), key=lambda x: -x[1])[:5]:
+		print(f"	{name}: {t/1000:.1f} ms")
+
+	if len(loaded) > 0:
+		sys.exit(f"Regression: seedai imports {', '.join(loaded)} at startup")
+	if import_ms > args.max_import_ms:
+		sys.exit(f"Regression: importing seedai takes {import_ms:.1f} ms (max {args.max_import_ms} ms)")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,293 @@
+#!/bin/python3
+# Offline performance suite: per-stage and end-to-end throughput without real models or network, using tiny random
+# HuggingFace models, a fake goparser and a fake OpenAI endpoint (see fixtures.py). Benchmarks that need torch and
+# transformers are skipped when they are not installed.
+# Results are saved in results/<commit>.json, compare with an earlier commit: ./bench_suite.py --compare results/<commit>.json
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root)
+from args import load_runs
+from corpus import save_seeds
+from data_processor import PromptTuneProcessor
+from metrics import metrics
+import fixtures
+
+benchmarks = {}
+
+def benchmark(name: str, unit: str, higher_is_better: bool = True, requires: list[str] = []):
+	"""
+	Register a benchmark function, it returns the measured value or a (value, details dict) tuple.
+	"""
+
+	def register(func):
+		benchmarks[name] = {"func": func, "unit": unit, "higher_is_better": higher_is_better, "requires": requires}
+		return func
+	return register
+
+def best_time(func, repeat: int) -> float:
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return min(times)
+
+def pt_config(name: str) -> dict:
+	with open(os.path.join(root, "pt_configs", "go", name)) as file:
+		return json.load(file)
+
+def generate_args(n: int, max_new_tokens: int) -> dict:
+	_, args = load_runs([os.path.join(root, "configs", "temp_0.8.json")], 1, n)[0]
+	return dict(args, max_new_tokens=max_new_tokens)
+
+class Context:
+	"""
+	Fixtures shared by the benchmarks, created on first use in the suite's temporary directory.
+	"""
+
+	def __init__(self, tmp: str, repeat: int):
+		self.tmp = tmp
+		self.repeat = repeat
+		self.model_paths = None
+		self.loaded = {}
+
+	def models(self) -> dict[str, str]:
+		if self.model_paths is None:
+			self.model_paths = fixtures.tiny_models(os.path.join(self.tmp, "models"))
+		return self.model_paths
+
+	def load(self, model_type: str):
+		"""
+		Returns the (model, tokenizer, seq2seq) of a tiny model, loaded like seedai.py loads models.
+		"""
+
+		if model_type not in self.loaded:
+			from args import parse_args
+			import init
+			args, _ = parse_args(["-c", os.path.join(root, "configs", "temp_0.8.json"), "-m", self.models()[model_type],
+								  "-t", model_type, "-pt", os.path.join(root, "pt_configs", "go", "code.json")])
+			tokenizer, _, seq2seq = init.tokenizer(args)
+			self.loaded[model_type] = (init.model(args, False), tokenizer, seq2seq)
+		return self.loaded[model_type]
+
+@benchmark("encode", "prompts/s", requires=["transformers", "tokenizers"])
+def bench_encode(context):
+	tokenizer = fixtures.tiny_tokenizer()
+	processor = PromptTuneProcessor(tokenizer, False, 768, 1, **pt_config("code.json"))
+	source = fixtures.go_source(400) # Packed to the token budget
+	seconds = best_time(lambda: processor.encode(source, ["FuzzParse"]), context.repeat)
+	return 1 / seconds
+
+@benchmark("stop_criteria", "steps/s", requires=["torch", "transformers"])
+def bench_stop_criteria(context):
+	import torch
+	from hf_generator import StopTokenCriteria
+
+	rows, steps = 64, 512
+	input_ids = torch.randint(1, 500, (rows, steps))
+	input_ids[::2, steps//2] = 0 # Half of the rows stop halfway
+
+	def run():
+		criteria = StopTokenCriteria(0, 0, None)
+		for step in range(1, steps+1):
+			criteria(input_ids[:, :step], None)
+	return steps / best_time(run, context.repeat)
+
+def bench_generate(context, model_type: str):
+	from hf_generator import HFGenerator
+
+	model, tokenizer, seq2seq = context.load(model_type)
+	processor = PromptTuneProcessor(tokenizer, seq2seq, 768, 1, **pt_config("code.json"))
+	input_ids, system_ids = processor.encode(fixtures.go_source(20), ["FuzzParse"])
+	generator = HFGenerator(model, tokenizer, processor.stop_token(), seq2seq, False, **generate_args(8, 64))
+
+	tokens = metrics.counters.get("generated_tokens", 0)
+	seconds = 0.0
+	for _ in range(context.repeat):
+		start = time.perf_counter()
+		for _ in generator.generate_batch([(input_ids, system_ids)]*2):
+			pass
+		seconds += time.perf_counter() - start
+	return (metrics.counters["generated_tokens"] - tokens) / seconds
+
+@benchmark("generate_causal", "tokens/s", requires=["torch", "transformers", "tokenizers", "peft", "accelerate"])
+def bench_generate_causal(context):
+	return bench_generate(context, "causal")
+
+@benchmark("generate_seq2seq", "tokens/s", requires=["torch", "transformers", "tokenizers", "peft", "accelerate"])
+def bench_generate_seq2seq(context):
+	return bench_generate(context, "seq2seq")
+
+@benchmark("openai_async", "requests/s")
+def bench_openai(context):
+	from openai_async import AsyncOpenAIGenerator
+
+	tokenizer = fixtures.ByteTokenizer()
+	processor = PromptTuneProcessor(tokenizer, False, 4096, 1, **pt_config("code.json"))
+	prompt = processor.encode(fixtures.go_source(20), ["FuzzParse"])
+	with fixtures.FakeOpenAI() as server:
+		generator = AsyncOpenAIGenerator("gpt-4", tokenizer, "\n", False, concurrency=8, api_base=server.api_base, **generate_args(8, 64))
+		prompts = [prompt]*64
+		seconds = best_time(lambda: list(generator.generate_batch(prompts)), context.repeat)
+	return len(prompts) / seconds
+
+@benchmark("extract", "seeds/s")
+def bench_extract(context):
+	results = {}
+	for name, multi_vals in [("lines", False), ("multi_vals", True)]:
+		processor = PromptTuneProcessor(fixtures.ByteTokenizer(), False, 4096, 1, **pt_config("code_multi.json" if multi_vals else "code.json"))
+		output = fixtures.model_output(20000, multi_vals)
+		seeds = len(processor.extract(output))
+		results[name] = seeds / best_time(lambda: processor.extract(output), context.repeat)
+	return min(results.values()), {"lines": results["lines"], "multi_vals": results["multi_vals"]}
+
+def bench_save_seeds(context, count: int):
+	seeds = [f"{fixtures.values[i % len(fixtures.values)]}{i}" for i in range(count)]
+	seconds = []
+	for r in range(context.repeat):
+		corpus_dir = os.path.join(context.tmp, f"corpus_{count}_{r}")
+		start = time.perf_counter()
+		save_seeds(corpus_dir, seeds)
+		seconds.append(time.perf_counter() - start)
+	duplicates = best_time(lambda: save_seeds(corpus_dir, seeds), 1) # All seeds already exist
+	return count / min(seconds), {"duplicates_per_second": count / duplicates}
+
+@benchmark("save_seeds_10k", "seeds/s")
+def bench_save_seeds_10k(context):
+	return bench_save_seeds(context, 10000)
+
+@benchmark("save_seeds_100k", "seeds/s")
+def bench_save_seeds_100k(context):
+	return bench_save_seeds(context, 100000)
+
+@benchmark("dedup_100k", "seeds/s")
+def bench_dedup(context):
+	from dedup import NearDuplicateFilter
+
+	seeds = [f"{fixtures.values[i % len(fixtures.values)]}{i}" for i in range(100000)]
+	def run():
+		NearDuplicateFilter().filter(seeds)
+	return len(seeds) / best_time(run, context.repeat)
+
+@benchmark("end_to_end", "s", higher_is_better=False, requires=["torch", "transformers", "tokenizers", "peft", "accelerate"])
+def bench_end_to_end(context):
+	"""
+	seedai.py with the tiny causal model and the fake parser, the stage times are taken from its --report.
+	"""
+
+	parser = fixtures.write_goparser(os.path.join(context.tmp, "goparser"), fixtures.go_source(100))
+	seconds = []
+	for r in range(context.repeat):
+		work_dir = os.path.join(context.tmp, f"e2e_{r}")
+		os.makedirs(work_dir)
+		report_path = os.path.join(work_dir, "report.json")
+		start = time.perf_counter()
+		subprocess.run([sys.executable, os.path.join(root, "seedai.py"), "-m", context.models()["causal"], "-p", parser,
+						"-c", os.path.join(root, "configs", "temp_0.8.json"), "-pt", os.path.join(root, "pt_configs", "go", "code.json"),
+						"-n", "8", "-g", "64", "--no-progress", "--report", report_path],
+					   cwd=work_dir, check=True, capture_output=True)
+		seconds.append(time.perf_counter() - start)
+
+	with open(report_path) as file:
+		report = json.load(file)
+	stages = {name: stage["seconds"] for name, stage in report["stages"].items()}
+	return min(seconds), {"stages": stages, "decode_tokens_per_second": report["decode_tokens_per_second"], "max_rss_bytes": report["max_rss_bytes"]}
+
+def missing_modules(modules: list[str]) -> list[str]:
+	import importlib.util
+	return [m for m in modules if importlib.util.find_spec(m) is None]
+
+def git_commit() -> tuple[str, bool]:
+	try:
+		commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, check=True, capture_output=True, text=True).stdout.strip()
+		dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, check=True, capture_output=True, text=True).stdout.strip() != ""
+		return commit, dirty
+	except (OSError, subprocess.CalledProcessError):
+		return "unknown", False
+
+def compare(results: dict, old: dict, max_regression: float) -> list[str]:
+	"""
+	Print the change of every benchmark in both results, returns the benchmarks that got slower than max_regression.
+	"""
+
+	regressions = []
+	print()
+	print(f"Compared with {old['commit']} ({old['date']}):")
+	for name, result in results["benchmarks"].items():
+		if name not in old["benchmarks"]:
+			continue
+		old_value, value = old["benchmarks"][name]["value"], result["value"]
+		change = value/old_value - 1 if result["higher_is_better"] else old_value/value - 1 # Positive is faster
+		print(f"	{name:<18} {old_value:>12.1f} -> {value:>12.1f} {result['unit']:<10} {change*100:+6.1f}%")
+		if change < -max_regression:
+			regressions.append(name)
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(description="Run the offline benchmark suite and save the results per commit.")
+	parser.add_argument("--only", nargs="+", default=None, choices=list(benchmarks),
+					 help="benchmarks to run. Default is all.")
+	parser.add_argument("--repeat", type=int, default=3,
+					 help="number of runs of each benchmark, the best run is used. Default is 3.")
+	parser.add_argument("--output", default=None,
+					 help="results json file. Default is results/<commit>.json.")
+	parser.add_argument("--compare", default=None,
+					 help="results json file of an earlier run to compare with.")
+	parser.add_argument("--max-regression", type=float, default=0.2,
+					 help="fail if a benchmark is slower than the compared results by more than this fraction. Default is 0.2.")
+	args = parser.parse_args()
+
+	commit, dirty = git_commit()
+	results = {
+		"commit": commit + ("-dirty" if dirty else ""),
+		"date": datetime.datetime.now().isoformat(timespec='seconds'),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"cpus": len(os.sched_getaffinity(0)),
+		"benchmarks": {},
+		"skipped": {},
+	}
+	for module in ["torch", "transformers", "tokenizers"]:
+		if len(missing_modules([module])) == 0:
+			results[module] = __import__(module).__version__
+
+	with tempfile.TemporaryDirectory() as tmp:
+		context = Context(tmp, args.repeat)
+		for name in args.only or benchmarks:
+			bench = benchmarks[name]
+			missing = missing_modules(bench["requires"])
+			if len(missing) > 0:
+				results["skipped"][name] = f"{', '.join(missing)} not installed"
+				print(f"{name:<18} skipped ({results['skipped'][name]})")
+				continue
+
+			value = bench["func"](context)
+			details = {}
+			if isinstance(value, tuple):
+				value, details = value
+			results["benchmarks"][name] = dict(value=value, unit=bench["unit"], higher_is_better=bench["higher_is_better"], **details)
+			print(f"{name:<18} {value:>12.1f} {bench['unit']}", flush=True)
+
+	output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", f"{results['commit']}.json")
+	os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+	with open(output, "w") as file:
+		json.dump(results, file, indent=4)
+	print(f"Results saved to {output}")
+
+	if args.compare:
+		with open(args.compare) as file:
+			regressions = compare(results, json.load(file), args.max_regression)
+		if len(regressions) > 0:
+			sys.exit(f"Regression: {', '.join(regressions)} slower by more than {args.max_regression*100:.0f}%")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,154 @@
+# Offline fixtures for the benchmarks: parser-like Go source, a fake goparser, a fake OpenAI endpoint and
+# tiny randomly initialized HuggingFace models (causal and seq2seq) with a small BPE tokenizer trained on the Go source.
+import json
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+eos_token = "<|endoftext|>"
+extra_token = "<extra_id_0>" # Required by the T5 tokenizer setup in init.load_tokenizer
+values = ['GET /index.html HTTP/1.1', 'a\\"b\\"c', '\\x00\\xff\\n', 'NL91ABNA0417164300', '<a href=\\"x\\">y</a>', 'long value '*20]
+
+def go_source(funcs: int) -> str:
+	"""
+	Parser-like output: a Fuzz function calling a chain of helpers, a type and unused functions in a Go code fence.
+	"""
+
+	lines = ["```go", "// FuzzParse fuzzes parse0", "func FuzzParse(f *testing.F) {", f'\tf.Add("{values[0]}")',
+			 "\tf.Fuzz(func(t *testing.T, s string) { parse0(s) })", "}", "", "type Node struct {", "\tvalue int", "}", ""]
+	for i in range(funcs):
+		callee = f"parse{i+1}(s[1:])" if i % 2 == 0 else f"unused{i}(s)"
+		lines += [
+			f"// parse{i} parses byte {i}",
+			f"func parse{i}(s string) *Node {{",
+			f"\tif len(s) > 0 && s[0] == '{chr(ord('a') + i % 26)}' {{",
+			f"\t\treturn {callee}",
+			"\t}",
+			f"\treturn &Node{{value: {i}}}",
+			"}",
+			"",
+		]
+	lines.append("```")
+	return "\n".join(lines)
+
+def model_output(values_count: int, multi_vals: bool) -> str:
+	"""
+	Model output with string and raw string literals, one value per line or a []string{...} list.
+	"""
+
+	if multi_vals:
+		return ", ".join(f'"{values[i % len(values)]}{i}", `raw {i}`' for i in range(values_count)) + "}"
+	return "\n".join(f'"{values[i % len(values)]}{i}"' for i in range(values_count))
+
+def write_goparser(path: str, source: str) -> str:
+	"""
+	Write an executable fake goparser that answers -func (and -serve) requests with the given source.
+	"""
+
+	with open(path, "w") as file:
+		file.write("\n".join([
+			f"#!{sys.executable}",
+			"import json, sys",
+			f"source = {source!r}",
+			'if "-serve" in sys.argv:',
+			"\tfor line in sys.stdin:",
+			'\t\tprint(json.dumps({"code": source}), flush=True)',
+			"else:",
+			"\tprint(source)",
+			"",
+		]))
+	os.chmod(path, 0o755)
+	return path
+
+class ByteTokenizer:
+	"""
+	Tokenizer without dependencies for the OpenAI and extraction benchmarks, one token per character.
+	"""
+
+	eos_token = eos_token
+	eos_token_id = 0
+	model_max_length = 4096
+
+	def encode(self, text, truncation=False, max_length=-1, add_special_tokens=False):
+		tokens = [ord(c) for c in text]
+		return tokens[:max_length] if truncation else tokens
+
+	def decode(self, tokens):
+		return ''.join(chr(t) for t in tokens)
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+	def do_POST(self):
+		args = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+		legacy = not self.path.endswith("/chat/completions")
+		choices = []
+		for k in range(args.get('n', 1)):
+			content = model_output(8, False) + "\n"
+			choices.append({"index": k, "text": content} if legacy else {"index": k, "message": {"role": "assistant", "content": content}})
+
+		body = json.dumps({
+			"choices": choices,
+			"usage": {"prompt_tokens": 100, "completion_tokens": 50*len(choices), "total_tokens": 100 + 50*len(choices)},
+		}).encode('utf-8')
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+class FakeOpenAI:
+	"""
+	Local OpenAI compatible endpoint (chat and legacy completions), api_base is set while the context is active.
+	"""
+
+	def __enter__(self):
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenAIHandler)
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		self.api_base = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+		return self
+
+	def __exit__(self, *args):
+		self.server.shutdown()
+		self.server.server_close()
+
+def tiny_tokenizer(vocab_size: int = 512):
+	from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+	from transformers import PreTrainedTokenizerFast
+
+	tokenizer = Tokenizer(models.BPE())
+	tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+	tokenizer.decoder = decoders.ByteLevel()
+	trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=[eos_token, extra_token],
+								  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+	tokenizer.train_from_iterator([go_source(50), model_output(200, True)], trainer)
+	return PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token=eos_token, eos_token=eos_token, pad_token=eos_token,
+								   additional_special_tokens=[extra_token], model_max_length=1024)
+
+def tiny_models(path: str) -> dict[str, str]:
+	"""
+	Save a tiny random GPT-2 (causal) and T5 (seq2seq) model with the tiny tokenizer, returns the model path of each type.
+	"""
+
+	import torch
+	from transformers import GPT2Config, GPT2LMHeadModel, T5Config, T5ForConditionalGeneration
+
+	torch.manual_seed(0)
+	tokenizer = tiny_tokenizer()
+	eos_id = tokenizer.eos_token_id
+	models = {
+		"causal": GPT2LMHeadModel(GPT2Config(vocab_size=len(tokenizer), n_positions=1024, n_embd=64, n_layer=2, n_head=2,
+											 bos_token_id=eos_id, eos_token_id=eos_id)),
+		"seq2seq": T5ForConditionalGeneration(T5Config(vocab_size=len(tokenizer), d_model=64, d_kv=16, d_ff=128, num_layers=2, num_heads=4,
+													   pad_token_id=eos_id, eos_token_id=eos_id, decoder_start_token_id=eos_id)),
+	}
+
+	paths = {}
+	for model_type, model in models.items():
+		paths[model_type] = os.path.join(path, model_type)
+		model.config.name_or_path = paths[model_type] # init.get_model_base_name loads the tokenizer from _name_or_path
+		model.save_pretrained(paths[model_type])
+		tokenizer.save_pretrained(paths[model_type])
+	return paths
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+class ResponseCache:
+	"""
+	Persistent on-disk cache of raw model outputs, keyed by the model, prompt, generation config and run.
+	The least recently used entries are evicted when the total size exceeds max_size bytes.
+	"""
+
+	def __init__(self, path: str, max_size: int):
+		os.makedirs(path, exist_ok=True)
+		self.max_size = max_size
+		self.hits = 0
+		self.misses = 0
+		self.db = sqlite3.connect(os.path.join(path, "responses.db"), check_same_thread=False)
+		self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, outputs TEXT, size INTEGER, used REAL)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+		self.db.commit()
+
+	@staticmethod
+	def key(model: str, input_ids, system_ids, stop_token: str, generate_args: dict, run: str = None) -> str:
+		content = json.dumps({
+			"model": model,
+			"run": run, # Repetitions of a config share generate_args, but must not replay each other's samples
+			"input_ids": list(input_ids),
+			"system_ids": list(system_ids),
+			"stop_token": stop_token,
+			"generate_args": generate_args,
+		}, sort_keys=True)
+		return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+	def get(self, key: str) -> list[str]:
+		row = self.db.execute("SELECT outputs FROM responses WHERE key = ?", (key,)).fetchone()
+		if row is None:
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		self.db.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+		self.db.commit()
+		return json.loads(row[0])
+
+	def put(self, key: str, outputs: list[str]):
+		value = json.dumps(outputs)
+		self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, value, len(value), time.time()))
+		self.evict()
+		self.db.commit()
+
+	def size(self) -> int:
+		return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+	def evict(self):
+		excess = self.size() - self.max_size
+		if excess <= 0:
+			return
+
+		evict = []
+		for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY used ASC"):
+			evict.append((key,))
+			excess -= size
+			if excess <= 0:
+				break
+		self.db.executemany("DELETE FROM responses WHERE key = ?", evict)
+
+class CachedGenerator:
+	"""
+	Wrapper for OpenAIGenerator and HFGenerator that returns the cached outputs of previous identical generations.
+	Outputs are only cached after all outputs of a prompt have been generated.
+	"""
+
+	def __init__(self, generator, cache: ResponseCache, model: str, stop_token: str, generate_args: dict, run: str = None):
+		self.generator = generator
+		self.cache = cache
+		self.model = model
+		self.stop_token = stop_token
+		self.generate_args = generate_args
+		self.run = run
+
+	def generate(self, input_ids, system_ids):
+		for _, output in self.generate_batch([(input_ids, system_ids)]):
+			yield output
+
+	def generate_batch(self, prompts):
+		keys, cached, misses = self.lookup(prompts)
+		for i, outputs in cached.items():
+			for output in outputs:
+				yield i, output
+
+		if len(misses) == 0:
+			return
+
+		outputs = {i: [] for i in misses}
+		for k, output in self.generator.generate_batch([prompts[i] for i in misses]):
+			outputs[misses[k]].append(output)
+			yield misses[k], output
+
+		for i in misses:
+			self.cache.put(keys[i], outputs[i])
+
+	def generate_stream(self, prompts):
+		keys, cached, misses = self.lookup(prompts)
+		for i, outputs in cached.items():
+			for j, output in enumerate(outputs):
+				yield i, j, output
+
+		if len(misses) == 0:
+			return
+
+		outputs = {i: {} for i in misses}
+		for k, j, text in self.generator.generate_stream([prompts[i] for i in misses]):
+			outputs[misses[k]][j] = outputs[misses[k]].get(j, "") + text
+			yield misses[k], j, text
+
+		for i in misses:
+			self.cache.put(keys[i], list(outputs[i].values()))
+
+	def lookup(self, prompts):
+		"""
+		Returns the cache keys of all prompts, the cached outputs by prompt index and the indices of uncached prompts.
+		"""
+
+		keys = []
+		cached = {}
+		misses = []
+		for i, (input_ids, system_ids) in enumerate(prompts):
+			key = self.cache.key(self.model, input_ids, system_ids, self.stop_token, self.generate_args, self.run)
+			keys.append(key)
+
+			outputs = self.cache.get(key)
+			if outputs is None:
+				misses.append(i)
+			else:
+				print("	Using cached outputs")
+				cached[i] = outputs
+
+		return keys, cached, misses
@@ -0,0 +1,459 @@
+#!/bin/python3
+import argparse
+import atexit
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+
+sha1_length = 40
+hex_chars = set("0123456789abcdef")
+
+# Corpus pack: header, the concatenated seed payloads and an index of (SHA1 digest, offset, length) entries sorted by digest
+pack_suffix = ".pack"
+pack_magic = b"SEEDPACK"
+pack_version = 1
+pack_header = struct.Struct("<8sIIQQ") # magic, version, reserved, seed count, index offset
+pack_entry = struct.Struct("<20sQI") # SHA1 digest, payload offset, payload length
+
+def is_sha1(name: str) -> bool:
+	return len(name) == sha1_length and set(name) <= hex_chars
+
+class CorpusWriter:
+	"""
+	Writes seeds to a corpus directory, the filename is the SHA1 hash of the seed content.
+	The hashes of the existing seeds are loaded once, so duplicates are skipped without touching the filesystem.
+	Without scan (a few one-shot saves) the existing seeds are not loaded, the flat and sharded path of each seed is checked instead.
+	Files are written atomically (temp file + rename) and optionally sharded into hash prefix subdirectories (ab/abcdef...).
+	"""
+
+	def __init__(self, corpus_dir: str, shard: bool = False, scan: bool = True):
+		self.corpus_dir = corpus_dir
+		self.shard = shard
+		self.scan = scan
+		os.makedirs(corpus_dir, exist_ok=True)
+		self.hashes = set(list_seeds(corpus_dir).keys()) if scan else set()
+
+	def path(self, sha1_hash: str) -> str:
+		if self.shard:
+			return os.path.join(self.corpus_dir, sha1_hash[:2], sha1_hash)
+		return os.path.join(self.corpus_dir, sha1_hash)
+
+	def exists(self, sha1_hash: str) -> bool:
+		if sha1_hash in self.hashes:
+			return True
+		if self.scan:
+			return False
+		return os.path.exists(os.path.join(self.corpus_dir, sha1_hash)) or os.path.exists(os.path.join(self.corpus_dir, sha1_hash[:2], sha1_hash))
+
+	def add(self, seed_bytes: bytes) -> bool:
+		"""
+		Save the seed bytes if they are not in the corpus yet.
+		Returns True if the seed is new.
+		"""
+
+		sha1_hash = hashlib.sha1(seed_bytes).hexdigest()
+		if self.exists(sha1_hash):
+			return False
+
+		file_path = self.path(sha1_hash)
+		try:
+			dir_path = os.path.dirname(file_path)
+			if self.shard:
+				os.makedirs(dir_path, exist_ok=True)
+
+			tmp_path = os.path.join(dir_path, f".{sha1_hash}.{os.getpid()}.tmp")
+			try:
+				# Write bytes to the file
+				with open(tmp_path, 'wb') as file:
+					file.write(seed_bytes)
+				os.replace(tmp_path, file_path)
+			except BaseException:
+				if os.path.exists(tmp_path):
+					os.unlink(tmp_path)
+				raise
+		except Exception as e:
+			raise Exception(f"Error while writing to file {file_path}: {str(e)}")
+
+		self.hashes.add(sha1_hash)
+		return True
+
+	def save(self, seeds: list[str]) -> int:
+		"""
+		Save each seed after converting it to bytes and return the number of new seeds.
+		"""
+
+		new_seeds = 0
+		for seed in seeds:
+			# Convert string to bytes
+			if self.add(seed.encode('utf-8', 'surrogatepass')):
+				new_seeds += 1
+
+		return new_seeds
+
+	def flush(self):
+		pass # Seeds are written immediately
+
+	def close(self):
+		pass
+
+def is_pack(corpus: str) -> bool:
+	return corpus.endswith(pack_suffix)
+
+class PackReader:
+	"""
+	Memory-mapped reader of a corpus pack, seeds are looked up by SHA1 hash with a binary search over the sorted index.
+	"""
+
+	def __init__(self, path: str):
+		self.file = open(path, 'rb')
+		try:
+			self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError: # Empty file
+			self.file.close()
+			raise Exception(f"Invalid corpus pack {path}: empty file")
+		if len(self.data) < pack_header.size:
+			self.close()
+			raise Exception(f"Invalid corpus pack {path}: truncated header")
+
+		magic, version, _, self.count, self.index_offset = pack_header.unpack_from(self.data, 0)
+		if magic != pack_magic or version != pack_version or self.index_offset + self.count*pack_entry.size > len(self.data):
+			self.close()
+			raise Exception(f"Invalid corpus pack {path}")
+
+	def __len__(self) -> int:
+		return self.count
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def entry(self, i: int) -> tuple[bytes, int, int]:
+		return pack_entry.unpack_from(self.data, self.index_offset + i*pack_entry.size)
+
+	def find(self, digest: bytes) -> int:
+		"""
+		Returns the index entry of the SHA1 digest, or -1 if the seed is not in the pack.
+		"""
+
+		low, high = 0, self.count
+		while low < high:
+			middle = (low + high) // 2
+			offset = self.index_offset + middle*pack_entry.size
+			key = self.data[offset:offset+20]
+			if key == digest:
+				return middle
+			if key < digest:
+				low = middle + 1
+			else:
+				high = middle
+		return -1
+
+	def get(self, sha1_hash: str) -> bytes:
+		"""
+		Returns the content of the seed with the SHA1 hash, or None if the seed is not in the pack.
+		"""
+
+		i = self.find(bytes.fromhex(sha1_hash))
+		if i == -1:
+			return None
+		_, offset, length = self.entry(i)
+		return self.data[offset:offset+length]
+
+	def __contains__(self, sha1_hash: str) -> bool:
+		return self.find(bytes.fromhex(sha1_hash)) != -1
+
+	def __iter__(self):
+		"""
+		Yields the (SHA1 hash, content) of every seed in order of hash.
+		"""
+
+		for i in range(self.count):
+			digest, offset, length = self.entry(i)
+			yield digest.hex(), self.data[offset:offset+length]
+
+	def close(self):
+		self.data.close()
+		self.file.close()
+
+class PackWriter:
+	"""
+	Appends seeds to a corpus pack, duplicates are skipped using the digests of the index.
+	New payloads are appended at the end of the file, flush writes the new sorted index after them and then the header.
+	Until the header is written readers (and a writer after a crash) use the previous index, so a pack is never inconsistent.
+	The previous indexes stay in the file, once they are larger than the seeds and the new index the pack is compacted.
+	"""
+
+	def __init__(self, path: str):
+		self.path = path
+		self.entries = {} # SHA1 digest -> (offset, length)
+		if os.path.exists(path) and os.path.getsize(path) > 0:
+			with PackReader(path) as reader:
+				for i in range(len(reader)):
+					digest, offset, length = reader.entry(i)
+					self.entries[digest] = (offset, length)
+			self.file = open(path, 'r+b')
+		else:
+			if os.path.dirname(path):
+				os.makedirs(os.path.dirname(path), exist_ok=True)
+			self.file = open(path, 'w+b')
+			self.file.write(pack_header.pack(pack_magic, pack_version, 0, 0, pack_header.size))
+		self.file.seek(0, os.SEEK_END)
+		self.dirty = False
+		atexit.register(self.close)
+
+	def add(self, seed_bytes: bytes) -> bool:
+		"""
+		Append the seed bytes if they are not in the pack yet.
+		Returns True if the seed is new.
+		"""
+
+		digest = hashlib.sha1(seed_bytes).digest()
+		if digest in self.entries:
+			return False
+
+		self.entries[digest] = (self.file.tell(), len(seed_bytes))
+		self.file.write(seed_bytes)
+		self.dirty = True
+		return True
+
+	def save(self, seeds: list[str]) -> int:
+		new_seeds = 0
+		for seed in seeds:
+			if self.add(seed.encode('utf-8', 'surrogatepass')):
+				new_seeds += 1
+		return new_seeds
+
+	def flush(self):
+		"""
+		Write the sorted index and the header, making the appended seeds visible to readers.
+		"""
+
+		if not self.dirty:
+			return
+
+		payload_bytes = sum(length for _, length in self.entries.values())
+		index_bytes = len(self.entries)*pack_entry.size
+		dead_bytes = self.file.seek(0, os.SEEK_END) - pack_header.size - payload_bytes # Previous indexes
+		if dead_bytes > payload_bytes + index_bytes:
+			self.compact()
+			return
+
+		index_offset = self.file.seek(0, os.SEEK_END)
+		self.file.write(b"".join(pack_entry.pack(digest, *self.entries[digest]) for digest in sorted(self.entries)))
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+		self.file.seek(0)
+		self.file.write(pack_header.pack(pack_magic, pack_version, 0, len(self.entries), index_offset))
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.file.seek(0, os.SEEK_END)
+		self.dirty = False
+
+	def compact(self):
+		"""
+		Rewrite the pack without the previous indexes to a temporary file and replace the pack with it.
+		"""
+
+		self.file.flush()
+		entries = {}
+		tmp_path = f"{self.path}.{os.getpid()}.tmp"
+		try:
+			with open(tmp_path, 'wb') as file:
+				file.write(pack_header.pack(pack_magic, pack_version, 0, 0, pack_header.size))
+				for digest in sorted(self.entries):
+					offset, length = self.entries[digest]
+					self.file.seek(offset)
+					entries[digest] = (file.tell(), length)
+					file.write(self.file.read(length))
+
+				index_offset = file.tell()
+				file.write(b"".join(pack_entry.pack(digest, *entries[digest]) for digest in sorted(entries)))
+				file.seek(0)
+				file.write(pack_header.pack(pack_magic, pack_version, 0, len(entries), index_offset))
+				file.flush()
+				os.fsync(file.fileno())
+			os.replace(tmp_path, self.path)
+		except BaseException:
+			if os.path.exists(tmp_path):
+				os.unlink(tmp_path)
+			raise
+
+		self.file.close()
+		self.file = open(self.path, 'r+b')
+		self.file.seek(0, os.SEEK_END)
+		self.entries = entries
+		self.dirty = False
+
+	def close(self):
+		if self.file.closed:
+			return
+		self.flush()
+		self.file.close()
+		atexit.unregister(self.close)
+
+writers = {}
+
+def open_writer(corpus: str, shard: bool = False, scan: bool = True):
+	"""
+	Returns a new writer for a corpus directory, or for a corpus pack if the path ends with .pack.
+	"""
+
+	if is_pack(corpus):
+		return PackWriter(corpus)
+	return CorpusWriter(corpus, shard, scan)
+
+def get_writer(corpus_dir: str, shard: bool = False):
+	"""
+	Returns the writer of the corpus directory (or pack), the existing seeds are only loaded on the first call.
+	"""
+
+	key = (os.path.abspath(corpus_dir), shard)
+	if key not in writers:
+		writers[key] = open_writer(corpus_dir, shard)
+	return writers[key]
+
+def save_seeds(corpus_dir: str, seeds: list[str]) -> int:
+	"""
+	Save each output as a file in the given directory (or in the pack) after converting it to bytes.
+	The filename is the SHA1 hash of its content.
+	If a file already exists, it skips the seed.
+	Raises an exception if there's an error.
+	"""
+
+	writer = open_writer(corpus_dir, scan=False) # Check each seed instead of listing the whole corpus
+	try:
+		return writer.save(seeds)
+	finally:
+		writer.close()
+
+def list_seeds(corpus_dir: str) -> dict[str, str]:
+	"""
+	Returns the path of every seed in a flat or sharded corpus directory by SHA1 hash.
+	"""
+
+	seeds = {}
+	if not os.path.isdir(corpus_dir):
+		return seeds
+
+	with os.scandir(corpus_dir) as entries:
+		for entry in entries:
+			if entry.is_file() and is_sha1(entry.name):
+				seeds[entry.name] = entry.path
+			elif entry.is_dir() and len(entry.name) == 2 and set(entry.name) <= hex_chars:
+				with os.scandir(entry.path) as shard_entries:
+					for shard_entry in shard_entries:
+						if shard_entry.is_file() and is_sha1(shard_entry.name):
+							seeds[shard_entry.name] = shard_entry.path
+
+	return seeds
+
+def read_seeds(corpus: str):
+	"""
+	Yields the (SHA1 hash, content) of every seed of a (sharded) corpus directory or corpus pack.
+	"""
+
+	if is_pack(corpus):
+		if os.path.exists(corpus):
+			with PackReader(corpus) as reader:
+				yield from reader
+		return
+
+	for sha1_hash, path in list_seeds(corpus).items():
+		with open(path, 'rb') as file:
+			yield sha1_hash, file.read()
+
+def copy_seeds(source: str, dest: str) -> int:
+	"""
+	Add the seeds of a corpus directory or pack to another one (pack and unpack).
+	Returns the number of new seeds in the destination.
+	"""
+
+	writer = open_writer(dest)
+	try:
+		return sum(1 for _, content in read_seeds(source) if writer.add(content))
+	finally:
+		writer.close()
+
+def export_flat(corpus_dir: str, dest_dir: str) -> int:
+	"""
+	Export a (sharded) corpus to the flat directory layout libFuzzer and AFL++ expect.
+	Files are hard linked when possible. Returns the number of exported seeds.
+	"""
+
+	os.makedirs(dest_dir, exist_ok=True)
+	exported = 0
+	for sha1_hash, path in list_seeds(corpus_dir).items():
+		dest_path = os.path.join(dest_dir, sha1_hash)
+		if os.path.exists(dest_path):
+			continue
+		try:
+			os.link(path, dest_path)
+		except OSError:
+			shutil.copyfile(path, dest_path)
+		exported += 1
+
+	return exported
+
+def near_duplicates(corpus_dir: str, threshold: float) -> list[str]:
+	"""
+	Returns the paths of the seeds that are near-duplicates of a smaller (or equally sized, lower hash) seed in the corpus.
+	"""
+
+	from dedup import NearDuplicateFilter # dedup imports read_seeds from this module
+	if is_pack(corpus_dir):
+		raise Exception("Near-duplicates can only be removed from a corpus directory, unpack the corpus pack first")
+	near_filter = NearDuplicateFilter(threshold)
+	duplicates = []
+	seeds = list_seeds(corpus_dir)
+	for sha1_hash, path in sorted(seeds.items(), key=lambda item: (os.path.getsize(item[1]), item[0])):
+		with open(path, 'rb') as file:
+			if not near_filter.add(file.read()):
+				duplicates.append(path)
+	return duplicates
+
+def main():
+	parser = argparse.ArgumentParser(description="SeedAI corpus tools.")
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	export = commands.add_parser("export", help="export a (sharded) corpus to a flat directory.")
+	export.add_argument("corpus", help="corpus directory.")
+	export.add_argument("dest", help="flat destination directory.")
+
+	pack = commands.add_parser("pack", help="add the seeds of a corpus directory to a corpus pack file.")
+	pack.add_argument("corpus", help="corpus directory.")
+	pack.add_argument("pack", help=f"corpus pack file ({pack_suffix}), created if it does not exist.")
+
+	unpack = commands.add_parser("unpack", help="write the seeds of a corpus pack to a flat directory (libFuzzer/AFL++ corpus).")
+	unpack.add_argument("pack", help=f"corpus pack file ({pack_suffix}).")
+	unpack.add_argument("dest", help="flat destination directory.")
+
+	dedup = commands.add_parser("dedup", help="find (and remove) the near-duplicate seeds of a corpus.")
+	dedup.add_argument("corpus", help="corpus directory.")
+	dedup.add_argument("--threshold", type=float, default=0.8, help="similarity threshold. Default is 0.8.")
+	dedup.add_argument("--remove", action="store_true", default=False, help="remove the near-duplicates, the smallest seed of similar seeds is kept.")
+
+	args = parser.parse_args()
+	if args.command == "export":
+		print(f"Exported {export_flat(args.corpus, args.dest)} seeds to {args.dest}")
+	elif args.command == "pack":
+		if not is_pack(args.pack):
+			raise Exception(f"Corpus pack file name must end with {pack_suffix}")
+		print(f"Packed {copy_seeds(args.corpus, args.pack)} new seeds in {args.pack}")
+	elif args.command == "unpack":
+		if not os.path.isfile(args.pack):
+			raise Exception(f"Cannot find corpus pack {args.pack}")
+		print(f"Unpacked {copy_seeds(args.pack, args.dest)} seeds to {args.dest}")
+	elif args.command == "dedup":
+		duplicates = near_duplicates(args.corpus, args.threshold)
+		for path in duplicates:
+			if args.remove:
+				os.unlink(path)
+		print(f"{'Removed' if args.remove else 'Found'} {len(duplicates)} near-duplicate seeds in {args.corpus}")
+
+if __name__ == "__main__":
+	main()
@@ -1,9 +1,16 @@
 import subprocess
-import ast
+import atexit
+import functools
+import hashlib
+import shutil
+import json
+import os
+import re
+import unicodedata
 from args import printd
 
-def run_parser(parser: str, func_name: str, code_only: bool) -> str:
-	parser_args = [parser, "-func", func_name]
+def run_parser(parser: str, func_name: str, code_only: bool, pkg_path: str = ".") -> str:
+	parser_args = [parser, "-func", func_name, "-p", pkg_path]
 	if code_only:
 		parser_args.append("-code")
 	result = subprocess.run(parser_args,
@@ -21,17 +28,166 @@ def run_parser(parser: str, func_name: str, code_only: bool) -> str:
 
 	return source_code # Return the captured output
 
+def run_parser_all(parser: str, code_only: bool, pkg_path: str = ".") -> dict[str, str]:
+	"""
+	Parse all Fuzz functions of a package with one parser process (-all).
+	The parser returns the declarations shared by the functions once, the code of each function is rebuilt from its chunks.
+	Returns the code of each Fuzz function, None for a function the parser failed on.
+	"""
+
+	parser_args = [parser, "-all", "-p", pkg_path]
+	if code_only:
+		parser_args.append("-code")
+	result = subprocess.run(parser_args, text=True, capture_output=True)
+	if result.returncode != 0:
+		raise Exception(f"Parser error: {result.stderr}")
+
+	output = json.loads(result.stdout)
+	if len(output['targets']) == 0:
+		raise Exception(f"No Fuzz functions in {pkg_path}")
+
+	functions = {}
+	for target in output['targets']:
+		if target.get('error'):
+			printd(f"PARSER ERROR {target['func']}: {target['error']}")
+			functions[target['func']] = None
+			continue
+		functions[target['func']] = "".join(output['chunks'][i] for i in target.get('chunks', [])).strip()
+	return functions
+
+class ParserDaemon:
+	"""
+	Client for a long-running parser process (-serve) that answers JSON-line requests on stdin/stdout.
+	The process is started on the first request and kept alive across targets.
+	"""
+
+	def __init__(self, parser: str):
+		self.parser = parser
+		self.process = None
+		atexit.register(self.close)
+
+	def start(self):
+		self.close() # Release the pipes of a process that exited
+		self.process = subprocess.Popen([self.parser, "-serve"],
+								  stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+								  text=True, bufsize=1)
+
+	def parse(self, func_name: str, code_only: bool, pkg_path: str = ".") -> str:
+		if self.process is None or self.process.poll() is not None:
+			self.start()
+
+		request = json.dumps({"func": func_name, "code_only": code_only, "path": pkg_path})
+		try:
+			self.process.stdin.write(request + "\n")
+			self.process.stdin.flush()
+			line = self.process.stdout.readline()
+		except BrokenPipeError:
+			line = ""
+		if line == "":
+			raise Exception(f"Parser error: daemon exited with code {self.process.wait()}")
+
+		result = json.loads(line)
+		if result.get("error"):
+			raise Exception(f"Parser error: {result['error']}")
+
+		source_code = result["code"].strip()
+		if source_code == "":
+			raise Exception("Parser returned empty result")
+
+		return source_code
+
+	def close(self):
+		if self.process is None:
+			return
+		try:
+			self.process.stdin.close()
+		except BrokenPipeError: # Buffered input of a process that exited
+			pass
+		self.process.wait()
+		self.process.stdout.close()
+		self.process = None
+
+class ParserCache:
+	"""
+	On-disk cache of parser output, keyed by a hash of the package's Go source files, the function name and the code only flag.
+	Any change to a .go file (or go.mod/go.sum) of the package invalidates the cached results.
+	"""
+
+	def __init__(self, path: str, parser: str, parse):
+		os.makedirs(path, exist_ok=True)
+		self.path = path
+		self.parse_fn = parse
+		self.hits = 0
+		self.misses = 0
+
+		# Parser updates invalidate the cache as well
+		parser_path = shutil.which(parser) or parser
+		stat = os.stat(parser_path)
+		self.parser_id = f"{os.path.abspath(parser_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+	def key(self, func_name: str, code_only: bool, pkg_path: str) -> str:
+		h = hashlib.sha256()
+		h.update(json.dumps([self.parser_id, func_name, code_only]).encode('utf-8'))
+		for name in sorted(os.listdir(pkg_path)):
+			file_path = os.path.join(pkg_path, name)
+			if not (name.endswith(".go") or name in ["go.mod", "go.sum"]) or not os.path.isfile(file_path):
+				continue
+			with open(file_path, 'rb') as file:
+				content = file.read()
+			h.update(f"\0{name}\0{len(content)}\0".encode('utf-8'))
+			h.update(content)
+
+		return h.hexdigest()
+
+	def parse(self, func_name: str, code_only: bool, pkg_path: str = ".") -> str:
+		file_path = os.path.join(self.path, self.key(func_name, code_only, pkg_path))
+		if os.path.exists(file_path):
+			self.hits += 1
+			with open(file_path, 'r', encoding='utf-8') as file:
+				return file.read()
+
+		self.misses += 1
+		source_code = self.parse_fn(func_name, code_only, pkg_path)
+		self.put(func_name, code_only, pkg_path, source_code)
+		return source_code
+
+	def put(self, func_name: str, code_only: bool, pkg_path: str, source_code: str):
+		file_path = os.path.join(self.path, self.key(func_name, code_only, pkg_path))
+		tmp_path = f"{file_path}.{os.getpid()}.tmp"
+		with open(tmp_path, 'w', encoding='utf-8') as file:
+			file.write(source_code)
+		os.replace(tmp_path, file_path)
+
+@functools.lru_cache(maxsize=None)
+def cached_encode(tokenizer, text: str) -> tuple[int]:
+	return tuple(tokenizer.encode(text, add_special_tokens=False))
+
+def template_tokens(tokenizer, text: str) -> list[int]:
+	"""
+	Returns the token ids of a prompt template text (prefix, suffix, split or stop token), encoded only once per tokenizer.
+	"""
+
+	return list(cached_encode(tokenizer, text))
+
+@functools.lru_cache(maxsize=64)
+def template_text(tokenizer, token_ids: tuple[int]) -> str:
+	"""
+	Returns the decoded text of template token ids (e.g. the system prompt), decoded only once per tokenizer.
+	"""
+
+	return tokenizer.decode(list(token_ids))
+
 # Processor for fine-tuned models
 class FineTuneProcessor:
 	def __init__(self, tokenizer, seq2seq, split: str, max_encode_length: int):
 		self.tokenizer = tokenizer
 		self.seq2seq = seq2seq
-		self.split_tokens = tokenizer.encode(split, add_special_tokens=False)
+		self.split_tokens = template_tokens(tokenizer, split)
 		self.max_encode_length = max_encode_length
 		if seq2seq == "t5" or seq2seq == "t5-ft":
 			self.max_encode_length -= 2
 
-	def encode(self, source_code: str):
+	def encode(self, source_code: str, roots: list[str] = []):
 		suffix_tokens = self.split_tokens
 		if self.seq2seq:
 			suffix_tokens = [] # Do not add split tokens for seq2seq models
@@ -39,6 +195,7 @@ class FineTuneProcessor:
 		input_ids = encode(
 			self.tokenizer, self.max_encode_length, source_code,
 			suffix_tokens=suffix_tokens,
+			roots=roots,
 		)
 
 		if self.seq2seq == "t5" or self.seq2seq == "t5-ft":
@@ -56,6 +213,9 @@ class FineTuneProcessor:
 
 		return []
 
+	def extractor(self):
+		return BufferedExtractor(self)
+
 # Processor for prompt-tuning
 class PromptTuneProcessor:
 	def __init__(
@@ -72,8 +232,8 @@ class PromptTuneProcessor:
 		prefix = prefix.replace("<count>", str(count))
 		suffix = suffix.replace("<count>", str(count))
 
-		self.prefix_tokens = tokenizer.encode(prefix, add_special_tokens=False)
-		self.suffix_tokens = tokenizer.encode(suffix, add_special_tokens=False)
+		self.prefix_tokens = template_tokens(tokenizer, prefix)
+		self.suffix_tokens = template_tokens(tokenizer, suffix)
 
 		if stop == "":
 			stop = tokenizer.eos_token
@@ -85,14 +245,15 @@ class PromptTuneProcessor:
 
 		self.check_suffix_tokens = []
 		if not code_only:
-			self.check_suffix_tokens = tokenizer.encode("\n```", add_special_tokens=False)
+			self.check_suffix_tokens = template_tokens(tokenizer, "\n```")
 
-	def encode(self, source_code: str):
+	def encode(self, source_code: str, roots: list[str] = []):
 		input_ids = encode(
 			self.tokenizer, self.max_encode_length, source_code,
 			prefix_tokens=self.prefix_tokens,
 			suffix_tokens=self.suffix_tokens,
 			check_suffix_tokens=self.check_suffix_tokens,
+			roots=roots,
 		)
 
 		if self.seq2seq == "t5" or self.seq2seq == "t5-ft":
@@ -112,17 +273,12 @@ class PromptTuneProcessor:
 			output = self.start_with_string + output
 
 		seeds = []
-		for line in output.splitlines():
-			values = extract_values(line, self.multi_vals)
-			if len(values) == 0:
-				continue
-
-			for seed in values:
-				# The output contains a string in source code, try to un-escape it
-				seed = parse_escaped(seed)
+		for seed in scan_values(output, self.multi_vals):
+			# The output contains a string in source code, try to un-escape it
+			seed = parse_escaped(seed)
 
-				if len(seed) > 0:
-					seeds.append(seed)
+			if len(seed) > 0:
+				seeds.append(seed)
 
 		if len(seeds) == 0: # Make sure to always return something when extraction failed
 			output = parse_escaped(raw)
@@ -130,11 +286,86 @@ class PromptTuneProcessor:
 
 		return seeds
 
-def encode(tokenizer, max_encode_length: int, text: str, prefix_tokens = [], suffix_tokens = [], check_suffix_tokens = []):
+	def extractor(self):
+		return IncrementalExtractor(self)
+
+# Extractor for streamed outputs that extracts the seeds once the output is complete
+class BufferedExtractor:
+	def __init__(self, processor):
+		self.processor = processor
+		self.raw = ""
+
+	def feed(self, text: str) -> list[str]:
+		self.raw += text
+		return []
+
+	def finish(self) -> list[str]:
+		return self.processor.extract(self.raw)
+
+# Extractor for streamed outputs that emits each seed as soon as its closing quote arrives.
+# The extracted seeds are the same as PromptTuneProcessor.extract on the complete output.
+class IncrementalExtractor:
+	def __init__(self, processor):
+		self.processor = processor
+		self.raw = ""
+		self.line = "" # Incomplete current line
+		self.emitted = 0 # Values already emitted from the current line
+		self.seeds = 0
+
+	def feed(self, text: str) -> list[str]:
+		if len(text) == 0:
+			return []
+
+		start_with_string = self.processor.start_with_string
+		if len(self.raw) == 0 and start_with_string and text[0] != start_with_string:
+			self.line = start_with_string
+		self.raw += text
+		self.line += text
+
+		seeds = []
+		lines = self.line.splitlines(keepends=True)
+		for line in lines[:-1]: # Complete lines
+			seeds += self.extract_line(line.splitlines()[0])
+			self.emitted = 0
+
+		self.line = lines[-1]
+		if self.line.splitlines()[0] != self.line: # Ends with a line break
+			seeds += self.extract_line(self.line.splitlines()[0])
+			self.emitted = 0
+			self.line = ""
+		else:
+			seeds += self.extract_line(self.line)
+
+		self.seeds += len(seeds)
+		return seeds
+
+	def extract_line(self, line: str) -> list[str]:
+		values = extract_values(line, self.processor.multi_vals)
+		new_values = values[self.emitted:]
+		self.emitted = len(values)
+
+		seeds = []
+		for seed in new_values:
+			# The output contains a string in source code, try to un-escape it
+			seed = parse_escaped(seed)
+			if len(seed) > 0:
+				seeds.append(seed)
+
+		return seeds
+
+	def finish(self) -> list[str]:
+		if self.seeds == 0 and len(self.raw) > 0: # Make sure to always return something when extraction failed
+			self.seeds += 1
+			return [parse_escaped(self.raw)]
+
+		return []
+
+def encode(tokenizer, max_encode_length: int, text: str, prefix_tokens = [], suffix_tokens = [], check_suffix_tokens = [], roots = []):
 	max_length = max_encode_length - len(prefix_tokens) - len(suffix_tokens) - len(check_suffix_tokens)
 	if max_length <= 0:
 		raise Exception("Encode length too small")
 
+	text = pack_source(tokenizer, text, max_length, roots)
 	encoded = tokenizer.encode(text, truncation=True, max_length=max_length, add_special_tokens=False)
 	if len(encoded) >= max_length:
 		print("	Warning: input length >= max encode length, prompt truncated")
@@ -149,50 +380,203 @@ def encode(tokenizer, max_encode_length: int, text: str, prefix_tokens = [], suf
 
 	return encoded
 
-def extract_values(line: str, multi_vals: bool) -> list[str]:
-	values = []
+# Top-level Go declarations start at the beginning of a line (gofmt)
+decl_re = re.compile(r"(?:func|type|var|const)\b")
+decl_name_re = re.compile(r"(?:func\s*(?:\([^)]*\)\s*)?|(?:type|var|const)\s+)([A-Za-z_]\w*)")
+group_name_re = re.compile(r"^\s+([A-Za-z_]\w*)", re.M)
+ident_re = re.compile(r"[A-Za-z_]\w*")
+
+def split_chunks(text: str) -> tuple[str, list[str], str]:
+	"""
+	Split parser output into a header, one chunk per top-level declaration (including its doc comment) and a footer.
+	The header is the text before the first declaration and the footer a closing code fence, both are always kept.
+	"""
+
+	lines = text.splitlines(keepends=True)
+	starts = []
+	for i, line in enumerate(lines):
+		if decl_re.match(line):
+			start = i
+			while start > 0 and (len(starts) == 0 or start > starts[-1]+1) and lines[start-1].startswith("//"):
+				start -= 1
+			starts.append(start)
+
+	if len(starts) == 0:
+		return text, [], ""
+
+	footer = ""
+	if lines[-1].strip() == "```" and len(lines)-1 > starts[-1]:
+		footer = lines.pop()
+
+	header = "".join(lines[:starts[0]])
+	chunks = ["".join(lines[start:end]) for start, end in zip(starts, starts[1:] + [len(lines)])]
+	return header, chunks, footer
+
+def chunk_names(chunk: str) -> list[str]:
+	"""
+	Returns the names declared by a chunk (functions, methods, types, vars and consts).
+	"""
+
+	for line in chunk.splitlines():
+		if not decl_re.match(line):
+			continue
+		if line.rstrip().endswith("("): # Grouped declaration
+			return group_name_re.findall(chunk)
+		name = decl_name_re.match(line)
+		return [name.group(1)] if name else []
+	return []
+
+def call_distances(chunks: list[str], roots: list[str]) -> list[float]:
+	"""
+	Returns the reference distance of each chunk from the root chunks (breadth-first over the identifiers used in each chunk).
+	Without a matching root the first chunk (the Fuzz function) is the root. Unreachable chunks have an infinite distance.
+	"""
+
+	declared = {}
+	for i, chunk in enumerate(chunks):
+		for name in chunk_names(chunk):
+			declared.setdefault(name, []).append(i)
+
+	distances = [float('inf')]*len(chunks)
+	frontier = sorted({i for name in roots for i in declared.get(name, [])})
+	if len(frontier) == 0:
+		frontier = [0]
+	for i in frontier:
+		distances[i] = 0
+
+	while len(frontier) > 0:
+		next_frontier = []
+		for i in frontier:
+			for name in set(ident_re.findall(chunks[i])):
+				for j in declared.get(name, []):
+					if distances[j] == float('inf'):
+						distances[j] = distances[i] + 1
+						next_frontier.append(j)
+		frontier = next_frontier
+
+	return distances
+
+def pack_source(tokenizer, text: str, max_length: int, roots: list[str] = []) -> str:
+	"""
+	Returns the declarations of the source code that fit in max_length tokens, closest to the roots first.
+	Chunks are tokenized one by one in order of distance, so text beyond the budget is never tokenized.
+	The kept chunks stay in their original order. Token counts of separate chunks are approximate,
+	the result is still truncated by encode if needed.
+	"""
+
+	if len(text.encode('utf-8', 'surrogatepass')) <= max_length: # A token is at least one byte (byte-level BPE splits multi-byte characters)
+		return text
+
+	header, chunks, footer = split_chunks(text)
+	if len(chunks) <= 1:
+		return text
+
+	distances = call_distances(chunks, roots)
+	used = len(tokenizer.encode(header + footer, add_special_tokens=False))
+	selected = []
+	for i in sorted(range(len(chunks)), key=lambda i: (distances[i], i)):
+		length = len(tokenizer.encode(chunks[i], add_special_tokens=False))
+		if used + length > max_length and len(selected) > 0:
+			break
+		used += length
+		selected.append(i)
+
+	if len(selected) < len(chunks):
+		print(f"	Packed {len(selected)} of {len(chunks)} declarations closest to the Fuzz function")
+		printd("PACKED CHUNKS: " + json.dumps([chunk_names(chunks[i]) for i in sorted(selected)]))
+
+	return header + "".join(chunks[i] for i in sorted(selected)) + footer
+
+line_breaks = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029" # Same as str.splitlines
+line_break_re = re.compile(f"[{line_breaks}]")
+quote_re = re.compile("[\"`]")
+# A literal ends at the first quote that is not preceded by a backslash (unrolled loop, no backtracking)
+closing_quote_re = {
+	q: re.compile(f'[^{q}\\\\{line_breaks}]*(?:\\\\+(?:[^{q}\\\\{line_breaks}]|{q})[^{q}\\\\{line_breaks}]*)*{q}')
+	for q in ['"', '`']
+}
+
+def scan_values(text: str, multi_vals: bool) -> list[str]:
+	"""
+	Return the non-empty values of the string ("...") and raw string (`...`) literals in text, line by line, in a single pass.
+	Only the first literal of each line is used unless multi_vals is set. A quote preceded by a backslash
+	never closes a literal, and the scan of a line ends at a literal without closing quote.
+	"""
 
-	value, i = extract_value(line)
-	if value != "":
-		values.append(value)
+	values = []
+	pos = 0
+	while True:
+		start = quote_re.search(text, pos)
+		if start is None:
+			break
 
-	if not multi_vals or i == -1:
-		return values
+		end = closing_quote_re[start.group()].match(text, start.end())
+		if end is not None:
+			value = text[start.end():end.end()-1]
+			if value != "":
+				values.append(value)
+			if multi_vals: # Handle one-line cases like []string{"value1", "value2"}
+				pos = end.end()
+				continue
 
-	# Handle one-line cases like []string{"value1", "value2"}
-	while True:
-		line = line[i+1:]
-		value, i = extract_value(line)
-		if value != "":
-			values.append(value)
-		if i == -1:
+		# Continue at the next line
+		next_line = line_break_re.search(text, start.end() if end is None else end.end())
+		if next_line is None:
 			break
+		pos = next_line.end()
 
 	return values
 
-def extract_value(line: str) -> str:
-	stringType = '"'
-	start = 0
-
-	start = line.find('"')
-	startBT = line.find('`')
-	if start == -1 or (startBT != -1 and startBT < start):
-		start = startBT
-		stringType = '`'
-	if start == -1:
-		return "", -1
-	start += 1
+def extract_values(line: str, multi_vals: bool) -> list[str]:
+	return scan_values(line, multi_vals)
+
+simple_escapes = {
+	'\\': '\\', "'": "'", '"': '"', 'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v',
+	'\n': '', '\r': '', '\r\n': '', # Line continuation
+}
+escape_re = re.compile(r'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{2})|u([0-9a-fA-F]{4})|U([0-9a-fA-F]{8})|N\{([^}"\n\r]*)\}|(\r\n|.?))|("[ \t\f]*"|["\n\r\0])', re.S)
+
+class InvalidEscape(Exception):
+	pass
+
+def unescape(match) -> str:
+	octal, hex2, hex4, hex8, name, other, special = match.groups()
+	if special is not None and len(special) > 1: # Implicit string concatenation "a" "b"
+		return ''
+	if special is not None: # Other unescaped quote, unterminated string or null byte
+		raise InvalidEscape()
+
+	if octal is not None:
+		return chr(int(octal, 8))
+	if hex2 is not None or hex4 is not None:
+		return chr(int(hex2 or hex4, 16))
+	if hex8 is not None:
+		if int(hex8, 16) > 0x10ffff:
+			raise InvalidEscape()
+		return chr(int(hex8, 16))
+	if name is not None:
+		try:
+			return unicodedata.lookup(name)
+		except KeyError:
+			raise InvalidEscape()
+
+	if other in simple_escapes:
+		return simple_escapes[other]
+	if other in ['', 'x', 'u', 'U', 'N', '\0']: # Truncated escape or escaped closing quote
+		raise InvalidEscape()
+
+	return '\\' + other # Unknown escapes are kept
 
-	# iterate from the start to the end
-	for i in range(start, len(line)):
-		if line[i] == stringType and (i == 0 or line[i-1] != '\\'):
-			return line[start:i], i
+def parse_escaped(value):
+	"""
+	Un-escape value as the content of a double quoted Python string literal.
+	Returns the original value if it is not a valid string literal.
+	"""
 
-	return "", -1
+	if '\\' not in value and '"' not in value and '\n' not in value and '\r' not in value and '\0' not in value:
+		return value
 
-def parse_escaped(value):
-	str_val = '"'+value+'"'
 	try:
-		return ast.literal_eval(str_val)
-	except SyntaxError: # Just return the original value on failure
+		return escape_re.sub(unescape, value)
+	except InvalidEscape: # Just return the original value on failure
 		return value
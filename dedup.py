@@ -0,0 +1,189 @@
+import array
+import hashlib
+import os
+import re
+
+from corpus import read_seeds
+
+default_threshold = 0.8
+whitespace_re = re.compile(rb"\s+")
+densify_offset = 0x9e3779b1 # Offset per bin for empty bins filled from the next bin (rotation densification)
+min_recall = 0.95 # LSH bands are chosen to find at least 95% of the seed pairs at the threshold similarity
+max_candidates = 32 # Seeds checked per band value (the most recent), bounds the lookup time of very common band values
+
+def lsh_bands(bins: int, threshold: float) -> tuple[int, int]:
+	"""
+	Returns the (bands, rows) split of the signature with the most rows per band (fewest false candidates)
+	that still finds a pair with the threshold similarity with probability min_recall.
+	"""
+
+	bands, rows = bins, 1
+	for r in range(1, bins+1):
+		if bins % r == 0 and 1 - (1 - threshold**r)**(bins // r) >= min_recall:
+			bands, rows = bins // r, r
+	return bands, rows
+
+class NearDuplicateFilter:
+	"""
+	Rejects seeds that are near-duplicates of an earlier seed: the estimated Jaccard similarity of their byte n-grams
+	(after collapsing whitespace) is at least the threshold.
+	Seeds are sketched with one-permutation MinHash (one hash per n-gram, the minimum per bin, empty bins densified),
+	keeping one byte per bin in a single bytearray. Candidates are looked up with LSH over bands of bins.
+	The band buckets are an open addressing hash table of seed numbers in an array, a slot matches if the band of its seed
+	signature matches, so no band values are stored. A slot holds the last seed with the band value, the earlier seeds with
+	the same band value are chained in an array of the previous seed number per seed and band. The last max_candidates seeds
+	of a band value are candidates: band values shared by many seeds (e.g. a common prefix) only lower the recall of that band.
+	The memory per seed is constant and independent of the seed length: the signature (bins bytes), the chain (4 bytes per band)
+	and 4 bytes per band value at a table load between 1/3 and 2/3 (about 220 to 320 bytes with the defaults).
+	"""
+
+	def __init__(self, threshold: float = default_threshold, bins: int = 64, ngram: int = 3):
+		if threshold <= 0 or threshold > 1:
+			raise Exception("Invalid near-duplicate threshold, must be between 0 and 1")
+		self.threshold = threshold
+		self.bins = bins
+		self.ngram = ngram
+		self.bands, self.rows = lsh_bands(bins, threshold)
+		self.buckets = array.array('I', bytes(4*1024)) # Seed index + 1 of the last seed of each band value, 0 if empty
+		self.entries = 0
+		self.chain = array.array('I') # Seed index + 1 of the previous seed with the same band value per seed and band, 0 if none
+		self.signatures = bytearray()
+		self.count = 0
+		self.rejected = 0
+
+	def sketch(self, seed: bytes) -> bytes:
+		data = whitespace_re.sub(b" ", seed.strip())
+		shingles = [data[i:i+self.ngram] for i in range(max(len(data) - self.ngram + 1, 1))]
+
+		mins = [None]*self.bins
+		for shingle in shingles:
+			h = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'little')
+			b, value = h % self.bins, h // self.bins
+			if mins[b] is None or value < mins[b]:
+				mins[b] = value
+
+		# Empty bins take the value of the next non-empty bin (circular), offset by the distance
+		signature = bytearray(self.bins)
+		next_value, distance = None, 0
+		for j in range(2*self.bins - 1, -1, -1):
+			if mins[j % self.bins] is not None:
+				next_value, distance = mins[j % self.bins], 0
+			else:
+				distance += 1
+			if j < self.bins:
+				signature[j] = (next_value + distance*densify_offset) & 0xff
+		return bytes(signature)
+
+	def similarity(self, a: bytes, b: bytes) -> float:
+		"""
+		Estimated Jaccard similarity of two signatures, corrected for the 1/256 chance that one byte bins match by accident.
+		"""
+
+		matches = (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(self.bins, 'little').count(0) / self.bins
+		return max(0.0, (matches - 1/256) / (1 - 1/256))
+
+	def signature(self, i: int) -> bytes:
+		return bytes(self.signatures[i*self.bins:(i+1)*self.bins])
+
+	def lookup(self, band: int, value: bytes) -> tuple[int, int]:
+		"""
+		Returns the bucket slot and the index of the last seed with the band value, or the empty slot and None.
+		"""
+
+		mask = len(self.buckets) - 1
+		slot = hash((band, value)) & mask
+		while True:
+			i = self.buckets[slot] - 1
+			if i == -1:
+				return slot, None
+			start = i*self.bins + band*self.rows
+			if self.signatures[start:start+self.rows] == value:
+				return slot, i
+			slot = (slot + 1) & mask
+
+	def insert(self, i: int):
+		for band in range(self.bands):
+			start = i*self.bins + band*self.rows
+			slot, j = self.lookup(band, bytes(self.signatures[start:start+self.rows]))
+			if j is None:
+				self.entries += 1
+			self.chain[i*self.bands + band] = 0 if j is None else j + 1
+			self.buckets[slot] = i + 1
+
+	def candidates(self, band: int, value: bytes):
+		"""
+		Yields the indices of the last max_candidates seeds with the band value, the last indexed seed first.
+		"""
+
+		_, i = self.lookup(band, value)
+		if i is None:
+			return
+		for _ in range(max_candidates):
+			yield i
+			i = self.chain[i*self.bands + band] - 1
+			if i == -1:
+				break
+
+	def index(self, signature: bytes):
+		self.signatures += signature
+		self.chain.frombytes(bytes(4*self.bands))
+		self.count += 1
+		self.insert(self.count - 1)
+
+		if 3*self.entries > 2*len(self.buckets): # Grow the table and insert all seeds again (in order, which rebuilds the same chains)
+			self.buckets = array.array('I', bytes(8*len(self.buckets)))
+			self.entries = 0
+			for i in range(self.count):
+				self.insert(i)
+
+	def add(self, seed: bytes) -> bool:
+		"""
+		Index the seed unless it is a near-duplicate of an indexed seed.
+		Returns True if the seed is new.
+		"""
+
+		signature = self.sketch(seed)
+		checked = set()
+		for band in range(self.bands):
+			for i in self.candidates(band, signature[band*self.rows:(band+1)*self.rows]):
+				if i in checked:
+					continue
+				checked.add(i)
+				if self.similarity(signature, self.signature(i)) >= self.threshold:
+					self.rejected += 1
+					return False
+
+		self.index(signature)
+		return True
+
+	def filter(self, seeds: list[str]) -> list[str]:
+		"""
+		Returns the seeds that are not near-duplicates of an indexed seed or an earlier seed in the list.
+		"""
+
+		return [seed for seed in seeds if self.add(seed.encode('utf-8', 'surrogatepass'))]
+
+	def load(self, corpus_dir: str) -> int:
+		"""
+		Index every seed of a (sharded) corpus directory or corpus pack, near-duplicates already in the corpus are indexed as well.
+		Returns the number of indexed seeds.
+		"""
+
+		count = 0
+		for _, content in read_seeds(corpus_dir):
+			self.index(self.sketch(content))
+			count += 1
+		return count
+
+filters = {}
+
+def get_filter(corpus_dir: str, threshold: float) -> NearDuplicateFilter:
+	"""
+	Returns the near-duplicate filter of the corpus directory, the existing seeds are only indexed on the first call.
+	"""
+
+	key = (os.path.abspath(corpus_dir), threshold)
+	if key not in filters:
+		filters[key] = NearDuplicateFilter(threshold)
+		filters[key].load(corpus_dir)
+	return filters[key]
@@ -0,0 +1,215 @@
+#!/bin/python3
+# Parallel replacement for the fuzzing part of collect.sh, base.sh and fuzz_missing.sh.
+# Fuzzes every run in ./results/<source>/*/*/* without a cov.out (and the base runs without seeds),
+# running one libfuzzer job per CPU core. Each job gets a private copy of the run corpus and is pinned to its own core.
+# Runs with a corpus.pack instead of a corpus directory are unpacked into the job's copy.
+# Writes the same files as collect.sh: the fuzzer output and RUN/TIMEDOUT/DONE lines in data.out,
+# the fuzzer log in log.out and the "<time>,cov: <cov>,ft: <ft>" coverage lines in cov.out.
+#
+# Usage (from this directory): ./evaluate.py [--jobs N] [--base 28] [--sources clean_html iban saml]
+import argparse
+import concurrent.futures
+import datetime
+import glob
+import os
+import queue
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from corpus import copy_seeds
+
+cov_re = re.compile(r"cov: ([0-9]+)")
+ft_re = re.compile(r"ft: ([0-9]+)")
+
+def timestamp() -> str:
+	return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] # date +"%Y-%m-%d %H:%M:%S.%3N"
+
+def coverage_line(line: str) -> str:
+	"""
+	Returns the cov.out line of a libFuzzer status line, or None if the line has no cov and ft count.
+	"""
+
+	cov = cov_re.search(line)
+	ft = ft_re.search(line)
+	if cov is None or ft is None:
+		return None
+	return f"{timestamp()},cov: {cov.group(1)},ft: {ft.group(1)}\n"
+
+class Job:
+	def __init__(self, source: str, run_dir: str, base: bool):
+		self.source = source
+		self.run_dir = run_dir
+		self.base = base # Base runs start with an empty corpus
+
+	def binary(self) -> str:
+		return os.path.join(".", f"source_{self.source}", "libfuzzer")
+
+def find_jobs(results: str, sources: list[str], base_runs: int) -> list[Job]:
+	"""
+	Returns a job for every run without a cov.out, runs with a cov.out are skipped.
+	"""
+
+	jobs = []
+	for source in sources:
+		for i in range(base_runs):
+			run_dir = os.path.join(results, source, "base", str(i+1))
+			if not os.path.exists(os.path.join(run_dir, "cov.out")):
+				jobs.append(Job(source, run_dir, True))
+
+		for run_dir in sorted(glob.glob(os.path.join(results, source, "*", "*", "*"))):
+			if not os.path.isdir(run_dir) or os.path.relpath(run_dir, os.path.join(results, source)).startswith("base" + os.sep):
+				continue
+			if os.path.exists(os.path.join(run_dir, "cov.out")):
+				print(f"Warning: {run_dir}/cov.out already exists, skipping ...")
+				continue
+			if not os.path.isdir(os.path.join(run_dir, "corpus")) and not os.path.isfile(os.path.join(run_dir, "corpus.pack")):
+				print(f"Warning: {run_dir} has no corpus, skipping ...")
+				continue
+			jobs.append(Job(source, run_dir, False))
+
+	return jobs
+
+def reset_data(job: Job):
+	"""
+	Start data.out of a run, keeping only the START/SEEDS lines of the generation (output of an interrupted run is removed).
+	"""
+
+	data_path = os.path.join(job.run_dir, "data.out")
+	lines = []
+	if not job.base and os.path.exists(data_path):
+		with open(data_path) as file:
+			lines = [line for line in file if line.startswith("START: ") or line.startswith("SEEDS: ")]
+	if len(lines) == 0:
+		lines = [f"START: {timestamp()}\n"]
+
+	with open(data_path, "w") as file:
+		file.writelines(lines)
+		file.write(f"RUN: {timestamp()}\n")
+
+def fuzz(job: Job, cpu: int, timeout: float, work_dir: str) -> str:
+	"""
+	Run libfuzzer for a single run pinned to the given CPU, killing it after the timeout.
+	Returns TIMEDOUT or DONE.
+	"""
+
+	os.makedirs(job.run_dir, exist_ok=True)
+	tmp_dir = tempfile.mkdtemp(prefix=f"{job.source}_", dir=work_dir)
+	try:
+		corpus_dir = os.path.join(tmp_dir, "corpus")
+		pack = os.path.join(job.run_dir, "corpus.pack")
+		if job.base:
+			os.mkdir(corpus_dir)
+		elif os.path.isfile(pack): # Unpack to the flat corpus directory libfuzzer expects
+			copy_seeds(pack, corpus_dir)
+		else: # libfuzzer adds new inputs to the corpus dir, so each job gets its own copy
+			shutil.copytree(os.path.join(job.run_dir, "corpus"), corpus_dir)
+
+		reset_data(job)
+		cov_path = os.path.join(job.run_dir, "cov.out")
+		with open(os.path.join(job.run_dir, "data.out"), "a") as data, \
+				open(os.path.join(job.run_dir, "log.out"), "w") as log, \
+				open(cov_path + ".tmp", "w") as cov:
+			process = subprocess.Popen([job.binary(), corpus_dir, "-use_value_profile=1"],
+							  stdout=data, stderr=subprocess.PIPE, text=True, errors="replace", start_new_session=True)
+			try: # Pin from the parent, preexec_fn is not safe in the threads of the executor
+				os.sched_setaffinity(process.pid, {cpu})
+			except ProcessLookupError: # Already exited
+				pass
+
+			timed_out = threading.Event()
+			def stop():
+				if process.poll() is not None: # Exited just before the timeout
+					return
+				try:
+					os.killpg(process.pid, signal.SIGTERM) # Same as timeout(1), which signals the whole process group
+				except ProcessLookupError: # Exited after the poll
+					return
+				timed_out.set()
+			timer = threading.Timer(timeout, stop)
+			timer.start()
+			try:
+				for line in process.stderr:
+					log.write(line)
+					line = coverage_line(line)
+					if line is not None:
+						cov.write(line)
+				process.wait()
+			finally:
+				timer.cancel()
+				timer.join() # timed_out is final once a running stop returned
+				if process.poll() is None:
+					os.killpg(process.pid, signal.SIGKILL)
+					process.wait()
+				process.stderr.close()
+
+		status = "TIMEDOUT" if timed_out.is_set() else "DONE"
+		with open(os.path.join(job.run_dir, "data.out"), "a") as data:
+			data.write(f"{status}: {timestamp()}\n")
+		os.replace(cov_path + ".tmp", cov_path) # cov.out marks the run as done
+		return status
+	finally:
+		shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def main():
+	cpus = sorted(os.sched_getaffinity(0))
+
+	parser = argparse.ArgumentParser(description="Fuzz all runs without a cov.out in parallel, one libfuzzer job per CPU core.")
+	parser.add_argument("--sources", nargs="+", default=sorted(path[len("source_"):] for path in glob.glob("source_*")),
+					 help="sources to fuzz (source_<source>/libfuzzer). Default is all source_* directories.")
+	parser.add_argument("--jobs", "-j", type=int, default=len(cpus),
+					 help=f"number of parallel fuzzing jobs. Default is the number of CPU cores ({len(cpus)}).")
+	parser.add_argument("--timeout", type=float, default=600,
+					 help="fuzzing time per run in seconds. Default is 600.")
+	parser.add_argument("--base", type=int, default=0,
+					 help="number of base runs (without seeds) per source in results/<source>/base/<run>. Default is 0.")
+	parser.add_argument("--results", default="./results",
+					 help="results directory. Default is ./results.")
+	parser.add_argument("--work-dir", default=None,
+					 help="directory for the temporary corpus copies. Default is the system temp directory.")
+	args = parser.parse_args()
+
+	if args.jobs < 1 or args.jobs > len(cpus):
+		raise Exception(f"Invalid number of jobs, must be between 1 and {len(cpus)}")
+
+	for source in args.sources:
+		if not os.path.isfile(os.path.join(".", f"source_{source}", "libfuzzer")):
+			raise Exception(f"Cannot find libfuzzer for {source}: ./source_{source}/libfuzzer")
+
+	jobs = find_jobs(args.results, args.sources, args.base)
+	print(f"Fuzzing {len(jobs)} runs with {args.jobs} jobs ...")
+
+	free_cpus = queue.Queue()
+	for cpu in cpus[:args.jobs]:
+		free_cpus.put(cpu)
+
+	def run(job):
+		cpu = free_cpus.get()
+		try:
+			print(f"In: {job.run_dir} (CPU {cpu})", flush=True)
+			return fuzz(job, cpu, args.timeout, args.work_dir)
+		finally:
+			free_cpus.put(cpu)
+
+	failed = 0
+	with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+		futures = {executor.submit(run, job): job for job in jobs}
+		for done, future in enumerate(concurrent.futures.as_completed(futures)):
+			job = futures[future]
+			try:
+				print(f"[{done+1}/{len(jobs)}] {job.run_dir}: {future.result()}", flush=True)
+			except Exception as e: # Keep fuzzing the other runs, the failed run is retried on the next invocation
+				failed += 1
+				print(f"[{done+1}/{len(jobs)}] {job.run_dir}: failed ({str(e)})", flush=True)
+
+	print("Done ...")
+	if failed > 0:
+		raise Exception(f"{failed} of {len(jobs)} runs failed")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,180 @@
+#!/bin/python3
+# In-process replacement for the generation part of ft.sh, pt.sh, pt_code_only.sh and ft-pt.sh.
+# The model is loaded once for the whole sweep, and each source is parsed and encoded once per prompt config.
+# Generated corpora are written to ./results/<source>/<name>/{ft,pt}/<run>/corpus (or corpus.pack with --pack) with the START and SEEDS
+# lines in data.out, so they can be fuzzed afterwards with evaluate.py.
+#
+# Usage (from this directory, remaining args are passed to seedai.py):
+#   ./sweep.py <name> -- -m Salesforce/codegen-16B-multi                                      # ft.sh
+#   ./sweep.py <name> --pt-configs ../../pt_configs/go/*.json -- -m Salesforce/codegen-16B-multi  # pt.sh
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, root_dir)
+
+from args import parse_args, load_runs
+from cache import CachedGenerator
+from evaluate import timestamp
+import init
+import seedai
+
+def run_params(pt_config: str) -> list[str]:
+	if pt_config is not None and pt_config.endswith("multi.json"):
+		return ["-n", "2", "-C", "5", "-g", "2000"]
+	return ["-n", "10", "-g", "200"]
+
+def sweep_groups(sweep_args) -> list[dict]:
+	"""
+	Returns the groups of runs that share a prompt config, in the order of the experiment scripts.
+	Each run is a (run directory name, generate config) tuple.
+	"""
+
+	groups = []
+	if sweep_args.ft or not sweep_args.pt_configs:
+		groups.append({
+			"kind": "ft",
+			"pt_config": None,
+			"argv": run_params(None),
+			"runs": [(f"{os.path.basename(conf)}_{i+1}", conf) for i in range(sweep_args.repeat) for conf in sweep_args.configs],
+		})
+
+	for pt_config in sweep_args.pt_configs:
+		groups.append({
+			"kind": "pt",
+			"pt_config": pt_config,
+			"argv": run_params(pt_config) + ["-pt", pt_config],
+			"runs": [(f"{os.path.basename(conf)}_{os.path.basename(pt_config)}", conf) for conf in sweep_args.configs],
+		})
+
+	return groups
+
+def main():
+	parser = argparse.ArgumentParser(description="Generate the corpora of all sources, configs and prompt-tuning configs, loading the model once.", allow_abbrev=False)
+	parser.add_argument("name", help="results folder name.")
+	parser.add_argument("--sources", nargs="+", default=sorted(glob.glob("source_*")),
+					 help="source directories. Default is source_*.")
+	parser.add_argument("--configs", nargs="+", default=sorted(glob.glob(os.path.join(root_dir, "configs", "*.json"))),
+					 help="generate config json files. Default is all configs.")
+	parser.add_argument("--pt-configs", nargs="+", default=[],
+					 help="prompt-tuning config json files. Default is fine-tune runs only.")
+	parser.add_argument("--ft", action="store_true", default=False,
+					 help="also run the fine-tune runs when --pt-configs is set.")
+	parser.add_argument("--repeat", type=int, default=4,
+					 help="number of fine-tune runs of each config. Default is 4.")
+	parser.add_argument("--pack", action="store_true", default=False,
+					 help="save each run corpus as a single corpus.pack file instead of a corpus directory.")
+	parser.add_argument("--results", default="./results",
+					 help="results directory. Default is ./results.")
+	sweep_args, seedai_argv = parser.parse_known_args()
+	if len(seedai_argv) > 0 and seedai_argv[0] == "--":
+		seedai_argv = seedai_argv[1:]
+
+	if len(sweep_args.sources) == 0:
+		raise Exception("No source directories")
+
+	model = None
+	summary = []
+	for group in sweep_groups(sweep_args):
+		# Passed seedai.py args come last to override the default run params
+		args, _ = parse_args(["-c"] + sweep_args.configs + group["argv"] + seedai_argv)
+
+		print()
+		print(f"Loading {group['kind']} {group['pt_config'] or ''} ...")
+		tokenizer, isOpenAI, seq2seq = init.tokenizer(args) # Loaded once, but seq2seq depends on the prompt config
+		if isOpenAI and 'OPENAI_API_KEY' not in os.environ:
+			raise Exception("Please set OPENAI_API_KEY env variable")
+		processor = init.processor(args, seq2seq, tokenizer, isOpenAI)
+		stop_token = processor.stop_token()
+
+		if model is None:
+			print("Loading model ...")
+			model = init.model(args, isOpenAI)
+			draft_model = init.draft_model(args, isOpenAI)
+			prefix_cache = init.prefix_cache(args, isOpenAI)
+			source_parser = init.parser(args)
+			parser_cache = init.parser_cache(args, source_parser)
+			if parser_cache is not None:
+				source_parser = parser_cache.parse
+			response_cache = init.response_cache(args)
+
+		for source in sweep_args.sources:
+			source_name = os.path.basename(os.path.normpath(source))
+			if source_name.startswith("source_"):
+				source_name = source_name[len("source_"):]
+			results = os.path.join(sweep_args.results, source_name, sweep_args.name, group["kind"])
+
+			pending = []
+			for run, config in group["runs"]:
+				if os.path.exists(os.path.join(results, run, "data.out")):
+					print(f"Warning: {os.path.join(results, run)}/data.out already exists, skipping ...")
+				else:
+					pending.append((run, config))
+			if len(pending) == 0:
+				continue
+
+			print()
+			print(f"Source: {source}")
+			prepare_start = time.monotonic()
+			input_ids, system_ids, decode_len = seedai.prepare_target(args, tokenizer, seq2seq, processor, source_parser,
+																	  {"path": source, "func": args.func})
+			prepare_time = time.monotonic() - prepare_start
+
+			for run, config in pending:
+				run_dir = os.path.join(results, run)
+				corpus_dir = os.path.join(run_dir, "corpus.pack" if sweep_args.pack else "corpus")
+				if os.path.isdir(corpus_dir): # Left over from an interrupted run
+					shutil.rmtree(corpus_dir)
+				elif os.path.exists(corpus_dir):
+					os.remove(corpus_dir)
+				os.makedirs(run_dir, exist_ok=True)
+
+				print()
+				print(f"Generating {run} ...")
+				generate_args = dict(load_runs([config], 1, args.n)[0][1], max_new_tokens=decode_len)
+				generator = init.generator(args, generate_args, model, tokenizer, isOpenAI, seq2seq, stop_token, prefix_cache, draft_model)
+				if response_cache is not None:
+					generator = CachedGenerator(generator, response_cache, args.model, stop_token, generate_args, run)
+				stream = args.stream and (isOpenAI or generate_args.get('num_beams', 1) == 1)
+
+				start = timestamp()
+				generate_start = time.monotonic()
+				counts = [0, 0]
+				seedai.generate_seeds(args, generator, processor, [(input_ids, system_ids)], stream, [corpus_dir], [counts])
+				generate_time = time.monotonic() - generate_start
+				print()
+				print(f"	Generated {counts[0]} initial seed files, {counts[1]} unique.")
+
+				with open(os.path.join(run_dir, "meta.json"), "w") as file:
+					json.dump({
+						"source": source,
+						"model": args.model,
+						"config": config,
+						"pt_config": group["pt_config"],
+						"argv": group["argv"] + seedai_argv,
+						"encoded_tokens": len(input_ids),
+						"prepare_seconds": prepare_time,
+						"generate_seconds": generate_time,
+						"seeds": counts[0],
+						"unique_seeds": counts[1],
+					}, file, indent=4)
+
+				# data.out is written last, a run without it is generated again
+				with open(os.path.join(run_dir, "data.out"), "w") as file:
+					file.write(f"START: {start}\n")
+					file.write(f"SEEDS: {timestamp()}\n")
+
+				summary.append((source_name, group["kind"], run, counts[1], generate_time))
+
+	print()
+	print("Summary:")
+	for source_name, kind, run, unique_seeds, generate_time in summary:
+		print(f"	{source_name} {kind}/{run}: {unique_seeds} seeds in {generate_time:.1f}s")
+
+if __name__ == "__main__":
+	main()
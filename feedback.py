@@ -0,0 +1,113 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from corpus import list_seeds
+
+cov_re = re.compile(r"cov: ([0-9]+)")
+ft_re = re.compile(r"ft: ([0-9]+)")
+min_gain = 0.01 # Stop when a round adds less than 1% features
+max_examples = 5
+max_example_length = 256
+examples_func = "TestCoverage"
+
+def fuzz(fuzzer: str, corpus_dir: str, seconds: int) -> tuple[int, int]:
+	"""
+	Fuzz a copy of the corpus with libFuzzer for the given number of seconds (0 only runs the corpus).
+	Returns the last (cov, ft) counts reported by the fuzzer.
+	"""
+
+	with tempfile.TemporaryDirectory() as tmp:
+		corpus = os.path.join(tmp, "corpus")
+		shutil.copytree(corpus_dir, corpus) # libFuzzer adds new inputs to the corpus dir
+		limit = f"-max_total_time={seconds}" if seconds > 0 else "-runs=0"
+		result = subprocess.run([fuzzer, corpus, "-use_value_profile=1", limit],
+						  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+
+	coverage = None
+	for line in result.stderr.splitlines():
+		cov = cov_re.search(line)
+		ft = ft_re.search(line)
+		if cov is not None and ft is not None:
+			coverage = (int(cov.group(1)), int(ft.group(1)))
+
+	if coverage is None:
+		raise Exception(f"No coverage output from fuzzer {fuzzer} (exit status {result.returncode})")
+	return coverage
+
+def productive_seeds(fuzzer: str, corpus_dir: str) -> list[str]:
+	"""
+	Returns the paths of the seeds that add coverage (libFuzzer corpus minimization with -merge=1), smallest first.
+	"""
+
+	seeds = list_seeds(corpus_dir)
+	with tempfile.TemporaryDirectory() as merged:
+		# Merged inputs are named by their SHA1 hash, just like the corpus seeds
+		result = subprocess.run([fuzzer, "-merge=1", "-use_value_profile=1", merged, corpus_dir],
+						  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+		if result.returncode != 0:
+			raise Exception(f"Fuzzer {fuzzer} merge failed: {result.stderr.strip().splitlines()[-1:]}")
+		paths = [seeds[name] for name in os.listdir(merged) if name in seeds]
+
+	return sorted(paths, key=lambda path: (os.path.getsize(path), path))
+
+def examples_code(examples: list[bytes]) -> str:
+	"""
+	Go test code with example inputs, added in front of the parsed source code to ask for more inputs in the same style.
+	"""
+
+	lines = ["// Inputs that increased coverage", f"func {examples_func}() {{", "\tinputs := []string{"]
+	for example in examples:
+		value = example.decode('utf-8', 'replace')[:max_example_length]
+		lines.append("\t\t" + json.dumps(value, ensure_ascii=False) + ",") # JSON strings are valid Go strings
+	lines += ["\t}", "}", "", ""]
+	return "\n".join(lines)
+
+class FeedbackLoop:
+	"""
+	Coverage-guided seed generation: fuzz the corpus for a short budget, generate more seeds in the style
+	of the seeds that add coverage and repeat until the fuzzer features stop growing.
+	"""
+
+	def __init__(self, fuzzer: str, seconds: int, rounds: int):
+		self.fuzzer = fuzzer
+		self.seconds = seconds
+		self.rounds = rounds
+
+	def run(self, corpus_dir: str, generate) -> list[tuple]:
+		"""
+		Runs the loop for the corpus, generate(round, examples) generates seeds into the corpus and returns the number of new seeds.
+		Returns a (new seeds, cov, ft) tuple for each round, round 0 is the initial corpus.
+		"""
+
+		print()
+		print(f"Fuzzing {corpus_dir} for {self.seconds}s ...")
+		cov, ft = fuzz(self.fuzzer, corpus_dir, self.seconds)
+		print(f"	Round 0: cov {cov}, ft {ft}")
+		history = [(0, cov, ft)]
+
+		for i in range(1, self.rounds+1):
+			examples = []
+			for path in productive_seeds(self.fuzzer, corpus_dir)[:max_examples]:
+				with open(path, 'rb') as file:
+					examples.append(file.read())
+
+			new_seeds = generate(i, examples)
+			if new_seeds == 0:
+				print(f"	Round {i}: no new seeds, stopping")
+				history.append((0, cov, ft))
+				break
+
+			new_cov, new_ft = fuzz(self.fuzzer, corpus_dir, self.seconds)
+			print(f"	Round {i}: {new_seeds} new seeds, cov {new_cov}, ft {new_ft}")
+			history.append((new_seeds, new_cov, new_ft))
+
+			if new_ft - ft < min_gain*max(ft, 1):
+				print("	Coverage plateau, stopping")
+				break
+			cov, ft = new_cov, new_ft
+
+		return history
@@ -0,0 +1,344 @@
+import copy
+import queue
+import threading
+import time
+import torch
+import transformers
+from packaging import version
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from data_processor import template_tokens
+from metrics import metrics
+
+class HFGenerator:
+	def __init__(self, model, tokenizer, stop_token, seq2seq, progress=True, prefix_cache=None, draft_model=None, **kwargs):
+		self.progress = progress
+		self.prefix_cache = prefix_cache
+		self.draft_model = draft_model
+		self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
+		self.model = model
+		self.tokenizer = tokenizer
+		self.seq2seq = seq2seq
+		stop_token_id = template_tokens(tokenizer, stop_token)
+		if len(stop_token_id) == 1:
+			self.stop_token_id = stop_token_id[0]
+		else:
+			print("WARNING: too many tokens for stop_token_id, using only eos_token as stop token")
+			self.stop_token_id = tokenizer.eos_token_id
+
+		self.__dict__.update(kwargs)
+		if self.draft_model is not None and self.num_beams > 1:
+			print("	Assisted generation is not supported for beam search, generating without draft model")
+			self.draft_model = None
+
+	def generate(self, input_ids, _):
+		for _, output in self.generate_batch([(input_ids, [])]):
+			yield output
+
+	def generate_batch(self, prompts):
+		"""
+		Generate n outputs for each (input_ids, system_ids) prompt in one padded forward pass.
+		Prompts are left padded, yields (prompt index, output) tuples.
+		With a draft model (assisted generation supports a single sequence only) each output is generated separately.
+		"""
+
+		if self.draft_model is not None:
+			for i, prompt in enumerate(prompts):
+				for _ in range(self.n):
+					for _, output in self.generate_rows([prompt], 1):
+						yield i, output
+			return
+
+		for k, output in self.generate_rows(prompts, self.n):
+			yield k // self.n, output
+
+	def generate_rows(self, prompts, n):
+		stopping_criteria = StopTokenCriteria(self.stop_token_id, self.tokenizer.eos_token_id, self.tokenizer, self.progress)
+		outputs = self.model.generate(**self.generate_args(prompts, stopping_criteria, n))
+		stopping_criteria.finish(self.progress)
+
+		lengths = stopping_criteria.stop_lengths()
+		for k, output in enumerate(outputs):
+			output = output[stopping_criteria.prompt_length:] # Trim input from output
+			if self.num_beams == 1 and k < len(lengths) and lengths[k] > 0: # Beams are reordered, rows only match without beam search
+				output = output[:lengths[k]]
+			output = output[output != self.stop_token_id] # Remove stop token
+			yield k, self.tokenizer.decode(output, skip_special_tokens=True)
+
+	def generate_stream(self, prompts):
+		"""
+		Stream the outputs of all (input_ids, system_ids) prompts while they are being generated.
+		Yields (prompt index, sequence index, text) tuples for each decoded piece of text.
+		Not supported for beam search.
+		"""
+
+		if self.num_beams > 1:
+			raise Exception("Streaming is not supported for beam search")
+
+		if self.draft_model is not None:
+			for i, prompt in enumerate(prompts):
+				for j in range(self.n):
+					for _, text in self.stream_rows([prompt], 1):
+						yield i, i*self.n + j, text
+			return
+
+		for k, text in self.stream_rows(prompts, self.n):
+			yield k // self.n, k, text
+
+	def stream_rows(self, prompts, n):
+		stopping_criteria = StopTokenCriteria(self.stop_token_id, self.tokenizer.eos_token_id, self.tokenizer, self.progress)
+		streamer = RowStreamer(self.tokenizer, [self.stop_token_id, self.tokenizer.eos_token_id])
+		args = self.generate_args(prompts, stopping_criteria, n)
+
+		def run():
+			try:
+				self.model.generate(**args, streamer=streamer)
+			except Exception as e:
+				streamer.queue.put(e)
+			finally:
+				streamer.queue.put(None)
+
+		threading.Thread(target=run, daemon=True).start()
+		while True:
+			item = streamer.queue.get()
+			if item is None:
+				break
+			if isinstance(item, Exception):
+				raise item
+			yield item
+
+		stopping_criteria.finish(self.progress)
+
+	def generate_args(self, prompts, stopping_criteria, n):
+		if self.seq2seq == "codet5p" and len(prompts) > 1:
+			raise Exception("Batched generation is not supported for CodeT5+ decoder inputs")
+
+		pad_token_id = self.tokenizer.eos_token_id
+		max_length = max(len(input_ids) for input_ids, _ in prompts)
+		padded, attention_mask = [], []
+		for input_ids, _ in prompts:
+			padding = max_length - len(input_ids)
+			padded.append([pad_token_id]*padding + list(input_ids))
+			attention_mask.append([0]*padding + [1]*len(input_ids))
+
+		inputs = {
+			'input_ids': torch.as_tensor(padded).to(self.device),
+			'attention_mask': torch.as_tensor(attention_mask).to(self.device),
+		}
+		stopping_criteria.prompt_length = 1 if self.seq2seq else max_length # Encoder-decoder outputs start with the decoder start token
+		if self.seq2seq == "codet5p": # Only for bigger CodeT5+ models (and not fine-tuned)
+			inputs['decoder_input_ids'] = inputs['input_ids'].clone()
+			stopping_criteria.prompt_length = max_length
+		if self.draft_model is not None:
+			inputs['assistant_model'] = self.draft_model
+		elif self.prefix_cache is not None and len(prompts) == 1: # Padded batches change every run, only single prompts are reused
+			inputs.update(self.prefix_cache.inputs(self.model, inputs, bool(self.seq2seq), self.num_beams if self.num_beams > 1 else n))
+
+		if self.draft_model is None: # Assisted generation rejects the min length logits processor
+			inputs['min_new_tokens'] = 0
+
+		return dict(
+			**inputs,
+			temperature=self.temperature,
+			top_p=self.top_p,
+			max_new_tokens=self.max_new_tokens,
+			do_sample=self.do_sample,
+			num_return_sequences=n,
+			num_beams=self.num_beams,
+			num_beam_groups=self.num_beam_groups,
+			diversity_penalty=self.diversity_penalty,
+			repetition_penalty=self.repetition_penalty,
+			pad_token_id=pad_token_id,
+			stopping_criteria=StoppingCriteriaList([stopping_criteria]),
+			eos_token_id=self.stop_token_id,
+		)
+
+class PrefixCache:
+	"""
+	Keeps the encoded prompt of the last generation, so generating again for the same prompt
+	(other configs or repetitions) skips the prompt forward pass.
+	Causal models reuse the key/value cache of all but the last prompt token, encoder-decoder models the encoder outputs.
+	"""
+
+	def __init__(self):
+		self.key = None
+		self.value = None
+		self.hits = 0
+		self.misses = 0
+
+	def inputs(self, model, inputs: dict, encoder_decoder: bool, expand_size: int) -> dict:
+		"""
+		Returns the extra model.generate arguments for the (single row) inputs.
+		"""
+
+		key = (encoder_decoder, tuple(inputs['input_ids'][0].tolist()))
+		if self.key != key:
+			self.misses += 1
+			self.key = None # Do not keep a stale prefix if the forward pass fails
+			with torch.no_grad():
+				if encoder_decoder:
+					self.value = model.get_encoder()(input_ids=inputs['input_ids'], attention_mask=inputs['attention_mask'], return_dict=True)
+				else: # The last token is fed by generate to get the first logits
+					self.value = model(input_ids=inputs['input_ids'][:, :-1], attention_mask=inputs['attention_mask'][:, :-1], use_cache=True).past_key_values
+			self.key = key
+		else:
+			self.hits += 1
+
+		if encoder_decoder: # generate expands the encoder outputs in place
+			return {'encoder_outputs': type(self.value)(**self.value)}
+		return {'past_key_values': expand_cache(self.value, expand_size)}
+
+def expand_cache(past_key_values, expand_size: int):
+	"""
+	Returns a copy of the key/value cache for expand_size rows, because generate does not expand nor copy the cache.
+	"""
+
+	if isinstance(past_key_values, tuple): # Legacy cache format
+		return tuple(tuple(t.repeat_interleave(expand_size, dim=0) for t in layer) for layer in past_key_values)
+
+	past_key_values = copy.deepcopy(past_key_values)
+	if expand_size > 1:
+		past_key_values.batch_repeat_interleave(expand_size)
+	return past_key_values
+
+class RowStreamer:
+	"""
+	Streamer for model.generate that incrementally decodes every row of the batch.
+	A row ends at its first stop/eos token, the stop token itself is not streamed.
+	"""
+
+	def __init__(self, tokenizer, stop_token_ids):
+		self.tokenizer = tokenizer
+		self.stop_token_ids = stop_token_ids
+		self.queue = queue.Queue()
+		self.prompt = True
+		self.tokens = None
+		self.printed = None
+		self.done = None
+
+	def put(self, value):
+		if self.prompt: # The first call contains the prompt
+			self.prompt = False
+			return
+
+		if len(value.shape) == 1:
+			value = value[:, None]
+		rows = value.tolist() # Assisted generation puts all tokens accepted in a step at once
+		if self.tokens is None:
+			self.tokens = [[] for _ in rows]
+			self.printed = [0 for _ in rows]
+			self.done = [False for _ in rows]
+
+		for k, tokens in enumerate(rows):
+			for token in tokens:
+				if self.done[k]:
+					break
+				self.put_token(k, token)
+
+	def put_token(self, k, token):
+		if token in self.stop_token_ids:
+			self.done[k] = True
+			self.flush(k)
+			return
+
+		self.tokens[k].append(token)
+		text = self.tokenizer.decode(self.tokens[k], skip_special_tokens=True)
+		if text.endswith('\ufffd'): # Wait for the rest of an incomplete character
+			return
+
+		self.send(k, text)
+		if text.endswith('\n'): # Restart decoding on new lines to keep decoding linear
+			self.tokens[k] = []
+			self.printed[k] = 0
+
+	def flush(self, k):
+		if len(self.tokens[k]) > 0:
+			self.send(k, self.tokenizer.decode(self.tokens[k], skip_special_tokens=True))
+
+	def send(self, k, text):
+		if len(text) > self.printed[k]:
+			self.queue.put((k, text[self.printed[k]:]))
+		self.printed[k] = len(text)
+
+	def end(self):
+		if self.tokens is not None:
+			for k in range(len(self.tokens)):
+				if not self.done[k]:
+					self.flush(k)
+
+PER_ROW_CRITERIA = version.parse(transformers.__version__) >= version.parse("4.39.0") # Stopping criteria may return a done mask per row
+
+class StopTokenCriteria(StoppingCriteria):
+	"""
+	Stops generation once every row reached the stop or eos token.
+	The per-row done mask and generated lengths are kept as tensors on the device of the input ids.
+	Every call rescans all generated tokens: assisted generation appends several tokens per step
+	and also checks the unverified draft tokens, which are dropped again if the model rejects them.
+	"""
+
+	def __init__(self, stop_token_id, eos_token_id, tokenizer, progress=False, progress_interval=1.0, prompt_length=None):
+		self.generated = 0
+		self.prompt_length = prompt_length # Set by HFGenerator.generate_args, otherwise all but the last token of the first call
+		self.stop_token_ids = torch.as_tensor(sorted({t for t in (stop_token_id, eos_token_id) if t is not None})) # Some tokenizers have no eos token
+		self.done = None
+		self.lengths = None # Generated length (including stop token) of each row, 0 if the row did not reach a stop token
+		self.tokenizer = tokenizer
+		self.progress = progress
+		self.progress_interval = progress_interval
+		self.progress_time = 0
+		self.start_time = time.monotonic()
+		self.first_token_time = None # The first call is after the prompt forward pass (prefill)
+
+	def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+		if self.done is None:
+			self.first_token_time = time.monotonic()
+			if self.prompt_length is None:
+				self.prompt_length = input_ids.shape[-1] - 1
+			self.done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+			self.lengths = torch.zeros(input_ids.shape[0], dtype=torch.long, device=input_ids.device)
+			self.stop_token_ids = self.stop_token_ids.to(input_ids.device)
+
+		generated = input_ids[:, self.prompt_length:]
+		self.generated = generated.shape[-1]
+		if self.generated > 0: # The first draft of assisted generation can be empty
+			is_stop = torch.isin(generated, self.stop_token_ids)
+			self.done = is_stop.any(dim=-1)
+			self.lengths = torch.where(self.done, is_stop.int().argmax(dim=-1) + 1, 0) # Up to the first stop token of each row
+
+		if self.progress and time.monotonic() - self.progress_time >= self.progress_interval:
+			self.progress_time = time.monotonic()
+			print(f"\r	Generated {self.generated} tokens, {int(self.done.sum())}/{len(self.done)} sequences done", end='', flush=True)
+
+		if PER_ROW_CRITERIA: # generate reduces the mask on the device, no host sync per step
+			return self.done
+		return bool(self.done.all()) # Stop generate on either stop token or eos token
+
+	def tokens(self) -> int:
+		"""
+		Returns the number of generated tokens of all rows, up to and including their stop token.
+		"""
+
+		if self.lengths is None:
+			return 0
+		return int(torch.where(self.done, self.lengths, self.generated).sum())
+
+	def finish(self, report: bool):
+		"""
+		Record the prefill and decode time and the generated tokens, optionally printing the tokens/s.
+		"""
+
+		end_time = time.monotonic()
+		first_token_time = self.first_token_time or end_time
+		tokens = self.tokens()
+		metrics.add_time("prefill", first_token_time - self.start_time)
+		metrics.add_time("decode", end_time - first_token_time)
+		metrics.add("generated_tokens", tokens)
+
+		if report:
+			seconds = end_time - self.start_time
+			print(f"\r	Generated {tokens} tokens in {seconds:.1f}s ({tokens/max(seconds, 1e-9):.1f} tokens/s)", flush=True)
+
+	def stop_lengths(self) -> list[int]:
+		if self.lengths is None:
+			return []
+		return self.lengths.tolist()
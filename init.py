@@ -1,20 +1,24 @@
-import os, urllib, json
-from transformers import AutoConfig, AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer
-from peft import PeftModel
-import torch
-import tiktoken
+import os, json, functools
 
 from args import TYPE_SEQ2SEQ, TYPE_CAUSAL
-from data_processor import PromptTuneProcessor, FineTuneProcessor
-from generator import OpenAIGenerator, HFGenerator
+from data_processor import PromptTuneProcessor, FineTuneProcessor, ParserDaemon, ParserCache, run_parser
+from cache import ResponseCache
+from metrics import max_rss
 
-def model(args, isOpenAI):
+# The backends (torch, transformers, openai, tiktoken) are imported when they are used, so only the selected one is loaded
+
+def model(args, isOpenAI, name: str = None):
 	if isOpenAI:
 		return args.model
+	if name is None:
+		name = args.model
 
+	from transformers import AutoConfig, AutoModelForCausalLM, AutoModelForSeq2SeqLM
+	from peft import PeftModel
+	import torch
 
-	base_name, isLoRA = get_model_base_name(args.model)
-	name_or_path = args.model
+	base_name, isLoRA = get_model_base_name(name)
+	name_or_path = name
 	if isLoRA:
 		name_or_path = base_name
 
@@ -27,28 +31,115 @@ def model(args, isOpenAI):
 		if config.torch_dtype == torch.float16:
 			torch_dtype = torch.float16
 
+	cpu_mode = None
+	if device == "cpu" and args.cpu_optimize:
+		cpu_mode = cpu_optimize(args)
+		if cpu_mode == "bf16":
+			torch_dtype = torch.bfloat16
+
 	if args.type == TYPE_CAUSAL:
 		model = AutoModelForCausalLM.from_pretrained(name_or_path, torch_dtype=torch_dtype, trust_remote_code=True, device_map=args.device_map, low_cpu_mem_usage=True)
 	if args.type == TYPE_SEQ2SEQ:
 		model = AutoModelForSeq2SeqLM.from_pretrained(name_or_path, torch_dtype=torch_dtype, trust_remote_code=True, device_map=args.device_map, low_cpu_mem_usage=True)
 	if isLoRA:
-		model = PeftModel.from_pretrained(model, args.model, torch_dtype=torch_dtype, trust_remote_code=True, device_map=args.device_map, low_cpu_mem_usage=True)
+		model = PeftModel.from_pretrained(model, name, torch_dtype=torch_dtype, trust_remote_code=True, device_map=args.device_map, low_cpu_mem_usage=True)
 		model = model.merge_and_unload()
 
-	return model.to(device)
+	if cpu_mode == "int8": # Quantize the weights of the linear layers, activations are quantized on the fly
+		model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+	model = model.to(device)
+	print(f"	Model memory: {model_bytes(model)/2**20:.0f} MB, max RSS: {max_rss()/2**20:.0f} MB")
+	return model
+
+def draft_model(args, isOpenAI):
+	"""
+	Returns the small model of the same family (same tokenizer) that drafts tokens for assisted generation, or None.
+	"""
+
+	if isOpenAI or not args.draft_model:
+		return None
+
+	print("Loading draft model ...")
+	return model(args, isOpenAI, args.draft_model)
+
+def cpu_optimize(args) -> str:
+	"""
+	Set the CPU thread counts and return the CPU inference mode, auto uses bf16 if the CPU supports it natively, otherwise int8.
+	"""
+
+	import torch
+	threads = args.threads if args.threads > 0 else len(os.sched_getaffinity(0))
+	torch.set_num_threads(threads)
+	try:
+		torch.set_num_interop_threads(1) # generate runs a single graph at a time
+	except RuntimeError: # Can only be set before any parallel work
+		pass
+
+	mode = args.cpu_optimize
+	if mode == "auto":
+		mode = "bf16" if cpu_supports_bf16() else "int8"
+	print(f"	CPU optimize: {mode}, {threads} threads")
+	return mode
+
+def cpu_supports_bf16() -> bool:
+	try:
+		with open("/proc/cpuinfo") as file:
+			for line in file:
+				if line.startswith("flags"):
+					flags = line.split()
+					return "avx512_bf16" in flags or "amx_bf16" in flags
+	except OSError:
+		pass
+	return False
+
+def model_bytes(model) -> int:
+	"""
+	Returns the size of the model weights and buffers, including packed int8 weights.
+	"""
+
+	import torch
+	def size(value):
+		if isinstance(value, torch.Tensor):
+			return value.numel() * value.element_size()
+		if isinstance(value, (tuple, list)):
+			return sum(size(v) for v in value)
+		return 0
+
+	return sum(size(value) for value in model.state_dict().values())
+
+tokenizers = {}
+processors = {}
 
 def tokenizer(args):
+	"""
+	Returns the tokenizer, whether it is an OpenAI model and the seq2seq model type (with -ft without prompt tuning).
+	The tokenizer is loaded once per model, so it is shared by all prompt configs.
+	"""
+
+	key = (args.model, args.type, args.legacy, args.length)
+	if key not in tokenizers:
+		tokenizers[key] = load_tokenizer(args)
+
+	tokenizer, isOpenAI, seq2seq = tokenizers[key]
+	if seq2seq and not args.prompt_tuning:
+		seq2seq += "-ft"
+	return tokenizer, isOpenAI, seq2seq
+
+def load_tokenizer(args):
 	try:
 		tokenizer = OpenAITokenizer(args.model, args.legacy)
 		isOpenAI = True
 		isLoRA = False
-	except KeyError:
+	except (KeyError, ImportError): # Not an OpenAI model (or tiktoken is not installed)
+		from transformers import AutoTokenizer
 		base_name, isLoRA = get_model_base_name(args.model)
 		tokenizer = AutoTokenizer.from_pretrained(base_name, trust_remote_code=True)
 		isOpenAI = False
 
 	seq2seq = False
 	if not isOpenAI and args.type == TYPE_SEQ2SEQ:
+		from transformers import AutoConfig
 		name_or_path = args.model
 		if isLoRA:
 			name_or_path = base_name
@@ -57,8 +148,6 @@ def tokenizer(args):
 			tokenizer.model_max_length = 2048 # Overwrite incorrect max length for small codet5+
 			tokenizer.extra_token_id = tokenizer.encode("<extra_id_0>", add_special_tokens=False)[0]
 		seq2seq = config.model_type
-		if not args.prompt_tuning:
-			seq2seq += "-ft"
 
 	if args.length > 0:
 		tokenizer.model_max_length = args.length
@@ -85,21 +174,84 @@ def get_model_base_name(name_or_path: str) -> str:
 
 def processor(args, seq2seq, tokenizer, isOpenAI):
 	if args.type == TYPE_CAUSAL or seq2seq == "codet5p": # Big codet5+ uses input in ouput (except ft)
-		max_encode_length = int(tokenizer.model_max_length*.75) # reserve 1/4 of model max length for generation (TODO: should depend on args.gen_length if set)
+		reserved = int(tokenizer.model_max_length*.25) # reserve 1/4 of model max length for generation
+		if args.gen_length > 0:
+			reserved = min(reserved, args.gen_length) # or less if the generation length is shorter
+		max_encode_length = tokenizer.model_max_length - reserved
 	elif args.type == TYPE_SEQ2SEQ:
 		max_encode_length = tokenizer.model_max_length
 	if isOpenAI and not args.legacy:
 		max_encode_length -= 11 # OpenAI uses 11 extra tokens for role (system, user) input
 
-	if args.prompt_tuning:
-		processor = PromptTuneProcessor(tokenizer, seq2seq, max_encode_length, args.pt_count, **args.prompt_tuning)
-	else:
-		processor = FineTuneProcessor(tokenizer, seq2seq, args.split, max_encode_length)
+	# Processors (and their template token ids) are built once per tokenizer and prompt config
+	key = (tokenizer, seq2seq, max_encode_length, str(args.pt_count), json.dumps(args.prompt_tuning, sort_keys=True), args.split)
+	if key not in processors:
+		if args.prompt_tuning:
+			processors[key] = PromptTuneProcessor(tokenizer, seq2seq, max_encode_length, args.pt_count, **args.prompt_tuning)
+		else:
+			processors[key] = FineTuneProcessor(tokenizer, seq2seq, args.split, max_encode_length)
+
+	return processors[key]
+
+def generator(args, generate_args, model, tokenizer, isOpenAI, seq2seq, stop_token, prefix_cache=None, draft_model=None):
+	if isOpenAI and args.concurrency > 0:
+		from openai_async import AsyncOpenAIGenerator
+		return AsyncOpenAIGenerator(model, tokenizer, stop_token, args.legacy,
+							  concurrency=args.concurrency, limiter=rate_limiter(args), **generate_args)
+	if isOpenAI:
+		from openai_generator import OpenAIGenerator
+		return OpenAIGenerator(model, tokenizer, stop_token, args.legacy, **generate_args)
+
+	from hf_generator import HFGenerator
+	generator = HFGenerator(model, tokenizer, stop_token, seq2seq, not args.no_progress, prefix_cache, draft_model, **generate_args)
+	if args.workers > 1:
+		if generator.device != "cpu":
+			raise Exception("Workers are only supported for CPU inference")
+		from workers import WorkerPool
+		return WorkerPool(generator, args.workers)
+	return generator
+
+rate_limiters = {}
+
+def rate_limiter(args):
+	"""
+	Returns the OpenAI rate limiter of the process, so the --rpm and --tpm budgets hold across all targets and configs.
+	"""
+
+	from openai_async import RateLimiter
+	key = (args.rpm, args.tpm)
+	if key not in rate_limiters:
+		rate_limiters[key] = RateLimiter(args.rpm, args.tpm)
+	return rate_limiters[key]
+
+def prefix_cache(args, isOpenAI):
+	if isOpenAI or args.no_prefix_cache:
+		return None
+
+	from hf_generator import PrefixCache
+	return PrefixCache()
+
+def parser(args):
+	if args.parser_daemon:
+		return ParserDaemon(args.parser).parse
+
+	return functools.partial(run_parser, args.parser)
+
+def parser_cache(args, parse):
+	if not args.parser_cache:
+		return None
+
+	return ParserCache(args.parser_cache, args.parser, parse)
+
+def response_cache(args):
+	if not args.cache or args.no_cache:
+		return None
 
-	return processor
+	return ResponseCache(args.cache, args.cache_size*1024*1024)
 
 class OpenAITokenizer: # Wrapper class to make OpenAI tokenizer compatible
 	def __init__(self, name: str, legacy: bool):
+		import tiktoken
 		if legacy:
 			split = name.split(':', 1)
 			self.enc = tiktoken.encoding_for_model(split[0])
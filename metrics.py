@@ -0,0 +1,125 @@
+import contextlib
+import datetime
+import json
+import os
+import time
+
+def max_rss() -> int:
+	import resource
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # KB on Linux
+
+class Metrics:
+	"""
+	Collects the time of each stage (model load, parse, encode, prefill, decode, extract, write ...),
+	counters (tokens, OpenAI usage, seeds) and the results of each target and run for the --report JSON.
+	"""
+
+	def __init__(self):
+		self.started = datetime.datetime.now().isoformat(timespec='seconds')
+		self.start_time = time.monotonic()
+		self.stages = {}
+		self.counters = {}
+		self.runs = []
+
+	@contextlib.contextmanager
+	def stage(self, name: str):
+		start = time.monotonic()
+		try:
+			yield
+		finally:
+			self.add_time(name, time.monotonic() - start)
+
+	def add_time(self, name: str, seconds: float):
+		stage = self.stages.setdefault(name, {"seconds": 0.0, "count": 0})
+		stage["seconds"] += seconds
+		stage["count"] += 1
+
+	def add(self, name: str, value: int = 1):
+		self.counters[name] = self.counters.get(name, 0) + value
+
+	def merge(self, other: dict):
+		"""
+		Add the stages and counters of another (worker process) report.
+		"""
+
+		for name, stage in other.get("stages", {}).items():
+			total = self.stages.setdefault(name, {"seconds": 0.0, "count": 0})
+			total["seconds"] += stage["seconds"]
+			total["count"] += stage["count"]
+		for name, value in other.get("counters", {}).items():
+			self.add(name, value)
+
+	def record_run(self, target: dict, name: str, seeds: int, unique_seeds: int, seconds: float, error: Exception = None):
+		self.runs.append({
+			"path": target['path'],
+			"func": target['func'],
+			"run": name,
+			"seeds": seeds,
+			"unique_seeds": unique_seeds,
+			"seconds": seconds,
+			"seeds_per_second": seeds / max(seconds, 1e-9),
+			"unique_ratio": unique_seeds / seeds if seeds > 0 else 0.0,
+			"error": None if error is None else (str(error) or repr(error)),
+		})
+
+	def seconds(self, stage: str) -> float:
+		return self.stages.get(stage, {}).get("seconds", 0.0)
+
+	def report(self) -> dict:
+		seconds = time.monotonic() - self.start_time
+		seeds = self.counters.get("seeds", 0)
+		generate_seconds = self.seconds("generate")
+		decode_seconds = self.seconds("decode_wall") if "decode_wall" in self.stages else self.seconds("decode") # decode is summed over workers
+		return {
+			"started": self.started,
+			"seconds": seconds,
+			"max_rss_bytes": max_rss(),
+			"stages": self.stages,
+			"counters": self.counters,
+			"decode_tokens_per_second": self.counters.get("generated_tokens", 0) / max(decode_seconds, 1e-9),
+			"seeds_per_second": seeds / max(generate_seconds, 1e-9),
+			"unique_ratio": self.counters.get("unique_seeds", 0) / seeds if seeds > 0 else 0.0,
+			"runs": self.runs,
+		}
+
+	def write(self, path: str):
+		tmp_path = path + ".tmp"
+		with open(tmp_path, "w") as file:
+			json.dump(self.report(), file, indent=4)
+		os.replace(tmp_path, path)
+
+metrics = Metrics() # Shared by all modules of a seedai.py process
+
+@contextlib.contextmanager
+def profile(cprofile_path: str = None, torch_path: str = None):
+	"""
+	Optionally profile the enclosed code with cProfile (pstats file) and/or torch.profiler (Chrome trace json).
+	"""
+
+	profiler = None
+	if cprofile_path:
+		import cProfile
+		profiler = cProfile.Profile()
+
+	with contextlib.ExitStack() as stack:
+		torch_profiler = None
+		if torch_path:
+			import torch # Only import torch when the torch profiler is used
+			activities = [torch.profiler.ProfilerActivity.CPU]
+			if torch.cuda.is_available():
+				activities.append(torch.profiler.ProfilerActivity.CUDA)
+			torch_profiler = stack.enter_context(torch.profiler.profile(activities=activities))
+
+		if profiler is not None:
+			profiler.enable()
+		try:
+			yield
+		finally:
+			if profiler is not None:
+				profiler.disable()
+				profiler.dump_stats(cprofile_path)
+				print(f"cProfile stats saved to {cprofile_path}")
+
+	if torch_profiler is not None:
+		torch_profiler.export_chrome_trace(torch_path)
+		print(f"torch.profiler trace saved to {torch_path}")
@@ -0,0 +1,191 @@
+import asyncio
+import collections
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from openai_generator import OpenAIGenerator, add_usage
+
+default_api_base = "https://api.openai.com/v1"
+chat_role_tokens = 11 # OpenAI uses 11 extra tokens for role (system, user) input
+
+class RateLimiter:
+	"""
+	Sliding one minute window for the requests and tokens per minute budgets.
+	A budget of 0 disables the limit.
+	One limiter is shared by all generators of a run, each generate_batch runs its own event loop, so the state is guarded
+	by a thread lock that is never held while waiting.
+	"""
+
+	def __init__(self, rpm: int = 0, tpm: int = 0, clock=time.monotonic):
+		self.rpm = rpm
+		self.tpm = tpm
+		self.clock = clock
+		self.window = collections.deque() # [time, tokens] per request in the last minute
+		self.tokens = 0
+		self.lock = threading.Lock()
+
+	def expire(self, now: float):
+		while len(self.window) > 0 and now - self.window[0][0] >= 60:
+			self.tokens -= self.window.popleft()[1]
+
+	def wait_time(self, tokens: int) -> float:
+		now = self.clock()
+		self.expire(now)
+		if len(self.window) == 0: # Always allow a single request, even if it exceeds the token budget
+			return 0
+		if (self.rpm <= 0 or len(self.window) < self.rpm) and (self.tpm <= 0 or self.tokens + tokens <= self.tpm):
+			return 0
+
+		return 60 - (now - self.window[0][0])
+
+	async def acquire(self, tokens: int) -> list:
+		"""
+		Wait until the request fits in the budgets and reserve it.
+		Returns the reserved entry, which can be corrected with the actual usage using update.
+		"""
+
+		while True:
+			with self.lock:
+				wait = self.wait_time(tokens)
+				if wait <= 0:
+					entry = [self.clock(), tokens]
+					self.window.append(entry)
+					self.tokens += tokens
+					return entry
+			await asyncio.sleep(wait)
+
+	def update(self, entry: list, tokens: int):
+		with self.lock:
+			if any(e is entry for e in self.window): # Only entries in the current window count towards the budget
+				self.tokens += tokens - entry[1]
+			entry[1] = tokens
+
+class RetryableError(Exception):
+	def __init__(self, message: str, retry_after: float = None):
+		super().__init__(message)
+		self.retry_after = retry_after
+
+class AsyncOpenAIGenerator(OpenAIGenerator):
+	"""
+	OpenAI generator that keeps up to `concurrency` requests in flight using asyncio.
+	Requests are scheduled within the requests/tokens per minute budgets and 429/5xx responses are retried with jittered backoff.
+	"""
+
+	def __init__(self, model, tokenizer, stop_token, legacy, concurrency=8, rpm=0, tpm=0, limiter=None,
+			max_retries=6, backoff=1.0, max_backoff=60.0, timeout=600, api_base=None, **kwargs):
+		super().__init__(model, tokenizer, stop_token, legacy, **kwargs)
+		self.api_key = os.environ.get('OPENAI_API_KEY')
+		self.api_base = (api_base or os.environ.get('OPENAI_API_BASE', default_api_base)).rstrip('/')
+		self.concurrency = concurrency
+		self.limiter = limiter or RateLimiter(rpm, tpm) # Pass a shared limiter to enforce the budgets across generators
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.timeout = timeout
+
+	def generate(self, input_ids, system_ids):
+		for _, output in self.generate_batch([(input_ids, system_ids)]):
+			yield output
+
+	def generate_batch(self, prompts):
+		"""
+		Run the requests for all (input_ids, system_ids) prompts concurrently.
+		Yields (prompt index, output) tuples in order of completion.
+		"""
+
+		results = queue.Queue()
+		def run():
+			try:
+				asyncio.run(self.run(prompts, results.put))
+			except Exception as e:
+				results.put(e)
+			finally:
+				results.put(None)
+
+		threading.Thread(target=run, daemon=True).start()
+		while True:
+			result = results.get()
+			if result is None:
+				break
+			if isinstance(result, Exception):
+				raise result
+			yield result
+
+	def generate_stream(self, prompts):
+		# Outputs are only streamed per completed request to keep the requests concurrent
+		counts = {}
+		for i, output in self.generate_batch(prompts):
+			counts[i] = counts.get(i, 0) + 1
+			yield i, counts[i]-1, output
+
+	async def run(self, prompts, callback):
+		semaphore = asyncio.Semaphore(self.concurrency)
+
+		async def run_prompt(i, input_ids, system_ids):
+			args = self.request_args(input_ids, system_ids)
+			tokens = len(input_ids) + self.n*self.max_new_tokens # Max tokens are counted against the budget
+			if not self.legacy:
+				tokens += chat_role_tokens
+
+			async with semaphore:
+				entry = await self.limiter.acquire(tokens)
+				completion = await self.request(args)
+
+			if 'usage' in completion:
+				self.limiter.update(entry, completion['usage']['total_tokens'])
+			add_usage(completion)
+
+			for choice in completion['choices']:
+				if self.legacy:
+					callback((i, choice['text']))
+				else:
+					callback((i, choice['message']['content']))
+
+		await asyncio.gather(*[run_prompt(i, *prompt) for i, prompt in enumerate(prompts)])
+
+	async def request(self, args) -> dict:
+		for attempt in range(self.max_retries+1):
+			try:
+				return await asyncio.to_thread(self.post, args)
+			except RetryableError as e:
+				if attempt == self.max_retries:
+					raise Exception(f"OpenAI request failed after {attempt+1} attempts: {str(e)}")
+
+				delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt)) # Full jitter
+				if e.retry_after is not None:
+					delay = max(delay, e.retry_after)
+				print(f"	OpenAI request failed ({str(e)}), retrying in {delay:.1f}s ...", flush=True)
+				await asyncio.sleep(delay)
+
+	def post(self, args) -> dict:
+		endpoint = "/completions" if self.legacy else "/chat/completions"
+		request = urllib.request.Request(
+			self.api_base + endpoint,
+			data=json.dumps(args).encode('utf-8'),
+			headers={
+				"Content-Type": "application/json",
+				"Authorization": f"Bearer {self.api_key}",
+			},
+		)
+
+		try:
+			with urllib.request.urlopen(request, timeout=self.timeout) as response:
+				return json.load(response)
+		except urllib.error.HTTPError as e:
+			body = e.read().decode('utf-8', 'replace')
+			if e.code == 429 or e.code >= 500:
+				retry_after = e.headers.get('Retry-After')
+				try:
+					retry_after = float(retry_after) if retry_after is not None else None
+				except ValueError:
+					retry_after = None
+				raise RetryableError(f"HTTP {e.code}", retry_after)
+			raise Exception(f"OpenAI error: HTTP {e.code}: {body}")
+		except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+			raise RetryableError(str(e))
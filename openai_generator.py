@@ -0,0 +1,119 @@
+import json
+import os
+
+from args import printd
+from data_processor import template_text
+from metrics import metrics
+
+def add_usage(completion: dict):
+	"""
+	Add the token usage of an OpenAI completion to the run metrics.
+	"""
+
+	metrics.add("openai_requests")
+	usage = completion.get('usage')
+	if usage:
+		metrics.add("openai_prompt_tokens", usage.get('prompt_tokens', 0))
+		metrics.add("openai_completion_tokens", usage.get('completion_tokens', 0))
+
+class OpenAIGenerator:
+	def __init__(self, model, tokenizer, stop_token, legacy, **kwargs):
+		self.model = model
+		self.tokenizer = tokenizer
+		self.legacy = legacy
+		self.stop_token = stop_token
+		self.__dict__.update(kwargs)
+
+	def request_args(self, input_ids, system_ids):
+		args = {
+			"model": self.model,
+			"temperature": self.temperature,
+			"top_p": self.top_p,
+			"stop": self.stop_token,
+			"n": self.n,
+			"frequency_penalty": self.repetition_penalty,
+			"presence_penalty": self.presence_penalty,
+		}
+
+		if self.legacy:
+			args["prompt"] = self.tokenizer.decode(input_ids)
+			args["max_tokens"] = self.max_new_tokens # Default is not infinity for legacy
+		else:
+			messages = []
+			input_str = None
+			if len(system_ids) > 0:
+				system_str = template_text(self.tokenizer, tuple(system_ids))
+				if input_ids[:len(system_ids)] == system_ids: # The input ids start with the system ids, only decode the rest
+					input_str = self.tokenizer.decode(input_ids[len(system_ids):])
+				else:
+					input_str = self.tokenizer.decode(input_ids).replace(system_str, '')
+				messages.append({
+					"role": "system",
+					"content": system_str
+				})
+			if input_str is None:
+				input_str = self.tokenizer.decode(input_ids)
+
+			messages.append({
+				"role": "user",
+				"content": input_str
+			})
+
+			args["messages"] = messages
+
+			printd("-----------OPENAI CALL------------") # For debugging
+			printd(json.dumps(messages, indent=4))
+			printd("----------------------------------")
+
+		return args
+
+	def client(self):
+		import openai # Only import the OpenAI client when it is used
+		openai.api_key = os.environ.get('OPENAI_API_KEY')
+		return openai
+
+	def generate(self, input_ids, system_ids):
+		openai = self.client()
+		args = self.request_args(input_ids, system_ids)
+		if self.legacy:
+			completion = openai.Completion.create(**args)
+		else:
+			print('	Waiting for OpenAI result ...', end='', flush=True)
+			completion = openai.ChatCompletion.create(**args)
+		add_usage(completion)
+
+		for choice in completion.choices:
+			if self.legacy:
+				yield choice.text
+			else:
+				yield choice.message.content
+
+	def generate_batch(self, prompts):
+		for i, (input_ids, system_ids) in enumerate(prompts):
+			for output in self.generate(input_ids, system_ids):
+				yield i, output
+
+	def generate_stream(self, prompts):
+		"""
+		Stream the outputs of all (input_ids, system_ids) prompts.
+		Yields (prompt index, sequence index, text) tuples for each received chunk.
+		"""
+
+		openai = self.client()
+		for i, (input_ids, system_ids) in enumerate(prompts):
+			args = self.request_args(input_ids, system_ids)
+			args["stream"] = True
+			if self.legacy:
+				completion = openai.Completion.create(**args)
+			else:
+				completion = openai.ChatCompletion.create(**args)
+			metrics.add("openai_requests") # Streamed completions do not report their usage
+
+			for chunk in completion:
+				for choice in chunk.choices:
+					if self.legacy:
+						text = choice.text
+					else:
+						text = choice.delta.get("content", "")
+					if text:
+						yield i, choice.index, text
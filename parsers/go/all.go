@@ -0,0 +1,156 @@
+package main
+
+import (
+	"go/ast"
+	"go/parser"
+	"go/token"
+	"path/filepath"
+	"regexp"
+	"sort"
+	"strings"
+	"unicode"
+	"unicode/utf8"
+)
+
+// Top-level declarations start at the beginning of a line (gofmt), the same split as split_chunks in data_processor.py
+var declRe = regexp.MustCompile(`^(func|type|var|const)\b`)
+
+type target struct {
+	Func   string `json:"func"`
+	Chunks []int  `json:"chunks,omitempty"`
+	Error  string `json:"error,omitempty"`
+}
+
+// allResponse is the -all output: the code of each target is the concatenation of its chunks,
+// declarations that several targets share (callees, types) are only included once in chunks.
+type allResponse struct {
+	Chunks  []string `json:"chunks"`
+	Targets []target `json:"targets"`
+}
+
+// parseAll returns the code of every fuzz function of the package.
+// Each function is a separate scparser.Parse call: scparser loads the package and builds the call graph per call
+// and cannot extract several functions from one load, so -all saves the process starts, not the package analysis.
+func parseAll(pkgPath string, codeOnly bool) (allResponse, error) {
+	names, err := fuzzFuncs(pkgPath)
+	if err != nil {
+		return allResponse{}, err
+	}
+
+	res := allResponse{Chunks: []string{}, Targets: []target{}}
+	index := make(map[string]int)
+	for _, name := range names {
+		t := target{Func: name}
+		code, err := parseFunc(pkgPath, name, codeOnly)
+		if err != nil {
+			t.Error = err.Error()
+		} else {
+			for _, chunk := range splitChunks(code) {
+				i, ok := index[chunk]
+				if !ok {
+					i = len(res.Chunks)
+					index[chunk] = i
+					res.Chunks = append(res.Chunks, chunk)
+				}
+				t.Chunks = append(t.Chunks, i)
+			}
+		}
+		res.Targets = append(res.Targets, t)
+	}
+
+	return res, nil
+}
+
+// fuzzFuncs returns the sorted names of the fuzz functions (func FuzzXxx(*testing.F)) in the package directory.
+func fuzzFuncs(pkgPath string) ([]string, error) {
+	files, err := filepath.Glob(filepath.Join(pkgPath, "*.go"))
+	if err != nil {
+		return nil, err
+	}
+
+	fset := token.NewFileSet()
+	var names []string
+	for _, file := range files {
+		f, err := parser.ParseFile(fset, file, nil, parser.SkipObjectResolution)
+		if err != nil {
+			return nil, err
+		}
+		for _, decl := range f.Decls {
+			fn, ok := decl.(*ast.FuncDecl)
+			if ok && fn.Recv == nil && isFuzzName(fn.Name.Name) && isFuzzParams(fn.Type.Params) {
+				names = append(names, fn.Name.Name)
+			}
+		}
+	}
+
+	sort.Strings(names)
+	return names, nil
+}
+
+// isFuzzName reports whether the name is Fuzz or FuzzXxx, where Xxx does not start with a lower case letter (go test rule).
+func isFuzzName(name string) bool {
+	if !strings.HasPrefix(name, "Fuzz") {
+		return false
+	}
+	if len(name) == len("Fuzz") {
+		return true
+	}
+	r, _ := utf8.DecodeRuneInString(name[len("Fuzz"):])
+	return !unicode.IsLower(r)
+}
+
+// isFuzzParams reports whether the parameters are a single *testing.F.
+func isFuzzParams(params *ast.FieldList) bool {
+	if params == nil || len(params.List) != 1 || len(params.List[0].Names) > 1 {
+		return false
+	}
+	star, ok := params.List[0].Type.(*ast.StarExpr)
+	if !ok {
+		return false
+	}
+	sel, ok := star.X.(*ast.SelectorExpr)
+	if !ok {
+		return false
+	}
+	pkg, ok := sel.X.(*ast.Ident)
+	return ok && pkg.Name == "testing" && sel.Sel.Name == "F"
+}
+
+// splitChunks splits parser output into the text before the first declaration, one chunk per top-level declaration
+// (including its doc comment) and a closing code fence, so that the chunks concatenate to the original code.
+func splitChunks(code string) []string {
+	lines := strings.SplitAfter(code, "\n")
+	var starts []int
+	for i, line := range lines {
+		if !declRe.MatchString(line) {
+			continue
+		}
+		start := i
+		for start > 0 && (len(starts) == 0 || start > starts[len(starts)-1]+1) && strings.HasPrefix(lines[start-1], "//") {
+			start--
+		}
+		starts = append(starts, start)
+	}
+
+	end := len(lines)
+	for end > 0 && strings.TrimSpace(lines[end-1]) == "" {
+		end--
+	}
+	fence := end > 0 && strings.TrimSpace(lines[end-1]) == "```" && (len(starts) == 0 || end-1 > starts[len(starts)-1])
+	if fence {
+		end--
+	}
+
+	bounds := append([]int{0}, starts...)
+	bounds = append(bounds, end)
+	var chunks []string
+	for i := 0; i+1 < len(bounds); i++ {
+		if chunk := strings.Join(lines[bounds[i]:bounds[i+1]], ""); chunk != "" {
+			chunks = append(chunks, chunk)
+		}
+	}
+	if rest := strings.Join(lines[end:], ""); rest != "" {
+		chunks = append(chunks, rest)
+	}
+	return chunks
+}
@@ -1,13 +1,32 @@
 package main
 
 import (
+	"bufio"
+	"crypto/sha256"
+	"encoding/hex"
+	"encoding/json"
 	"flag"
 	"fmt"
+	"io"
 	"os"
+	"path/filepath"
+	"sort"
+	"strings"
 
 	"github.com/elwint/scparser"
 )
 
+type request struct {
+	Func     string `json:"func"`
+	CodeOnly bool   `json:"code_only"`
+	Path     string `json:"path"`
+}
+
+type response struct {
+	Code  string `json:"code"`
+	Error string `json:"error,omitempty"`
+}
+
 func main() {
 	if os.Getenv(`GO111MODULE`) == `off` {
 		panic(`go mod required`)
@@ -16,16 +35,42 @@ func main() {
 	var funcName string
 	var codeOnly bool
 	var pkgPath string
+	var serve bool
+	var all bool
 
 	flag.StringVar(&funcName, "func", "", "Name of the function to parse")
 	flag.BoolVar(&codeOnly, "code", false, "Return code only")
 	flag.StringVar(&pkgPath, "p", ".", "Package path (optional)")
+	flag.BoolVar(&serve, "serve", false, "Answer JSON-line requests on stdin until EOF (optional)")
+	flag.BoolVar(&all, "all", false, "Parse all Fuzz* functions of the package and print JSON (optional)")
 
 	flag.Parse()
 
+	if serve {
+		if err := serveRequests(pkgPath); err != nil {
+			fmt.Fprintln(os.Stderr, err)
+			os.Exit(1)
+		}
+		return
+	}
+
+	if all {
+		res, err := parseAll(pkgPath, codeOnly)
+		if err == nil {
+			err = json.NewEncoder(os.Stdout).Encode(res)
+		}
+		if err != nil {
+			fmt.Fprintln(os.Stderr, err)
+			os.Exit(1)
+		}
+		return
+	}
+
 	if funcName == "" {
 		fmt.Println("Missing function name")
 		fmt.Println("Usage: goparser -func func_name [-code] [-p pkg_path]")
+		fmt.Println("       goparser -all [-code] [-p pkg_path]")
+		fmt.Println("       goparser -serve [-p default_pkg_path]")
 		flag.PrintDefaults()
 		os.Exit(1)
 	}
@@ -33,3 +78,115 @@ func main() {
 	code := scparser.Parse(pkgPath, funcName, false, codeOnly)
 	fmt.Println(code)
 }
+
+// packageResults are the parse results of one version of a package.
+type packageResults struct {
+	hash    string
+	results map[request]response
+}
+
+// serveRequests answers one {"func", "code_only", "path"} JSON request per line with a {"code", "error"} JSON line.
+// Results are kept until a source file of the package changes, so repeated requests do not parse the package again.
+// scparser.Parse loads the package itself, so requests for other functions of the same package still load it again.
+func serveRequests(defaultPath string) error {
+	packages := make(map[string]packageResults)
+	scanner := bufio.NewScanner(os.Stdin)
+	scanner.Buffer(make([]byte, 64*1024), 16*1024*1024)
+	encoder := json.NewEncoder(os.Stdout)
+
+	for scanner.Scan() {
+		var req request
+		if err := json.Unmarshal(scanner.Bytes(), &req); err != nil {
+			if err := encoder.Encode(response{Error: err.Error()}); err != nil {
+				return err
+			}
+			continue
+		}
+		if req.Path == "" {
+			req.Path = defaultPath
+		}
+
+		hash, err := packageHash(req.Path)
+		if err != nil {
+			if err := encoder.Encode(response{Error: err.Error()}); err != nil {
+				return err
+			}
+			continue
+		}
+		pkg, ok := packages[req.Path]
+		if !ok || pkg.hash != hash { // Drop the results of a changed package
+			pkg = packageResults{hash: hash, results: make(map[request]response)}
+			packages[req.Path] = pkg
+		}
+
+		res, ok := pkg.results[req]
+		if !ok {
+			res = parse(req)
+			pkg.results[req] = res
+		}
+
+		if err := encoder.Encode(res); err != nil {
+			return err
+		}
+	}
+
+	return scanner.Err()
+}
+
+// packageHash returns a hash of the package's .go files, go.mod and go.sum (the files the ParserCache key covers).
+func packageHash(pkgPath string) (string, error) {
+	entries, err := os.ReadDir(pkgPath)
+	if err != nil {
+		return "", err
+	}
+
+	var names []string
+	for _, entry := range entries {
+		name := entry.Name()
+		if !strings.HasSuffix(name, ".go") && name != "go.mod" && name != "go.sum" {
+			continue
+		}
+		if info, err := os.Stat(filepath.Join(pkgPath, name)); err == nil && info.Mode().IsRegular() {
+			names = append(names, name)
+		}
+	}
+	sort.Strings(names)
+
+	h := sha256.New()
+	for _, name := range names {
+		file, err := os.Open(filepath.Join(pkgPath, name))
+		if err != nil {
+			return "", err
+		}
+		fmt.Fprintf(h, "\x00%s\x00", name)
+		_, err = io.Copy(h, file)
+		file.Close()
+		if err != nil {
+			return "", err
+		}
+	}
+	return hex.EncodeToString(h.Sum(nil)), nil
+}
+
+func parse(req request) response {
+	if req.Func == "" {
+		return response{Error: "missing function name"}
+	}
+
+	code, err := parseFunc(req.Path, req.Func, req.CodeOnly)
+	if err != nil { // Keep serving after a failed parse
+		return response{Error: err.Error()}
+	}
+	return response{Code: code}
+}
+
+// parseFunc returns the code of a function and its callees, a panic of the parser is returned as an error.
+func parseFunc(pkgPath, funcName string, codeOnly bool) (code string, err error) {
+	defer func() {
+		if r := recover(); r != nil {
+			err = fmt.Errorf("%v", r)
+		}
+	}()
+
+	return scparser.Parse(pkgPath, funcName, false, codeOnly), nil
+}
@@ -1,32 +1,53 @@
 #!/bin/python3
 import os
-import hashlib
 import json
+import time
 
-from args import parse_args, TYPE_SEQ2SEQ, printd
-from data_processor import run_parser
-from generator import OpenAIGenerator, HFGenerator
+from args import parse_args, load_runs, TYPE_SEQ2SEQ, printd
+from cache import CachedGenerator
+from data_processor import run_parser_all
+from corpus import get_writer, save_seeds, is_pack, pack_suffix
+from dedup import get_filter
+from feedback import FeedbackLoop, examples_code, examples_func
+from metrics import metrics, profile
 import init
 
 def main():
 	print("Loading config ...")
-	args, generate_args = parse_args()
-	print(json.dumps(generate_args, indent=4))
+	args, runs = parse_args()
+	with profile(args.profile, args.torch_profile):
+		try:
+			run(args, runs)
+		finally:
+			if args.report:
+				metrics.write(args.report)
+				print(f"Report saved to {args.report}")
+
+def run(args, runs):
+	"""
+	Generate the seeds of all targets with all (name, generate_args) runs and run the feedback loops.
+	"""
+
+	for name, generate_args in runs:
+		if len(runs) > 1:
+			print(f"{name}:")
+		print(json.dumps(generate_args, indent=4))
 	if args.prompt_tuning:
 		print(json.dumps(args.prompt_tuning, indent=4))
 
-	# Create corpus dir if not exists
-	os.makedirs(args.corpus, exist_ok=True)
+	targets = load_targets(args)
 
 	print("Loading tokenizer ...")
-	tokenizer, isOpenAI, seq2seq = init.tokenizer(args)
+	with metrics.stage("tokenizer_load"):
+		tokenizer, isOpenAI, seq2seq = init.tokenizer(args)
 	printd("SEQ2SEQ: " + str(seq2seq))
 	print("	EOS token:", tokenizer.eos_token)
 
 	if isOpenAI and 'OPENAI_API_KEY' not in os.environ:
 		raise Exception("Please set OPENAI_API_KEY env variable")
 
-	processor = init.processor(args, seq2seq, tokenizer, isOpenAI)
+	with metrics.stage("processor_init"):
+		processor = init.processor(args, seq2seq, tokenizer, isOpenAI)
 
 	total_max_length = tokenizer.model_max_length
 	if args.type == TYPE_SEQ2SEQ and seq2seq != "codet5p": # Big codet5+ uses input in ouput (except ft)
@@ -35,95 +56,350 @@ def main():
 	print("	Max encode tokens:", processor.max_encode_length)
 
 	print("Loading model ...")
-	model = init.model(args, isOpenAI)
+	with metrics.stage("model_load"):
+		model = init.model(args, isOpenAI)
+		draft_model = init.draft_model(args, isOpenAI)
+	prefix_cache = init.prefix_cache(args, isOpenAI)
+	parser = init.parser(args)
+	parser_cache = init.parser_cache(args, parser)
+	if parser_cache is not None:
+		parser = parser_cache.parse
+	response_cache = init.response_cache(args)
+	targets, parser = expand_targets(args, targets, parser, parser_cache)
 
-	print("Parsing code ...")
+	summary = []
+	for start in range(0, len(targets), args.batch_size):
+		summary += run_batch(args, runs, tokenizer, isOpenAI, seq2seq, processor, parser, model, draft_model, prefix_cache, response_cache, targets[start:start+args.batch_size])
+
+	feedback_runs = runs
+	if args.feedback_configs:
+		feedback_runs = load_runs(args.feedback_configs, 1, args.n)
+	for target, name, _, _, error in summary:
+		if error is None and target['fuzzer']:
+			try:
+				if is_pack(target['corpus']):
+					raise Exception("The feedback loop requires a corpus directory, unpack the corpus pack first")
+				run_feedback(args, feedback_runs, tokenizer, isOpenAI, seq2seq, processor, parser, model, draft_model, prefix_cache, target, run_corpus(target, name))
+			except Exception as e:
+				print(f"	Feedback loop failed: {str(e)}")
+				if len(summary) == 1:
+					raise
+
+	if parser_cache is not None:
+		print(f"	Parser cache: {parser_cache.hits} hits, {parser_cache.misses} misses")
+	if response_cache is not None:
+		print(f"	Response cache: {response_cache.hits} hits, {response_cache.misses} misses")
+	if prefix_cache is not None and prefix_cache.hits > 0:
+		print(f"	Prefix cache: {prefix_cache.hits} hits, {prefix_cache.misses} misses")
+
+	if len(summary) == 1:
+		if summary[0][4] is not None:
+			raise summary[0][4]
+		return
+
+	print()
+	print("Summary:")
+	for target, name, total, new_seeds, error in summary:
+		label = f"{target['path']} {target['func']}"
+		if name is not None:
+			label += f" {name}"
+		if error is not None:
+			print(f"	{label}: failed ({str(error)})")
+		else:
+			print(f"	{label}: {total} seeds, {new_seeds} new -> {run_corpus(target, name)}")
+
+	failed = sum(1 for s in summary if s[4] is not None)
+	if failed > 0:
+		raise Exception(f"{failed} of {len(summary)} runs failed")
+
+def load_targets(args) -> list[dict]:
+	"""
+	Return the list of targets to generate seeds for.
+	Without a manifest this is the single target given by --func and --corpus in the current directory.
+	Each manifest entry requires a package "path"; "func" defaults to --func,
+	"corpus" defaults to --corpus inside the package path and "fuzzer" defaults to --feedback.
+	"""
+
+	if not args.manifest:
+		return [{"path": ".", "func": args.func, "corpus": args.corpus, "fuzzer": args.feedback}]
+
+	targets = []
+	for entry in args.manifest:
+		if "path" not in entry:
+			raise Exception(f"Manifest entry without path: {json.dumps(entry)}")
+		targets.append({
+			"path": entry["path"],
+			"func": entry.get("func", args.func),
+			"corpus": entry.get("corpus", os.path.join(entry["path"], args.corpus)),
+			"fuzzer": entry.get("fuzzer", args.feedback),
+		})
+
+	return targets
+
+def expand_targets(args, targets: list[dict], parser, parser_cache=None) -> tuple[list[dict], object]:
+	"""
+	Replace each target with func "*" by a target for every Fuzz function of its package, saved in <corpus>/<func>.
+	All functions of a package are parsed by one goparser -all process (always a separate process, also with --parser-daemon),
+	the parsed code is added to the parser cache.
+	Returns the targets and a parse function that returns the parsed code and falls back to the given parser.
+	"""
 
 	code_only = False
 	if args.prompt_tuning:
 		code_only = args.prompt_tuning['code_only']
 
-	source_code = run_parser(args.parser, args.func, code_only)
-	input_ids, system_ids = processor.encode(source_code)
-	printd("--------------INPUT---------------") # For debugging
-	printd(tokenizer.decode(input_ids))
-	printd("----------------------------------")
-	print("	Encoded tokens:", len(input_ids))
+	parsed = {}
+	errors = {}
+	expanded = []
+	for target in targets:
+		if target['func'] != "*":
+			expanded.append(target)
+			continue
 
-	decode_len = tokenizer.model_max_length-len(input_ids)
-	if args.type == TYPE_SEQ2SEQ and seq2seq != "codet5p":
-		decode_len = tokenizer.model_max_length
+		print(f"Parsing all Fuzz functions in {target['path']} ...")
+		try:
+			with metrics.stage("parse"):
+				functions = run_parser_all(args.parser, code_only, target['path'])
+		except Exception as e: # Fails when the target is prepared, like a single function
+			print(f"	Failed: {str(e)}")
+			errors[target['path']] = e
+			expanded.append(target)
+			continue
 
-	if args.gen_length != -1 and decode_len > args.gen_length:
-		decode_len = args.gen_length
+		print(f"	{len(functions)} Fuzz functions: {', '.join(functions)}")
+		for func, code in functions.items():
+			if code is not None:
+				parsed[(func, code_only, target['path'])] = code
+				if parser_cache is not None:
+					parser_cache.put(func, code_only, target['path'], code)
+			expanded.append({**target, "func": func, "corpus": run_corpus(target, func)})
 
-	generate_args['max_new_tokens'] = decode_len
-	print("	Max decode tokens:", decode_len)
+	def parse(func_name: str, code_only: bool, pkg_path: str = ".") -> str:
+		if func_name == "*" and pkg_path in errors:
+			raise errors[pkg_path]
+		if (func_name, code_only, pkg_path) in parsed:
+			return parsed[(func_name, code_only, pkg_path)]
+		return parser(func_name, code_only, pkg_path)
 
-	print("Generating ...")
+	if len(parsed) == 0 and len(errors) == 0:
+		return targets, parser
+	return expanded, parse
+
+def run_corpus(target: dict, name: str) -> str:
+	"""
+	Returns the corpus directory of a run, each run of multiple configs/repetitions gets its own subdirectory.
+	With a corpus pack (<corpus>.pack) each run gets its own pack in the <corpus> directory.
+	"""
+
+	if name is None:
+		return target['corpus']
+	if is_pack(target['corpus']):
+		return os.path.join(target['corpus'][:-len(pack_suffix)], name + pack_suffix)
+	return os.path.join(target['corpus'], name)
+
+def run_batch(args, runs, tokenizer, isOpenAI, seq2seq, processor, parser, model, draft_model, prefix_cache, response_cache, targets: list[dict]) -> list[tuple]:
+	"""
+	Parse, encode, generate and save the seeds for a batch of targets using an already loaded model.
+	The targets are parsed and encoded once for all (name, generate_args) runs, and the prompts
+	of all targets in the batch are passed to the generator at once.
+	Returns a (target, run name, total seeds, new unique seeds, error) tuple for each target and run.
+	"""
+
+	results = {}
+	prompts = []
+	for i, target in enumerate(targets):
+		if args.manifest or args.func == "*":
+			print()
+			print(f"Target: {target['func']} in {target['path']}")
+		try:
+			prompts.append((i, prepare_target(args, tokenizer, seq2seq, processor, parser, target)))
+		except Exception as e: # Do not let one broken target stop the whole batch
+			for name, _ in runs:
+				results[(i, name)] = (target, name, 0, 0, e)
+
+	if len(prompts) == 0:
+		return [results[(i, name)] for i in range(len(targets)) for name, _ in runs]
+
+	# All prompts in a batch share the same decode length
+	decode_len = min(prompt[2] for _, prompt in prompts)
+	print("	Max decode tokens:", decode_len)
 
 	stop_token = processor.stop_token()
 	printd("STOP TOKEN: "+json.dumps(stop_token))
-	if isOpenAI:
-		generator = OpenAIGenerator(model, tokenizer, stop_token, args.legacy, **generate_args)
-	else:
-		generator = HFGenerator(model, tokenizer, stop_token, seq2seq, **generate_args)
-
-	total = 0
-	new_seeds = 0
-	for output in generator.generate(input_ids, system_ids):
-		printd("--------------OUTPUT--------------")  # For debugging
-		printd(output)
-		printd("----------------------------------")
 
-		seeds = processor.extract(output)
+	for name, generate_args in runs:
+		print()
+		if name is not None:
+			print(f"Generating {name} ...")
+		else:
+			print("Generating ...")
+
+		generate_args = dict(generate_args, max_new_tokens=decode_len)
+		corpus_dirs = {i: run_corpus(targets[i], name) for i, _ in prompts}
+		counts = {i: [0, 0] for i, _ in prompts}
+		start_time = time.monotonic()
+		try:
+			generator = init.generator(args, generate_args, model, tokenizer, isOpenAI, seq2seq, stop_token, prefix_cache, draft_model)
+			if response_cache is not None:
+				generator = CachedGenerator(generator, response_cache, args.model, stop_token, generate_args, name)
 
-		printd("----------EXTRACTED SEEDS---------")
-		for seed in seeds:
-			printd(seed)
-			printd("----------------------------------")
+			generate_seeds(args, generator, processor, [prompt[:2] for _, prompt in prompts], use_stream(args, isOpenAI, generate_args),
+						   [corpus_dirs[i] for i, _ in prompts], [counts[i] for i, _ in prompts])
+			for i, (total, new_seeds) in counts.items():
+				results[(i, name)] = (targets[i], name, total, new_seeds, None)
+		except Exception as e:
+			for i in counts:
+				results[(i, name)] = (targets[i], name, 0, 0, e)
 
-		new_seeds += save_seeds(args.corpus, seeds)
+		seconds = time.monotonic() - start_time # The targets of a batch are generated together and share the time
+		for i, (total, new_seeds) in counts.items():
+			metrics.record_run(targets[i], name, total, new_seeds, seconds, results[(i, name)][4])
 
-		total += len(seeds)
-	
-	print()
-	print(f"	Generated {total} initial seed files.")
-	print(f"	Total new unique seeds saved: {new_seeds}")
+		print()
+		for i, (total, new_seeds) in counts.items():
+			if len(targets) > 1:
+				print(f"	{targets[i]['func']} in {targets[i]['path']}:")
+			print(f"	Generated {total} initial seed files.")
+			print(f"	Total new unique seeds saved: {new_seeds}")
 
-def save_seeds(corpus_dir: str, seeds: list[str]) -> int:
+	return [results[(i, name)] for i in range(len(targets)) for name, _ in runs]
+
+def use_stream(args, isOpenAI: bool, generate_args: dict) -> bool:
+	if args.stream and not isOpenAI and generate_args.get('num_beams', 1) > 1:
+		print("	Streaming is not supported for beam search, generating without streaming")
+		return False
+	return args.stream
+
+def run_feedback(args, runs, tokenizer, isOpenAI, seq2seq, processor, parser, model, draft_model, prefix_cache, target: dict, corpus_dir: str):
 	"""
-	Save each output as a file in the given directory after converting it to bytes.
-	The filename is the SHA1 hash of its content.
-	If a file already exists, it skips the seed.
-	Raises an exception if there's an error.
+	Generate more seeds for the target until its coverage stops growing, see FeedbackLoop.
+	Each round prompts with the seeds that added coverage and uses the next (name, generate_args) run.
 	"""
 
-	new_seeds = 0
+	def generate(i, examples):
+		input_ids, system_ids, decode_len = prepare_target(args, tokenizer, seq2seq, processor, parser, target, examples)
+		name, generate_args = runs[(i-1) % len(runs)]
+		if name is not None:
+			print(f"Generating round {i} with {name} ...")
+		else:
+			print(f"Generating round {i} ...")
 
-	for seed in seeds:
-		# Convert string to bytes
-		seed_bytes = seed.encode('utf-8', 'surrogatepass')
+		generate_args = dict(generate_args, max_new_tokens=decode_len)
+		generator = init.generator(args, generate_args, model, tokenizer, isOpenAI, seq2seq, processor.stop_token(), prefix_cache, draft_model)
+		counts = [0, 0]
+		start_time = time.monotonic()
+		generate_seeds(args, generator, processor, [(input_ids, system_ids)], use_stream(args, isOpenAI, generate_args), [corpus_dir], [counts])
+		metrics.record_run(target, f"feedback_{i}", counts[0], counts[1], time.monotonic() - start_time)
+		print()
+		return counts[1]
 
-		# Calculate SHA1 hash of the bytes
-		sha1_hash = hashlib.sha1(seed_bytes).hexdigest()
+	FeedbackLoop(target['fuzzer'], args.feedback_time, args.feedback_rounds).run(corpus_dir, generate)
 
-		# Construct the full path to save the file
-		file_path = os.path.join(corpus_dir, sha1_hash)
+def generate_seeds(args, generator, processor, prompts: list[tuple], stream: bool, corpus_dirs: list[str], counts: list[list[int]]):
+	"""
+	Generate the outputs of all (input_ids, system_ids) prompts, extract the seeds and save them in the corpus directory of each prompt.
+	The number of seeds and new unique seeds of each prompt are added to its counts.
+	With --dedup the near-duplicates are dropped before saving (counted as seeds, but not as new seeds).
+	The generate stage time includes the extract and write stages.
+	"""
 
-		if os.path.exists(file_path):
-			continue
+	for corpus_dir in corpus_dirs:
+		if not is_pack(corpus_dir): # A pack (and its directory) is created by its writer
+			os.makedirs(corpus_dir, exist_ok=True) # Create corpus dir if not exists
+
+	def save(k, seeds):
+		counts[k][0] += len(seeds)
+		metrics.add("seeds", len(seeds))
+		if args.dedup:
+			with metrics.stage("dedup"):
+				kept = get_filter(corpus_dirs[k], args.dedup).filter(seeds)
+			metrics.add("near_duplicates", len(seeds) - len(kept))
+			seeds = kept
+
+		with metrics.stage("write"):
+			new_seeds = save_extracted(corpus_dirs[k], seeds, args.shard)
+		counts[k][1] += new_seeds
+		metrics.add("unique_seeds", new_seeds)
 
+	with metrics.stage("generate"):
 		try:
-			# Write bytes to the file
-			with open(file_path, 'wb') as file:
-				file.write(seed_bytes)
-			new_seeds += 1
-		except Exception as e:
-			raise Exception(f"Error while writing to file {file_path}: {str(e)}")
+			if stream:
+				# Save each seed as soon as it is complete
+				extractors = {}
+				for k, j, text in generator.generate_stream(prompts):
+					if (k, j) not in extractors:
+						extractors[(k, j)] = processor.extractor()
+					with metrics.stage("extract"):
+						seeds = extractors[(k, j)].feed(text)
+					save(k, seeds)
+				for (k, _), extractor in extractors.items():
+					with metrics.stage("extract"):
+						seeds = extractor.finish()
+					save(k, seeds)
+					print_output(extractor.raw)
+			else:
+				for k, output in generator.generate_batch(prompts):
+					print_output(output)
+					with metrics.stage("extract"):
+						seeds = processor.extract(output)
+					save(k, seeds)
+		finally:
+			with metrics.stage("write"):
+				for corpus_dir in corpus_dirs:
+					get_writer(corpus_dir, args.shard).flush() # Write the index of corpus packs
+
+def prepare_target(args, tokenizer, seq2seq, processor, parser, target, examples: list[bytes] = None) -> tuple[list[int], list[int], int]:
+	"""
+	Parse and encode the source code of a single target, optionally with example seeds in front of the code.
+	Returns the input ids, system ids and the max decode length for the target.
+	"""
+
+	print("Parsing code ...")
+
+	code_only = False
+	if args.prompt_tuning:
+		code_only = args.prompt_tuning['code_only']
+
+	with metrics.stage("parse"):
+		source_code = parser(target['func'], code_only, target['path'])
+	roots = [target['func']]
+	if examples:
+		source_code = examples_code(examples) + source_code
+		roots.append(examples_func)
+	with metrics.stage("encode"):
+		input_ids, system_ids = processor.encode(source_code, roots)
+	if args.debug: # Only decode the input for debugging
+		printd("--------------INPUT---------------")
+		printd(tokenizer.decode(input_ids))
+		printd("----------------------------------")
+	print("	Encoded tokens:", len(input_ids))
 
-	return new_seeds
+	decode_len = tokenizer.model_max_length-len(input_ids)
+	if args.type == TYPE_SEQ2SEQ and seq2seq != "codet5p":
+		decode_len = tokenizer.model_max_length
+
+	if args.gen_length != -1 and decode_len > args.gen_length:
+		decode_len = args.gen_length
+
+	return input_ids, system_ids, decode_len
+
+def print_output(output: str):
+	printd("--------------OUTPUT--------------")  # For debugging
+	printd(output)
+	printd("----------------------------------")
+
+def save_extracted(corpus_dir: str, seeds: list[str], shard: bool) -> int:
+	"""
+	Save the seeds extracted from a model output in the corpus directory.
+	Returns the number of new unique seeds saved.
+	"""
+
+	printd("----------EXTRACTED SEEDS---------")
+	for seed in seeds:
+		printd(seed)
+		printd("----------------------------------")
 
+	return get_writer(corpus_dir, shard).save(seeds)
 
 if __name__ == "__main__":
 	main()
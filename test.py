@@ -1,8 +1,15 @@
 #!/bin/python3
 import unittest
 import os
+import sys
 import hashlib
+import importlib.util
 import tempfile
+import json
+import threading
+import asyncio
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 from seedai import save_seeds
 from data_processor import extract_values
@@ -30,6 +37,28 @@ class TestSaveSeeds(unittest.TestCase):
 				content = file.read()
 				self.assertEqual(expected_bytes_list[idx], content)
 
+	def test_corpus_writer(self):
+		from corpus import CorpusWriter, export_flat
+		outputs = ["a", "b", "a"]
+		writer = CorpusWriter(self.corpus_dir, shard=True)
+		self.assertEqual(2, writer.save(outputs))
+
+		sha1_hash = hashlib.sha1(b"a").hexdigest()
+		self.assertTrue(os.path.exists(os.path.join(self.corpus_dir, sha1_hash[:2], sha1_hash)))
+
+		# Existing flat and sharded seeds are loaded once
+		self.assertEqual(1, save_seeds(self.corpus_dir, ["a", "c"]))
+		writer = CorpusWriter(self.corpus_dir)
+		self.assertEqual(0, writer.save(["a", "b", "c"]))
+
+		from unittest import mock
+		with mock.patch("corpus.list_seeds", side_effect=AssertionError("corpus listed")): # One-shot saves check each seed
+			self.assertEqual(1, save_seeds(self.corpus_dir, ["b", "c", "d", "d"]))
+
+		with tempfile.TemporaryDirectory() as flat_dir:
+			self.assertEqual(4, export_flat(self.corpus_dir, flat_dir))
+			self.assertEqual(sorted(hashlib.sha1(v).hexdigest() for v in [b"a", b"b", b"c", b"d"]), sorted(os.listdir(flat_dir)))
+
 	def tearDown(self):
 		# Cleanup after each test to remove temporary directory
 		for root, dirs, files in os.walk(self.corpus_dir, topdown=False):
@@ -113,5 +142,915 @@ class TestDataProcessor(unittest.TestCase):
 		result = extract_values(test_string, True)
 		self.assertEqual(expected, result)
 
+	def test_parse_escaped(self):
+		from data_processor import parse_escaped
+		self.assertEqual('a"b\n', parse_escaped('a\\"b\\n'))
+		self.assertEqual('ab', parse_escaped('a" "b')) # Implicit string concatenation
+		self.assertEqual('x"y', parse_escaped('x\\"" "y'))
+
+		# Not a string literal, the original value is kept
+		self.assertEqual('x" + "y', parse_escaped('x" + "y'))
+		self.assertEqual('a"', parse_escaped('a"'))
+		self.assertEqual('a\\', parse_escaped('a\\'))
+		self.assertEqual('\\x4', parse_escaped('\\x4'))
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+	failures = 0 # Number of 429 responses before succeeding
+
+	def do_POST(self):
+		args = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+		self.server.requests.append(args)
+		if len(self.server.requests) <= self.failures:
+			self.send_response(429)
+			self.send_header('Retry-After', '0')
+			self.end_headers()
+			return
+
+		content = args['messages'][-1]['content']
+		body = json.dumps({
+			"choices": [{"message": {"content": f"{content} {k}"}} for k in range(args['n'])],
+			"usage": {"total_tokens": 5},
+		}).encode('utf-8')
+		self.send_response(200)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+class StubTokenizer:
+	def decode(self, tokens):
+		return ''.join(chr(t) for t in tokens)
+
+class StubEncoder(StubTokenizer):
+	eos_token = "<eos>"
+
+	def encode(self, text, add_special_tokens=False):
+		return [ord(c) for c in text]
+
+class TestAsyncOpenAI(unittest.TestCase):
+	def setUp(self):
+		self.servers = []
+
+	def start_server(self, failures):
+		handler = type('Handler', (StubOpenAIHandler,), {'failures': failures})
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+		self.server.requests = []
+		self.servers.append(self.server)
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+	def generator(self, api_base, **kwargs):
+		from openai_async import AsyncOpenAIGenerator
+		return AsyncOpenAIGenerator("gpt-4", StubTokenizer(), "}", False, api_base=api_base, backoff=0.01,
+							  temperature=1.0, top_p=1.0, n=2, repetition_penalty=1.0, presence_penalty=1.0, max_new_tokens=10, **kwargs)
+
+	def test_generate_batch(self):
+		generator = self.generator(self.start_server(0), concurrency=3)
+		prompts = [([ord(c) for c in f"p{i}"], []) for i in range(5)]
+		result = sorted(generator.generate_batch(prompts))
+		expected = sorted((i, f"p{i} {k}") for i in range(5) for k in range(2))
+		self.assertEqual(expected, result)
+		self.assertEqual(5, len(self.server.requests))
+
+	def test_retry(self):
+		generator = self.generator(self.start_server(2), max_retries=2)
+		result = list(generator.generate([ord('a')], []))
+		self.assertEqual(["a 0", "a 1"], result)
+		self.assertEqual(3, len(self.server.requests))
+
+		generator = self.generator(self.start_server(3), max_retries=2)
+		with self.assertRaises(Exception):
+			list(generator.generate([ord('a')], []))
+
+	def test_rate_limiter(self):
+		from openai_async import RateLimiter
+		now = [0]
+		limiter = RateLimiter(rpm=2, tpm=100, clock=lambda: now[0])
+		entry = asyncio.run(limiter.acquire(50))
+		self.assertEqual(0, limiter.wait_time(50))
+		self.assertEqual(60, limiter.wait_time(51)) # Tokens budget reached
+
+		limiter.update(entry, 30) # Actual usage
+		self.assertEqual(0, limiter.wait_time(70))
+
+		now[0] = 10
+		asyncio.run(limiter.acquire(10))
+		self.assertEqual(50, limiter.wait_time(1)) # Requests budget reached
+
+		now[0] = 60
+		self.assertEqual(0, limiter.wait_time(90))
+		self.assertEqual(10, limiter.wait_time(91))
+
+	def test_shared_limiter(self):
+		import argparse
+		import init
+		args = argparse.Namespace(rpm=1, tpm=0, concurrency=2, legacy=False)
+		generate_args = dict(temperature=1.0, top_p=1.0, n=1, repetition_penalty=1.0, presence_penalty=1.0, max_new_tokens=10)
+		generators = [init.generator(args, generate_args, "gpt-4", StubTokenizer(), True, False, "}") for _ in range(2)]
+		self.assertIs(generators[0].limiter, generators[1].limiter) # The budgets hold across targets and configs
+
+		api_base = self.start_server(0)
+		for generator in generators:
+			generator.api_base = api_base
+		self.assertEqual([(0, "a 0")], list(generators[0].generate_batch([([ord('a')], [])]))) # Separate event loops
+		self.assertGreater(generators[1].limiter.wait_time(1), 59) # Within the requests per minute budget of the first run
+		init.rate_limiters.clear()
+
+	def tearDown(self):
+		for server in self.servers:
+			server.shutdown()
+			server.server_close()
+
+class StubGenerator:
+	def __init__(self):
+		self.calls = 0
+
+	def generate_batch(self, prompts):
+		self.calls += 1
+		for i, (input_ids, _) in enumerate(prompts):
+			yield i, f"output {input_ids[0]}"
+
+requires_torch = unittest.skipUnless(importlib.util.find_spec("torch") and importlib.util.find_spec("transformers"), "torch and transformers are not installed")
+
+@requires_torch
+class TestStopTokenCriteria(unittest.TestCase):
+	def test_rows(self):
+		import torch
+		from hf_generator import StopTokenCriteria
+		criteria = StopTokenCriteria(9, None, None) # No eos token
+		input_ids = torch.as_tensor([
+			[1, 1, 5, 9, 5, 5],
+			[1, 1, 5, 5, 5, 9],
+			[1, 1, 9, 9, 5, 5],
+		])
+		self.assertEqual([False, False, True], criteria(input_ids[:, :3], None).tolist()) # Done mask per row, reduced by generate
+		self.assertEqual([0, 0, 1], criteria.stop_lengths())
+		self.assertEqual([True, False, True], criteria(input_ids[:, :4], None).tolist())
+		self.assertEqual([2, 0, 1], criteria.stop_lengths()) # The second stop token of row 3 is ignored
+		self.assertFalse(criteria(input_ids[:, :5], None).all())
+		self.assertEqual(2 + 3 + 1, criteria.tokens())
+		self.assertTrue(criteria(input_ids, None).all())
+		self.assertEqual([2, 4, 1], criteria.stop_lengths())
+		self.assertEqual(7, criteria.tokens())
+
+	def test_multi_token_steps(self):
+		import torch
+		from hf_generator import StopTokenCriteria
+		criteria = StopTokenCriteria(9, 0, None, prompt_length=2)
+		input_ids = torch.as_tensor([[1, 1, 5, 5, 5, 9, 5, 5]])
+		self.assertFalse(criteria(input_ids[:, :3], None))
+		self.assertTrue(criteria(input_ids, None)) # Assisted step with 5 accepted tokens, the stop token in the middle
+		self.assertEqual([4], criteria.stop_lengths())
+		self.assertEqual(4, criteria.tokens())
+
+		criteria = StopTokenCriteria(9, 0, None, prompt_length=2)
+		self.assertFalse(criteria(input_ids[:, :2], None)) # Empty first draft
+		self.assertTrue(criteria(input_ids[:, :6], None)) # Draft tokens up to the stop token
+		self.assertFalse(criteria(input_ids[:, :4], None)) # The model rejected the last two draft tokens
+		self.assertEqual([0], criteria.stop_lengths())
+		self.assertEqual(2, criteria.tokens())
+
+	def test_assisted_generate(self):
+		import torch
+		from hf_generator import HFGenerator, RowStreamer
+
+		class Tokenizer(StubEncoder):
+			eos_token_id = 0
+			def decode(self, tokens, skip_special_tokens=False):
+				return ''.join(chr(t) for t in torch.as_tensor(tokens).tolist())
+
+		class AssistedModel:
+			steps = [[ord('a')], [ord('b'), ord('c'), 9, ord('x')]] # Tokens accepted per assisted step
+			def generate(self, input_ids, stopping_criteria, streamer=None, **kwargs):
+				if streamer is not None:
+					streamer.put(input_ids)
+				for step in self.steps:
+					input_ids = torch.cat([input_ids, torch.as_tensor([step])], dim=-1)
+					if streamer is not None:
+						streamer.put(torch.as_tensor([step]))
+					if stopping_criteria[0](input_ids, None):
+						break
+				return input_ids
+
+		generator = HFGenerator(AssistedModel(), Tokenizer(), "\t", False, False, draft_model=AssistedModel(), n=2, num_beams=1,
+								num_beam_groups=1, temperature=1.0, top_p=1.0, do_sample=True, diversity_penalty=0.0,
+								repetition_penalty=1.0, max_new_tokens=10)
+		self.assertEqual([(0, "abc"), (0, "abc"), (1, "abc"), (1, "abc")],
+						 list(generator.generate_batch([([1, 2, 3], []), ([4, 5], [])])))
+		self.assertEqual("abc", "".join(text for i, j, text in generator.generate_stream([([1, 2, 3], [])]) if j == 0))
+
+	def test_assisted_hf_model(self):
+		import torch
+		from transformers import GPT2Config, GPT2LMHeadModel, T5Config, T5ForConditionalGeneration
+		from hf_generator import HFGenerator
+
+		class Tokenizer(StubEncoder):
+			eos_token_id = 0
+			def decode(self, tokens, skip_special_tokens=False):
+				return ''.join(chr(t) for t in torch.as_tensor(tokens).tolist())
+
+		torch.manual_seed(0)
+		models = [
+			(GPT2LMHeadModel(GPT2Config(vocab_size=128, n_positions=64, n_embd=16, n_layer=2, n_head=2)), False),
+			(T5ForConditionalGeneration(T5Config(vocab_size=128, d_model=16, d_kv=8, d_ff=32, num_layers=2, num_heads=2,
+												 decoder_start_token_id=0, pad_token_id=0, eos_token_id=0)), True),
+		]
+		args = dict(n=1, num_beams=1, num_beam_groups=1, temperature=1.0, top_p=1.0, do_sample=False, diversity_penalty=0.0,
+					repetition_penalty=1.0, max_new_tokens=12)
+		prompts = [([65, 66, 67], []), ([70, 71], [])]
+		for model, seq2seq in models: # The model is its own draft, so greedy outputs must match
+			model.eval()
+			greedy = list(HFGenerator(model, Tokenizer(), "\t", seq2seq, False, **args).generate_batch(prompts))
+			assisted = HFGenerator(model, Tokenizer(), "\t", seq2seq, False, draft_model=model, **args)
+			self.assertEqual(greedy, list(assisted.generate_batch(prompts)))
+			self.assertEqual(greedy[0][1], "".join(text for i, j, text in assisted.generate_stream(prompts) if j == 0))
+
+@requires_torch
+class TestPrefixCache(unittest.TestCase):
+	def test_inputs(self):
+		import types
+		import torch
+		from hf_generator import PrefixCache
+
+		calls = []
+		class Model:
+			def __call__(self, input_ids, attention_mask, use_cache):
+				calls.append(input_ids.tolist())
+				layer = (input_ids[:, None, :, None].float(), input_ids[:, None, :, None].float()) # (batch, heads, length, dim)
+				return types.SimpleNamespace(past_key_values=(layer,))
+
+			def get_encoder(self):
+				def encoder(input_ids, attention_mask, return_dict):
+					calls.append(input_ids.tolist())
+					return dict(last_hidden_state=input_ids.float())
+				return encoder
+
+		def inputs(input_ids):
+			return {'input_ids': torch.as_tensor([input_ids]), 'attention_mask': torch.ones(1, len(input_ids), dtype=torch.long)}
+
+		model = Model()
+		cache = PrefixCache()
+		past = cache.inputs(model, inputs([1, 2, 3]), False, 2)['past_key_values']
+		self.assertEqual([[[1, 2]]], calls) # All but the last prompt token
+		self.assertEqual((2, 1, 2, 1), tuple(past[0][0].shape))
+		past = cache.inputs(model, inputs([1, 2, 3]), False, 1)['past_key_values']
+		self.assertEqual((1, 1, 2, 1), tuple(past[0][0].shape))
+		self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+		encoder_outputs = cache.inputs(model, inputs([1, 2, 3]), True, 1)['encoder_outputs'] # Same prompt, other model type
+		self.assertEqual((1, 2), (cache.hits, cache.misses))
+		self.assertIsNot(cache.value, cache.inputs(model, inputs([1, 2, 3]), True, 1)['encoder_outputs'])
+		self.assertEqual([[1.0, 2.0, 3.0]], encoder_outputs['last_hidden_state'].tolist())
+		cache.inputs(model, inputs([1, 2, 4]), True, 1)
+		self.assertEqual((2, 3), (cache.hits, cache.misses))
+		self.assertEqual([[[1, 2]], [[1, 2, 3]], [[1, 2, 4]]], calls)
+
+	def test_expand_cache(self):
+		import torch
+		from transformers import DynamicCache
+		from hf_generator import expand_cache
+
+		layer = (torch.arange(2.0).view(1, 1, 2, 1), torch.arange(2.0).view(1, 1, 2, 1) + 10)
+		legacy = expand_cache((layer,), 3)
+		self.assertEqual((3, 1, 2, 1), tuple(legacy[0][1].shape))
+		self.assertEqual([[10.0], [11.0]], legacy[0][1][2, 0].tolist())
+
+		cache = DynamicCache.from_legacy_cache((layer,))
+		expanded = expand_cache(cache, 3).to_legacy_cache()
+		self.assertEqual((3, 1, 2, 1), tuple(expanded[0][0].shape))
+		self.assertTrue(torch.equal(legacy[0][0], expanded[0][0]))
+		self.assertEqual((1, 1, 2, 1), tuple(cache.to_legacy_cache()[0][0].shape)) # The cached prefix is not modified
+		self.assertIsNot(cache, expand_cache(cache, 1))
+
+class TestIncrementalExtractor(unittest.TestCase):
+	def test_extractor(self):
+		from data_processor import PromptTuneProcessor
+		processor = PromptTuneProcessor(StubEncoder(), False, 1000, 2, "", '[]string{"', True, False)
+		extractor = processor.extractor()
+
+		self.assertEqual([], extractor.feed('a\\'))
+		self.assertEqual(['a"b'], extractor.feed('"b", "c'))
+		self.assertEqual(['c', 'd'], extractor.feed('"\n`d` "e'))
+		self.assertEqual([], extractor.feed('\n'))
+		self.assertEqual([], extractor.finish())
+
+		raw = 'a\\"b", "c"\n`d` "e\n'
+		self.assertEqual(processor.extract(raw), ['a"b', 'c', 'd'])
+
+		extractor = processor.extractor()
+		self.assertEqual([], extractor.feed('no seeds'))
+		self.assertEqual(['no seeds'], extractor.finish())
+
+class TestResponseCache(unittest.TestCase):
+	def setUp(self):
+		self.cache_dir = tempfile.TemporaryDirectory()
+
+	def test_cached_generator(self):
+		from cache import ResponseCache, CachedGenerator
+		generator = StubGenerator()
+		cached = CachedGenerator(generator, ResponseCache(self.cache_dir.name, 1024), "model", "}", {"n": 1})
+
+		self.assertEqual([(0, "output 1"), (1, "output 2")], list(cached.generate_batch([([1], []), ([2], [])])))
+		self.assertEqual([(0, "output 2"), (1, "output 3")], sorted(cached.generate_batch([([2], []), ([3], [])])))
+		self.assertEqual(["output 3"], list(cached.generate([3], [])))
+		self.assertEqual(2, generator.calls) # Last call only uses the cache
+		self.assertEqual((2, 3), (cached.cache.hits, cached.cache.misses))
+
+		# Different generation config is not cached
+		cached = CachedGenerator(generator, ResponseCache(self.cache_dir.name, 1024), "model", "}", {"n": 2})
+		self.assertEqual(["output 3"], list(cached.generate([3], [])))
+		self.assertEqual(3, generator.calls)
+
+	def test_repetitions(self):
+		from args import load_runs
+		from cache import ResponseCache, CachedGenerator
+		config = os.path.join(self.cache_dir.name, "temp_0.8.json")
+		with open(config, 'w') as f:
+			json.dump({"do_sample": True, "temperature": 0.8}, f)
+
+		generator = StubGenerator()
+		cache = ResponseCache(self.cache_dir.name, 1024)
+		for name, generate_args in load_runs([config], 2, 1):
+			list(CachedGenerator(generator, cache, "model", "}", generate_args, name).generate([1], []))
+		self.assertEqual((0, 2), (cache.hits, cache.misses)) # Each repetition samples its own outputs
+		self.assertEqual(2, generator.calls)
+
+		for name, generate_args in load_runs([config], 2, 1): # Rerunning the same repetitions uses the cache
+			list(CachedGenerator(generator, cache, "model", "}", generate_args, name).generate([1], []))
+		self.assertEqual((2, 2), (cache.hits, cache.misses))
+
+	def test_lru_eviction(self):
+		from cache import ResponseCache
+		cache = ResponseCache(self.cache_dir.name, 30)
+		cache.put("a", ["1234567890"])
+		cache.put("b", ["1234567890"])
+		cache.get("a")
+		cache.put("c", ["1234567890"]) # Evicts b
+		self.assertIsNone(cache.get("b"))
+		self.assertEqual(["1234567890"], cache.get("a"))
+		self.assertEqual(["1234567890"], cache.get("c"))
+
+	def tearDown(self):
+		self.cache_dir.cleanup()
+
+fake_parser = """#!/usr/bin/env python3
+import json, sys
+for line in sys.stdin:
+	request = json.loads(line)
+	if request["func"] == "Exit":
+		sys.exit(3)
+	print(json.dumps({"code": f"func {request['func']}() {{}} // {request['path']} {request['code_only']}"}), flush=True)
+"""
+
+class TestParserDaemon(unittest.TestCase):
+	def test_parse(self):
+		from data_processor import ParserDaemon
+		with tempfile.TemporaryDirectory() as tmp:
+			parser = os.path.join(tmp, "parser")
+			with open(parser, "w") as file:
+				file.write(fake_parser)
+			os.chmod(parser, 0o755)
+
+			daemon = ParserDaemon(parser)
+			self.assertEqual("func FuzzA() {} // . False", daemon.parse("FuzzA", False))
+			process = daemon.process
+			self.assertEqual("func FuzzB() {} // pkg True", daemon.parse("FuzzB", True, "pkg"))
+			self.assertIs(process, daemon.process) # Same process for all requests
+
+			with self.assertRaises(Exception):
+				daemon.parse("Exit", False)
+			self.assertEqual("func FuzzA() {} // . False", daemon.parse("FuzzA", False)) # Restarted
+			self.assertTrue(process.stdin.closed and process.stdout.closed) # Pipes of the exited process are released
+			daemon.close()
+			self.assertIsNone(daemon.process)
+
+class TestParserCache(unittest.TestCase):
+	def test_parse(self):
+		from data_processor import ParserCache
+		calls = []
+		def parse(func_name, code_only, pkg_path):
+			calls.append(func_name)
+			return f"func {func_name}() {{}}"
+
+		with tempfile.TemporaryDirectory() as tmp:
+			pkg = os.path.join(tmp, "pkg")
+			os.mkdir(pkg)
+			with open(os.path.join(pkg, "a.go"), "w") as file:
+				file.write("package a")
+
+			cache = ParserCache(os.path.join(tmp, "cache"), sys.executable, parse)
+			self.assertEqual("func FuzzA() {}", cache.parse("FuzzA", False, pkg))
+			self.assertEqual("func FuzzA() {}", cache.parse("FuzzA", False, pkg))
+			cache.parse("FuzzA", True, pkg)
+			self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+			with open(os.path.join(pkg, "notes.txt"), "w") as file: # Non-Go files are ignored
+				file.write("notes")
+			cache.parse("FuzzA", False, pkg)
+			self.assertEqual((2, 2), (cache.hits, cache.misses))
+
+			with open(os.path.join(pkg, "b_test.go"), "w") as file:
+				file.write("package a")
+			cache.parse("FuzzA", False, pkg)
+			self.assertEqual((2, 3), (cache.hits, cache.misses))
+			self.assertEqual(3, len(calls))
+
+fake_parser_all = """#!/usr/bin/env python3
+import json, sys
+print(json.dumps({
+	"chunks": ["```go\\n", "func FuzzA(f *testing.F) { parse() }\\n\\n", "func parse() {}\\n", "func FuzzB(f *testing.F) { parse() }\\n\\n", "```\\n"],
+	"targets": [{"func": "FuzzA", "chunks": [0, 1, 2, 4]}, {"func": "FuzzB", "chunks": [0, 3, 2, 4]}, {"func": "FuzzC", "error": "failed"}],
+}))
+"""
+
+class TestParserAll(unittest.TestCase):
+	def test_expand(self):
+		import argparse
+		from seedai import expand_targets
+		with tempfile.TemporaryDirectory() as tmp:
+			parser = os.path.join(tmp, "parser")
+			with open(parser, "w") as file:
+				file.write(fake_parser_all)
+			os.chmod(parser, 0o755)
+
+			args = argparse.Namespace(parser=parser, prompt_tuning=None)
+			targets = [{"path": "pkg", "func": "*", "corpus": "corpus", "fuzzer": None}, {"path": "pkg", "func": "FuzzD", "corpus": "d", "fuzzer": None}]
+			calls = []
+			def parse(func_name, code_only, pkg_path):
+				calls.append(func_name)
+				return f"func {func_name}() {{}}"
+
+			targets, parse = expand_targets(args, targets, parse)
+			self.assertEqual([("FuzzA", "corpus/FuzzA"), ("FuzzB", "corpus/FuzzB"), ("FuzzC", "corpus/FuzzC"), ("FuzzD", "d")],
+							 [(t['func'], t['corpus']) for t in targets])
+			self.assertEqual("```go\nfunc FuzzA(f *testing.F) { parse() }\n\nfunc parse() {}\n```", parse("FuzzA", False, "pkg"))
+			self.assertEqual("```go\nfunc FuzzB(f *testing.F) { parse() }\n\nfunc parse() {}\n```", parse("FuzzB", False, "pkg"))
+			self.assertEqual([], calls)
+			parse("FuzzC", False, "pkg") # Failed functions are parsed again on their own
+			parse("FuzzD", False, "pkg")
+			self.assertEqual(["FuzzC", "FuzzD"], calls)
+
+	def test_parser_cache(self):
+		import argparse
+		from data_processor import ParserCache
+		from seedai import expand_targets
+		with tempfile.TemporaryDirectory() as tmp:
+			parser = os.path.join(tmp, "parser")
+			with open(parser, "w") as file:
+				file.write(fake_parser_all)
+			os.chmod(parser, 0o755)
+			pkg = os.path.join(tmp, "pkg")
+			os.mkdir(pkg)
+
+			cache = ParserCache(os.path.join(tmp, "cache"), parser, None)
+			args = argparse.Namespace(parser=parser, prompt_tuning=None)
+			expand_targets(args, [{"path": pkg, "func": "*", "corpus": "corpus", "fuzzer": None}], cache.parse, cache)
+			self.assertEqual("```go\nfunc FuzzB(f *testing.F) { parse() }\n\nfunc parse() {}\n```", cache.parse("FuzzB", False, pkg))
+			self.assertEqual((1, 0), (cache.hits, cache.misses)) # Added by the -all call
+
+class TestLoadRuns(unittest.TestCase):
+	def test_runs(self):
+		from args import load_runs
+		with tempfile.TemporaryDirectory() as tmp:
+			configs = []
+			for name in ["a.json", "b.json"]:
+				configs.append(os.path.join(tmp, name))
+				with open(configs[-1], "w") as file:
+					json.dump({"temperature": 0.6}, file)
+
+			self.assertEqual([(None, {"temperature": 0.6, "n": 5})], load_runs(configs[:1], 1, 5))
+			self.assertEqual(["a.json", "b.json"], [name for name, _ in load_runs(configs, 1, 5)])
+			self.assertEqual(["a.json_1", "a.json_2", "b.json_1", "b.json_2"], [name for name, _ in load_runs(configs, 2, 5)])
+
+fake_fuzzer = """#!/usr/bin/env python3
+import os, shutil, sys
+# Every distinct seed containing "good" adds one coverage edge
+if sys.argv[1] == "-merge=1":
+	merged, corpus = sys.argv[-2], sys.argv[-1]
+	for name in os.listdir(corpus):
+		with open(os.path.join(corpus, name), "rb") as file:
+			if b"good" in file.read():
+				shutil.copy(os.path.join(corpus, name), merged)
+	sys.exit(0)
+good = 0
+for name in os.listdir(sys.argv[1]):
+	with open(os.path.join(sys.argv[1], name), "rb") as file:
+		good += b"good" in file.read()
+print(f"#2	INITED cov: {good} ft: {10*good} corp: 1/1b exec/s: 0", file=sys.stderr)
+"""
+
+class TestFeedbackLoop(unittest.TestCase):
+	def test_run(self):
+		from feedback import FeedbackLoop
+		with tempfile.TemporaryDirectory() as tmp:
+			fuzzer = os.path.join(tmp, "fuzzer")
+			with open(fuzzer, "w") as file:
+				file.write(fake_fuzzer)
+			os.chmod(fuzzer, 0o755)
+
+			corpus_dir = os.path.join(tmp, "corpus")
+			save_seeds(corpus_dir, ["good 1", "bad"])
+
+			rounds = []
+			def generate(i, examples):
+				rounds.append(examples)
+				if i < 3: # Two productive rounds, then only unproductive seeds
+					return save_seeds(corpus_dir, [f"good {i+1}", f"bad {i+1}"])
+				return save_seeds(corpus_dir, [f"bad {i+1}"])
+
+			history = FeedbackLoop(fuzzer, 0, 10).run(corpus_dir, generate)
+			self.assertEqual([(0, 1, 10), (2, 2, 20), (2, 3, 30), (1, 3, 30)], history)
+			self.assertEqual([b"good 1"], rounds[0])
+			self.assertEqual([b"good 1", b"good 2", b"good 3"], sorted(rounds[2]))
+
+	def test_examples_code(self):
+		from feedback import examples_code
+		self.assertIn('\t\t"a\\"b\\n",\n', examples_code([b'a"b\n']))
+
+fake_libfuzzer = """import os, sys
+print(f"files {len(os.listdir(sys.argv[1]))}", flush=True)
+open(os.path.join(sys.argv[1], "new"), "w").close() # libFuzzer adds new inputs to the corpus
+sys.stderr.write("INFO: Seed: 1\\n#2 INITED cov: 3 ft: 4 corp: 1/1b\\n#8 DONE cov: 5 ft: 6 corp: 2/2b\\n")
+"""
+
+class TestEvaluate(unittest.TestCase):
+	def test_fuzz(self):
+		sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "experiments", "libfuzzer"))
+		import evaluate
+		self.assertIsNone(evaluate.coverage_line("INFO: Seed: 1"))
+		self.assertRegex(evaluate.coverage_line("#2 INITED cov: 3 ft: 4 corp: 1/1b"), r"^[0-9-]+ [0-9:.]+,cov: 3,ft: 4\n$")
+
+		with tempfile.TemporaryDirectory() as tmp:
+			fuzzer = os.path.join(tmp, "libfuzzer")
+			with open(fuzzer, "w") as file:
+				file.write(f"#!{sys.executable}\n" + fake_libfuzzer)
+			os.chmod(fuzzer, 0o755)
+
+			runs = os.path.join(tmp, "results", "src", "config", "model")
+			for run in ["1", "2", "3", "4"]:
+				os.makedirs(os.path.join(runs, run))
+			save_seeds(os.path.join(runs, "1", "corpus"), ["a", "b"])
+			with open(os.path.join(runs, "1", "data.out"), "w") as file:
+				file.write("START: 1\nSEEDS: 2\nRUN: 2\nfiles 2\n") # Interrupted earlier run
+			with open(os.path.join(runs, "2", "cov.out"), "w") as file: # Already fuzzed
+				file.write("1,cov: 1,ft: 1\n")
+			save_seeds(os.path.join(runs, "4", "corpus.pack"), ["c"]) # Run 3 has no corpus
+
+			jobs = evaluate.find_jobs(os.path.join(tmp, "results"), ["src"], 1)
+			self.assertEqual([(os.path.join(tmp, "results", "src", "base", "1"), True), (os.path.join(runs, "1"), False), (os.path.join(runs, "4"), False)],
+							 [(job.run_dir, job.base) for job in jobs])
+
+			cpu = min(os.sched_getaffinity(0))
+			for job in jobs:
+				job.binary = lambda: fuzzer
+				self.assertEqual("DONE", evaluate.fuzz(job, cpu, 60, tmp))
+				with open(os.path.join(job.run_dir, "cov.out")) as file:
+					self.assertEqual([",cov: 3,ft: 4", ",cov: 5,ft: 6"], [line[line.index(","):].strip() for line in file])
+
+			data = {}
+			for job in jobs:
+				with open(os.path.join(job.run_dir, "data.out")) as file:
+					data[job.run_dir] = [line.split(":")[0] if ":" in line else line.strip() for line in file]
+			self.assertEqual(["START", "RUN", "files 0", "DONE"], data[jobs[0].run_dir])
+			self.assertEqual(["START", "SEEDS", "RUN", "files 2", "DONE"], data[jobs[1].run_dir]) # Output of the interrupted run is reset
+			self.assertEqual(["START", "RUN", "files 1", "DONE"], data[jobs[2].run_dir]) # Unpacked corpus
+			self.assertEqual(2, len(os.listdir(os.path.join(runs, "1", "corpus")))) # Fuzzed a copy of the corpus
+			self.assertEqual([], evaluate.find_jobs(os.path.join(tmp, "results"), ["src"], 1))
+
+	def test_timeout(self):
+		from unittest import mock
+		sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "experiments", "libfuzzer"))
+		import evaluate
+
+		with tempfile.TemporaryDirectory() as tmp:
+			fuzzer = os.path.join(tmp, "libfuzzer")
+			with open(fuzzer, "w") as file:
+				file.write(f"#!{sys.executable}\nimport time\ntime.sleep(1)\n")
+			os.chmod(fuzzer, 0o755)
+
+			cpu = min(os.sched_getaffinity(0))
+			job = evaluate.Job("src", os.path.join(tmp, "base", "1"), True)
+			job.binary = lambda: fuzzer
+			self.assertEqual("TIMEDOUT", evaluate.fuzz(job, cpu, 0.1, tmp))
+
+			errors = []
+			threading.excepthook, excepthook = errors.append, threading.excepthook
+			try: # The fuzzer exits between the poll and the kill of the timer
+				with mock.patch.object(evaluate.os, "killpg", side_effect=ProcessLookupError):
+					self.assertEqual("DONE", evaluate.fuzz(job, cpu, 0.1, tmp))
+			finally:
+				threading.excepthook = excepthook
+			self.assertEqual([], errors)
+
+class TestPackSource(unittest.TestCase):
+	source = "\n".join([
+		"```go",
+		"// FuzzParse fuzzes Parse",
+		"func FuzzParse(f *testing.F) { f.Fuzz(func(t *testing.T, s string) { Parse(s) }) }",
+		"",
+		"func unused() { return }",
+		"",
+		"func (p *Parser) Parse(s string) *Node { return helper(s) }",
+		"",
+		"type Node struct { a int }",
+		"",
+		"func helper(s string) *Node { return &Node{a: 1} }",
+		"```",
+	])
+
+	def test_call_distances(self):
+		from data_processor import split_chunks, call_distances
+		header, chunks, footer = split_chunks(self.source)
+		self.assertEqual(("```go\n", "```"), (header, footer))
+		self.assertEqual(5, len(chunks))
+		self.assertTrue(chunks[0].startswith("// FuzzParse"))
+		self.assertEqual([0, float('inf'), 1, 2, 2], call_distances(chunks, ["FuzzParse"]))
+		self.assertEqual(0, call_distances(chunks, ["helper"])[4])
+
+	def test_pack(self):
+		from data_processor import pack_source
+		self.assertEqual(self.source, pack_source(StubEncoder(), self.source, len(self.source)))
+
+		packed = pack_source(StubEncoder(), self.source, 220, ["FuzzParse"])
+		self.assertLessEqual(len(packed), 220)
+		self.assertIn("func FuzzParse", packed)
+		self.assertIn("type Node", packed) # Same distance as helper, but first in the parser output
+		self.assertNotIn("func helper", packed)
+		self.assertNotIn("func unused", packed)
+		self.assertTrue(packed.startswith("```go\n") and packed.endswith("\n```"))
+
+	def test_pack_multi_byte(self):
+		from data_processor import pack_source
+		class ByteEncoder(StubEncoder): # Byte-level BPE without merges, one token per byte
+			def encode(self, text, add_special_tokens=False):
+				return list(text.encode('utf-8'))
+
+		source = self.source.replace("return }", "return \"\u00e9\u00e9\u00e9\u00e9\u00e9\u00e9\u00e9\u00e9\" }")
+		packed = pack_source(ByteEncoder(), source, len(source)) # Fits in characters, but not in tokens
+		self.assertNotIn("func unused", packed)
+		self.assertLessEqual(len(ByteEncoder().encode(packed)), len(source))
+
+class CountingEncoder(StubEncoder):
+	def __init__(self):
+		self.calls = 0
+
+	def encode(self, text, truncation=False, max_length=-1, add_special_tokens=False):
+		self.calls += 1
+		if truncation:
+			return super().encode(text)[:max_length]
+		return super().encode(text)
+
+class TestTemplates(unittest.TestCase):
+	def test_template_tokens(self):
+		from data_processor import PromptTuneProcessor
+		tokenizer = CountingEncoder()
+		config = {"prefix": "P\n", "suffix": "\nS \"", "multi_vals": False, "code_only": False}
+		processor = PromptTuneProcessor(tokenizer, False, 100, 10, **config)
+		calls = tokenizer.calls
+		PromptTuneProcessor(tokenizer, False, 100, 10, **config)
+		self.assertEqual(calls, tokenizer.calls) # Prefix, suffix and check suffix are encoded once
+
+		input_ids, system_ids = processor.encode("code")
+		self.assertEqual(calls+1, tokenizer.calls) # Only the source code is encoded per target
+		self.assertEqual("P\ncode\nS \"", StubTokenizer().decode(input_ids))
+
+	def test_openai_messages(self):
+		from openai_generator import OpenAIGenerator
+		tokenizer = StubEncoder()
+		generator = OpenAIGenerator("gpt-4", tokenizer, "\n", False, temperature=1, top_p=1, n=1, repetition_penalty=0, presence_penalty=0)
+		system_ids = tokenizer.encode("Complete.")
+		args = generator.request_args(system_ids + tokenizer.encode("// Complete. the code"), system_ids)
+		self.assertEqual([
+			{"role": "system", "content": "Complete."},
+			{"role": "user", "content": "// Complete. the code"}, # The system prompt in the code is kept
+		], args["messages"])
+
+class SequenceGenerator:
+	n = 5
+	num_beams = 1
+
+	def generate_batch(self, prompts):
+		from metrics import metrics
+		metrics.add_time("decode", 0.5)
+		for i, (input_ids, _) in enumerate(prompts):
+			for s in range(self.n):
+				yield i, f"{input_ids[0]} {os.getpid()}"
+
+	def generate_stream(self, prompts):
+		for i, (input_ids, _) in enumerate(prompts):
+			for s in range(self.n):
+				yield i, i*self.n + s, f"{input_ids[0]}"
+
+class TorchGenerator(SequenceGenerator):
+	progress = True
+
+	def generate_batch(self, prompts):
+		import torch
+		x = torch.ones(256, 256)
+		for i, _ in enumerate(prompts):
+			for s in range(self.n):
+				yield i, (float((x @ x).sum()), torch.get_num_threads(), self.progress)
+
+class TestWorkerPool(unittest.TestCase):
+	def test_split_work(self):
+		from workers import split_work
+		self.assertEqual([[(0, 0, 3), (1, 0, 2)], [(0, 3, 2), (1, 2, 3)]], split_work(2, 5, 2, True))
+		self.assertEqual([[(0, 0, 1)], [(1, 0, 1)]], split_work(2, 1, 2, True))
+		self.assertEqual([[(0, 0, 4), (2, 0, 4)], [(1, 0, 4)]], split_work(3, 4, 2, False))
+
+	def test_generate(self):
+		from workers import WorkerPool
+		from metrics import metrics
+		from workers import split_work
+		pool = WorkerPool(SequenceGenerator(), min(2, len(os.sched_getaffinity(0))))
+		decode = (metrics.seconds("decode"), metrics.seconds("decode_wall"))
+		outputs = list(pool.generate_batch([([1], []), ([2], [])]))
+		batches = [len({count for _, _, count in items}) for items in split_work(2, 5, pool.workers, True)] # generate_batch calls per worker
+		self.assertEqual((decode[0] + 0.5*sum(batches), decode[1] + 0.5*max(batches)), (metrics.seconds("decode"), metrics.seconds("decode_wall")))
+		self.assertEqual([0]*5 + [1]*5, sorted(i for i, _ in outputs))
+		self.assertNotIn(str(os.getpid()), " ".join(output for _, output in outputs)) # Generated in the workers
+		self.assertEqual({(i, j) for i in range(2) for j in range(5)}, {(i, j) for i, j, _ in pool.generate_stream([([1], []), ([2], [])])})
+
+	@requires_torch
+	def test_fork_after_torch(self):
+		import torch
+		from workers import WorkerPool
+		torch.set_num_threads(len(os.sched_getaffinity(0)))
+		torch.ones(512, 512) @ torch.ones(512, 512) # Start the intra-op threads before forking
+
+		pool = WorkerPool(TorchGenerator(), min(2, len(os.sched_getaffinity(0))))
+		outputs = []
+		thread = threading.Thread(target=lambda: outputs.extend(output for _, output in pool.generate_batch([([1], []), ([2], [])])), daemon=True)
+		thread.start()
+		thread.join(60)
+		self.assertFalse(thread.is_alive(), "Workers hang after fork")
+		self.assertEqual({(256.0**3, len(cpus), False) for cpus in pool.cpus}, set(outputs)) # Own thread count, no progress
+
+class TestMetrics(unittest.TestCase):
+	def test_generate_seeds(self):
+		import argparse
+		from data_processor import PromptTuneProcessor
+		from metrics import metrics
+		from seedai import generate_seeds
+
+		processor = PromptTuneProcessor(StubEncoder(), False, 1000, 2, "", '[]string{"', True, False)
+		seeds = metrics.counters.get("seeds", 0)
+		extracts = metrics.stages.get("extract", {}).get("count", 0)
+		counts = [[0, 0], [0, 0]]
+		with tempfile.TemporaryDirectory() as corpus_dir:
+			generate_seeds(argparse.Namespace(shard=False, dedup=None), StubGenerator(), processor, [([1], []), ([1], [])], False,
+						   [corpus_dir, corpus_dir], counts)
+		self.assertEqual([[1, 1], [1, 0]], counts) # Same output for both prompts
+		self.assertEqual(seeds + 2, metrics.counters["seeds"])
+		self.assertEqual(extracts + 2, metrics.stages["extract"]["count"])
+
+	def test_report(self):
+		from metrics import Metrics
+		metrics = Metrics()
+		with metrics.stage("decode"):
+			pass
+		metrics.merge({"stages": {"decode": {"seconds": 2.0, "count": 1}}, "counters": {"generated_tokens": 10}})
+		metrics.add("seeds", 4)
+		self.assertAlmostEqual(5.0, metrics.report()["decode_tokens_per_second"], places=1)
+		metrics.merge({"stages": {"decode": {"seconds": 2.0, "count": 1}}, "counters": {"generated_tokens": 10}}) # Second worker
+		metrics.add_time("decode_wall", 2.0)
+		metrics.add("unique_seeds", 3)
+		metrics.record_run({"path": ".", "func": "Fuzz"}, None, 4, 3, 2.0)
+
+		with tempfile.TemporaryDirectory() as tmp:
+			path = os.path.join(tmp, "report.json")
+			metrics.write(path)
+			with open(path) as file:
+				report = json.load(file)
+		self.assertEqual(3, report["stages"]["decode"]["count"])
+		self.assertAlmostEqual(10.0, report["decode_tokens_per_second"]) # Aggregate over the workers
+		self.assertEqual(0.75, report["unique_ratio"])
+		self.assertEqual(2.0, report["runs"][0]["seeds_per_second"])
+		self.assertGreater(report["max_rss_bytes"], 0)
+
+class TestCorpusPack(unittest.TestCase):
+	def test_pack(self):
+		from corpus import PackReader, PackWriter, copy_seeds, read_seeds
+		with tempfile.TemporaryDirectory() as tmp:
+			path = os.path.join(tmp, "corpus.pack")
+			self.assertEqual(2, save_seeds(path, ["b", "a", "b"]))
+
+			writer = PackWriter(path)
+			self.assertEqual(1, writer.save(["a", "\u00ffc"]))
+			with PackReader(path) as reader: # Not flushed yet, the previous index is used
+				self.assertEqual(2, len(reader))
+			writer.close()
+
+			with PackReader(path) as reader:
+				self.assertEqual(3, len(reader))
+				sha1_hash = hashlib.sha1(b"\xc3\xbfc").hexdigest()
+				self.assertIn(sha1_hash, reader)
+				self.assertEqual(b"\xc3\xbfc", reader.get(sha1_hash))
+				self.assertIsNone(reader.get(hashlib.sha1(b"d").hexdigest()))
+				hashes = [h for h, _ in reader]
+				self.assertEqual(sorted(hashes), hashes)
+
+			flat_dir = os.path.join(tmp, "flat")
+			self.assertEqual(3, copy_seeds(path, flat_dir))
+			self.assertEqual(sorted(hashes), sorted(os.listdir(flat_dir)))
+			self.assertEqual(0, copy_seeds(flat_dir, path))
+			self.assertEqual(sorted(read_seeds(path)), sorted(read_seeds(flat_dir)))
+
+	def test_compact(self):
+		from corpus import PackReader, pack_entry, pack_header
+		with tempfile.TemporaryDirectory() as tmp:
+			path = os.path.join(tmp, "corpus.pack")
+			for i in range(50):
+				self.assertEqual(20, save_seeds(path, [f"seed {i} {j}" for j in range(20)]))
+
+			with PackReader(path) as reader:
+				self.assertEqual(1000, len(reader))
+				self.assertEqual(b"seed 49 19", reader.get(hashlib.sha1(b"seed 49 19").hexdigest()))
+				live_bytes = sum(len(content) for _, content in reader) + len(reader)*pack_entry.size
+			self.assertLessEqual(os.path.getsize(path), pack_header.size + 2*live_bytes) # Old indexes are reclaimed
+			self.assertEqual([], [name for name in os.listdir(tmp) if name.endswith(".tmp")])
+
+			with open(path, "wb") as file:
+				file.write(b"SEEDPACK")
+			with self.assertRaisesRegex(Exception, "Invalid corpus pack"):
+				PackReader(path)
+
+class TestNearDuplicateFilter(unittest.TestCase):
+	def test_filter(self):
+		from dedup import NearDuplicateFilter, lsh_bands
+		self.assertEqual((16, 4), lsh_bands(64, 0.8))
+		self.assertEqual((8, 8), lsh_bands(64, 0.9))
+
+		near_filter = NearDuplicateFilter(0.8)
+		seed = "GET /index.html HTTP/1.1 Host: example.com"
+		seeds = [seed, "GET  /index.html HTTP/1.1\tHost: example.com", "GET /index.html HTTP/1.1 Host: examplx.com", "POST /api/v1/users HTTP/2", "a", "b"]
+		self.assertEqual([seed, "POST /api/v1/users HTTP/2", "a", "b"], near_filter.filter(seeds))
+		self.assertEqual(2, near_filter.rejected)
+		self.assertEqual(4*near_filter.bins, len(near_filter.signatures)) # Constant size per seed
+
+		seeds = [f"seed {i} {hashlib.sha1(str(i).encode()).hexdigest()}" for i in range(2000)]
+		self.assertEqual(2000, len(near_filter.filter(seeds)))
+		self.assertEqual([], near_filter.filter([seed + " " for seed in seeds[:10]])) # Found after the bucket table grew
+		self.assertLessEqual(len(near_filter.buckets), 3*near_filter.entries) # 4 bytes per slot at a load of at least 1/3
+
+	def test_chained_buckets(self):
+		from dedup import NearDuplicateFilter
+		near_filter = NearDuplicateFilter(0.8)
+		near_filter.sketch = lambda signature: signature # Add signatures directly
+		self.assertEqual((16, 4), (near_filter.bands, near_filter.rows))
+
+		a = bytes(range(64))
+		b = a[:4] + bytes(x + 100 for x in a[4:52]) + a[52:] # Shares bands 0 and 13-15 with a, not similar
+		c = bytes(x + 1 if 4 <= k < 52 and k % 4 == 0 else x for k, x in enumerate(b)) # Similar to b, one bin off in bands 1-12
+		self.assertTrue(near_filter.add(a))
+		self.assertTrue(near_filter.add(b))
+		self.assertEqual([1, 0], list(near_filter.candidates(0, a[:4])))
+		self.assertFalse(near_filter.add(c)) # Only found through the bands b shares with a
+
+	def test_corpus(self):
+		from corpus import near_duplicates
+		from dedup import get_filter
+		with tempfile.TemporaryDirectory() as corpus_dir:
+			save_seeds(corpus_dir, ["<a href=\"x\">y</a>", "<a href=\"x\">y</a> ", "NL91ABNA0417164300"])
+			self.assertEqual(1, len(near_duplicates(corpus_dir, 0.8)))
+			self.assertEqual([], get_filter(corpus_dir, 0.8).filter(["<a  href=\"x\">y</a>"]))
+			self.assertEqual(["NL20INGB0001234567"], get_filter(corpus_dir, 0.8).filter(["NL20INGB0001234567"]))
+
+class TestImports(unittest.TestCase):
+	def test_lazy_backends(self):
+		# Importing seedai (e.g. for --help or OpenAI-only runs) must not load the model backends
+		code = "import sys, seedai, openai_async; print(','.join(m for m in ['torch', 'transformers', 'peft', 'openai', 'tiktoken'] if m in sys.modules))"
+		result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+		self.assertEqual(0, result.returncode, result.stderr)
+		self.assertEqual("", result.stdout.strip())
+
+	def test_init_loaders(self):
+		import argparse
+		from unittest import mock
+		import init
+		from data_processor import FineTuneProcessor
+
+		loaded = []
+		class OpenAITokenizer(StubEncoder):
+			model_max_length = 1000
+			def __init__(self, name, legacy):
+				loaded.append(name)
+
+		args = argparse.Namespace(model="gpt-4", type=init.TYPE_CAUSAL, legacy=False, length=0, prompt_tuning=None,
+								  gen_length=100, pt_count=10, split="\n\n###\n\n")
+		with mock.patch.object(init, "OpenAITokenizer", OpenAITokenizer), mock.patch.dict(init.tokenizers, clear=True), mock.patch.dict(init.processors, clear=True):
+			tokenizer, isOpenAI, seq2seq = init.tokenizer(args)
+			self.assertIsInstance(tokenizer, OpenAITokenizer)
+			self.assertEqual((True, False), (isOpenAI, seq2seq))
+			self.assertIs(tokenizer, init.tokenizer(args)[0]) # Loaded once per model
+			self.assertEqual(["gpt-4"], loaded)
+
+			processor = init.processor(args, seq2seq, tokenizer, isOpenAI)
+			self.assertIsInstance(processor, FineTuneProcessor)
+			self.assertEqual(1000 - 100 - 11, processor.max_encode_length) # Generation length and OpenAI role tokens reserved
+			self.assertIs(processor, init.processor(args, seq2seq, tokenizer, isOpenAI))
+
 if __name__ == '__main__':
 	unittest.main()
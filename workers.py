@@ -0,0 +1,158 @@
+import multiprocessing
+import os
+import queue
+import sys
+
+from metrics import metrics
+
+def cpu_groups(workers: int) -> list[set[int]]:
+	"""
+	Split the available CPUs into one group per worker, CPUs of the same socket are kept together.
+	"""
+
+	def package(cpu):
+		try:
+			with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id") as file:
+				return int(file.read())
+		except (OSError, ValueError):
+			return 0
+
+	cpus = sorted(os.sched_getaffinity(0), key=lambda cpu: (package(cpu), cpu))
+	if workers > len(cpus):
+		raise Exception(f"More workers than CPUs ({len(cpus)})")
+
+	size, extra = divmod(len(cpus), workers)
+	groups = []
+	start = 0
+	for w in range(workers):
+		end = start + size + (1 if w < extra else 0)
+		groups.append(set(cpus[start:end]))
+		start = end
+	return groups
+
+def split_work(prompts: int, n: int, workers: int, split_sequences: bool) -> list[list[tuple]]:
+	"""
+	Returns the (prompt index, sequence offset, count) items of each worker.
+	Sequences of a prompt are split over the workers, unless split_sequences is False (beam search) and
+	the prompts are divided instead. Extra sequences go to different workers for consecutive prompts.
+	"""
+
+	work = [[] for _ in range(workers)]
+	for i in range(prompts):
+		if not split_sequences:
+			work[i % workers].append((i, 0, n))
+			continue
+
+		size, extra = divmod(n, workers)
+		offset = 0
+		for w in range(workers):
+			count = size + (1 if (w - i) % workers < extra else 0)
+			if count > 0:
+				work[w].append((i, offset, count))
+			offset += count
+	return work
+
+class WorkerPool:
+	"""
+	Wrapper for HFGenerator that generates in forked worker processes, each pinned to its own CPUs (socket).
+	The workers share the loaded model weights copy-on-write and only send their outputs to the parent,
+	which stays the single process that extracts and saves (dedups) the seeds.
+	The workers are forked after torch ran on its intra-op threads in the parent. Only the forking thread exists in a worker,
+	which sets its thread count before its first torch op, so torch starts a new pool of that size in the worker
+	(see TestWorkerPool.test_fork_after_torch). Spawned workers would need the weights in shared memory (share_memory()),
+	a copy in /dev/shm that is often too small in containers.
+	"""
+
+	def __init__(self, generator, workers: int):
+		self.generator = generator
+		self.workers = workers
+		self.cpus = cpu_groups(workers)
+
+	def generate(self, input_ids, system_ids):
+		for _, output in self.generate_batch([(input_ids, system_ids)]):
+			yield output
+
+	def generate_batch(self, prompts):
+		for i, _, output in self.run(prompts, False):
+			yield i, output
+
+	def generate_stream(self, prompts):
+		for i, j, text in self.run(prompts, True):
+			yield i, j, text
+
+	def run(self, prompts, stream: bool):
+		work = split_work(len(prompts), self.generator.n, self.workers, self.generator.num_beams == 1)
+		context = multiprocessing.get_context("fork") # Fork to share the model without copying or pickling it
+		results = context.Queue()
+		processes = []
+		for w in range(self.workers):
+			if len(work[w]) == 0:
+				continue
+			process = context.Process(target=self.work, args=(w, prompts, work[w], stream, results), daemon=True)
+			process.start()
+			processes.append((w, process))
+
+		done = set()
+		decode = [0.0] # Decode seconds of each worker
+		try:
+			while len(done) < len(processes):
+				try:
+					w, item = results.get(timeout=1)
+				except queue.Empty:
+					for w, process in processes:
+						if w not in done and process.exitcode not in (None, 0):
+							raise Exception(f"Worker {w} exited with code {process.exitcode}")
+					continue
+
+				if item is None:
+					done.add(w)
+				elif isinstance(item, dict):
+					metrics.merge(item)
+					decode.append(item["stages"].get("decode", {}).get("seconds", 0.0))
+				elif isinstance(item, str):
+					raise Exception(f"Worker {w} failed: {item}")
+				else:
+					yield item
+
+			metrics.add_time("decode_wall", max(decode)) # The workers decode in parallel
+		finally:
+			for _, process in processes:
+				if process.is_alive():
+					process.terminate()
+				process.join()
+
+	def work(self, w: int, prompts, items: list[tuple], stream: bool, results):
+		"""
+		Worker process: generate the items and send (prompt index, sequence index, output) tuples, an error message,
+		its metrics (stage times and tokens, summed over the workers in the parent) and None when done.
+		"""
+
+		metrics.stages, metrics.counters = {}, {} # Only send the metrics of this worker
+		self.generator.progress = False # Progress lines of the workers would interleave
+		try:
+			os.sched_setaffinity(0, self.cpus[w])
+			if "torch" in sys.modules: # Loaded by the HuggingFace generator
+				torch = sys.modules["torch"]
+				torch.set_num_threads(len(self.cpus[w]))
+				torch.seed() # Forked workers inherit the random state, reseed so they do not sample the same sequences
+
+			counts = {} # Prompts with the same number of sequences are generated in one batch
+			for i, offset, count in items:
+				counts.setdefault(count, []).append((i, offset))
+
+			for count, batch in counts.items():
+				self.generator.n = count
+				batch_prompts = [prompts[i] for i, _ in batch]
+				if stream:
+					for k, j, text in self.generator.generate_stream(batch_prompts):
+						i, offset = batch[k]
+						results.put((w, (i, offset + j % count, text)))
+				else:
+					for k, output in self.generator.generate_batch(batch_prompts):
+						i, _ = batch[k]
+						results.put((w, (i, None, output)))
+		except Exception as e:
+			results.put((w, str(e) or repr(e)))
+		finally:
+			results.put((w, {"stages": metrics.stages, "counters": metrics.counters}))
+			results.put((w, None))